@@ -0,0 +1,291 @@
+"""
+Контроль допуска запросов к LLM по приоритетам
+Все вызовы OllamaModelClient проходят через локальный контроллер хоста:
+классы interactive / pipeline / batch получают свои лимиты одновременных
+запросов, свободный слот достается самому приоритетному ожидающему классу,
+внутри класса — по кругу между владельцами (сессиями, воркерами), чтобы один
+длинный пакет не занимал очередь целиком. Пакетные запросы откладываются,
+пока идет интерактивная работа, и их можно отменить
+
+Настройка (переменные окружения):
+    OLLAMA_NUM_PARALLEL          — слотов на хост (по умолчанию 4)
+    ADMISSION_PIPELINE_SLOTS     — максимум для pipeline (по умолчанию все, кроме резерва)
+    ADMISSION_BATCH_SLOTS        — максимум для batch (по умолчанию половина)
+    ADMISSION_INTERACTIVE_RESERVE — слоты, которые batch/pipeline не занимают (1)
+    ADMISSION_INTERACTIVE_GRACE  — сколько секунд после интерактивного запроса
+                                   batch ограничен одним слотом (30)
+    ADMISSION=0                  — отключить
+"""
+
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional
+
+ENABLED = os.getenv("ADMISSION", "1") != "0"
+
+# Классы в порядке приоритета (значения совпадают с llm_client.INTERACTIVE/PIPELINE/BATCH)
+PRIORITY = ("interactive", "pipeline", "batch")
+
+DEFAULT_SLOTS = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+
+
+class AdmissionCancelled(Exception):
+    """Ожидающий запрос отменен (cancel_pending)"""
+
+
+class AdmissionTimeout(Exception):
+    """Слот не освободился за отведенное время"""
+
+
+# Владелец запросов внутри класса (сессия, задача пакета); по умолчанию — поток
+_tenant: ContextVar[Optional[str]] = ContextVar("admission_tenant", default=None)
+
+
+@contextmanager
+def tenant(name: str):
+    """
+    Задать владельца запросов для справедливой очереди внутри класса
+
+    Пример:
+        with tenant("nightly-review"), request_class(BATCH):
+            batcher.map(prompts)
+    """
+    token = _tenant.set(name)
+    try:
+        yield
+    finally:
+        _tenant.reset(token)
+
+
+@dataclass(eq=False)
+class Ticket:
+    request_class: str
+    tenant: str
+    created: float = field(default_factory=time.monotonic)
+    event: threading.Event = field(default_factory=threading.Event)
+    cancelled: bool = False
+
+
+@dataclass
+class ClassStats:
+    admitted: int = 0
+    cancelled: int = 0
+    timeouts: int = 0
+    waits: Deque[float] = field(default_factory=lambda: deque(maxlen=500))
+
+
+class AdmissionController:
+    """
+    Допуск запросов к одному хосту Ollama
+
+    Args:
+        slots: Всего одновременных запросов (по числу слотов сервера)
+        class_slots: Максимум одновременных запросов по классам
+        interactive_reserve: Слотов, недоступных pipeline и batch
+        interactive_grace: После интерактивного запроса batch в течение
+            стольких секунд получает не больше одного слота
+    """
+
+    def __init__(self, slots: int = DEFAULT_SLOTS, class_slots: Optional[Dict[str, int]] = None,
+                 interactive_reserve: Optional[int] = None, interactive_grace: Optional[float] = None):
+        self.slots = max(1, slots)
+        reserve = interactive_reserve if interactive_reserve is not None else \
+            int(os.getenv("ADMISSION_INTERACTIVE_RESERVE", "1"))
+        self.interactive_reserve = min(reserve, self.slots - 1)
+        self.interactive_grace = interactive_grace if interactive_grace is not None else \
+            float(os.getenv("ADMISSION_INTERACTIVE_GRACE", "30"))
+        defaults = {
+            "interactive": self.slots,
+            "pipeline": int(os.getenv("ADMISSION_PIPELINE_SLOTS", str(self.slots))),
+            "batch": int(os.getenv("ADMISSION_BATCH_SLOTS", str(max(1, self.slots // 2)))),
+        }
+        self.class_slots = {**defaults, **(class_slots or {})}
+        self._lock = threading.Lock()
+        # класс -> владелец -> очередь билетов (OrderedDict — для обхода по кругу)
+        self._queues: Dict[str, "OrderedDict[str, Deque[Ticket]]"] = {name: OrderedDict() for name in PRIORITY}
+        self._active = {name: 0 for name in PRIORITY}
+        self._last_interactive = float("-inf")
+        self._stats = {name: ClassStats() for name in PRIORITY}
+
+    # ---------- правила ----------
+
+    def _limit_locked(self, request_class: str) -> int:
+        limit = self.class_slots[request_class]
+        if request_class != "interactive":
+            limit = min(limit, self.slots - self.interactive_reserve)
+        if request_class == "batch" and (
+            self._waiting_locked("interactive")
+            or time.monotonic() - self._last_interactive < self.interactive_grace
+        ):
+            # Идет интерактивная работа — пакет откладывается до одного слота
+            limit = min(limit, 1)
+        return limit
+
+    def _waiting_locked(self, request_class: str) -> int:
+        return sum(len(queue) for queue in self._queues[request_class].values())
+
+    def _can_start_locked(self, request_class: str) -> bool:
+        return sum(self._active.values()) < self.slots and self._active[request_class] < self._limit_locked(request_class)
+
+    def _dispatch_locked(self):
+        """Раздать свободные слоты: по приоритету классов, внутри класса — по кругу владельцев"""
+        for request_class in PRIORITY:
+            queues = self._queues[request_class]
+            while queues and self._can_start_locked(request_class):
+                owner, queue = next(iter(queues.items()))
+                ticket = queue.popleft()
+                if queue:
+                    queues.move_to_end(owner)
+                else:
+                    del queues[owner]
+                self._start_locked(ticket)
+            # Если класс уперся в свой лимит, свободные слоты достаются следующему
+
+    def _start_locked(self, ticket: Ticket):
+        self._active[ticket.request_class] += 1
+        stats = self._stats[ticket.request_class]
+        stats.admitted += 1
+        stats.waits.append(time.monotonic() - ticket.created)
+        ticket.event.set()
+
+    def _remove_locked(self, ticket: Ticket) -> bool:
+        queues = self._queues[ticket.request_class]
+        queue = queues.get(ticket.tenant)
+        if queue is None or ticket not in queue:
+            return False
+        queue.remove(ticket)
+        if not queue:
+            del queues[ticket.tenant]
+        return True
+
+    # ---------- API ----------
+
+    def acquire(self, request_class: str, owner: Optional[str] = None, timeout: Optional[float] = None) -> Ticket:
+        """
+        Дождаться слота
+
+        Raises:
+            AdmissionTimeout: слот не освободился за timeout
+            AdmissionCancelled: запрос отменен через cancel_pending
+        """
+        request_class = request_class if request_class in PRIORITY else "pipeline"
+        ticket = Ticket(request_class, owner or _tenant.get() or threading.current_thread().name)
+        with self._lock:
+            if request_class == "interactive":
+                self._last_interactive = time.monotonic()
+            if not self._queues[request_class] and self._can_start_locked(request_class):
+                self._start_locked(ticket)
+                return ticket
+            self._queues[request_class].setdefault(ticket.tenant, deque()).append(ticket)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not ticket.event.wait(0.5):
+            with self._lock:
+                # Окно grace для batch истекает без событий — перераздать слоты
+                self._dispatch_locked()
+                if ticket.event.is_set():
+                    break
+                if deadline is not None and time.monotonic() >= deadline and self._remove_locked(ticket):
+                    self._stats[request_class].timeouts += 1
+                    raise AdmissionTimeout(f"Нет свободного слота для {request_class} за {timeout}s")
+        if ticket.cancelled:
+            raise AdmissionCancelled(f"Запрос {request_class} ({ticket.tenant}) отменен")
+        return ticket
+
+    def release(self, ticket: Ticket):
+        with self._lock:
+            self._active[ticket.request_class] -= 1
+            self._dispatch_locked()
+
+    @contextmanager
+    def slot(self, request_class: str, owner: Optional[str] = None, timeout: Optional[float] = None):
+        """Слот на время блока (см. acquire)"""
+        if not ENABLED:
+            yield None
+            return
+        ticket = self.acquire(request_class, owner, timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def cancel_pending(self, request_class: str = "batch", owner: Optional[str] = None) -> int:
+        """
+        Отменить ожидающие запросы класса (или одного владельца)
+
+        Уже выполняющиеся запросы дорабатывают: генерация на сервере
+        не прерывается, освобождается только очередь.
+
+        Returns:
+            Число отмененных запросов
+        """
+        with self._lock:
+            queues = self._queues[request_class]
+            owners = [owner] if owner is not None else list(queues)
+            cancelled: List[Ticket] = []
+            for name in owners:
+                cancelled.extend(queues.pop(name, ()))
+            for ticket in cancelled:
+                ticket.cancelled = True
+                ticket.event.set()
+            self._stats[request_class].cancelled += len(cancelled)
+            self._dispatch_locked()
+        return len(cancelled)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            status: Dict[str, Any] = {"slots": self.slots, "in_use": sum(self._active.values())}
+            for name in PRIORITY:
+                stats = self._stats[name]
+                waits = sorted(stats.waits)
+                status[name] = {
+                    "active": self._active[name],
+                    "waiting": self._waiting_locked(name),
+                    "limit_now": self._limit_locked(name),
+                    "admitted": stats.admitted,
+                    "cancelled": stats.cancelled,
+                    "timeouts": stats.timeouts,
+                    "wait_p50_s": round(waits[len(waits) // 2], 3) if waits else 0.0,
+                    "wait_p95_s": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0.0,
+                }
+            return status
+
+
+_controllers: Dict[str, AdmissionController] = {}
+_controllers_lock = threading.Lock()
+
+
+def get_controller(base_url: str) -> AdmissionController:
+    """Контроллер хоста (общий для всех агентов процесса)"""
+    key = base_url.rstrip("/").removesuffix("/v1")
+    with _controllers_lock:
+        if key not in _controllers:
+            _controllers[key] = AdmissionController()
+        return _controllers[key]
+
+
+def cancel_batch(owner: Optional[str] = None) -> int:
+    """Отменить ожидающие пакетные запросы на всех хостах"""
+    with _controllers_lock:
+        controllers = list(_controllers.values())
+    return sum(controller.cancel_pending("batch", owner) for controller in controllers)
+
+
+def admission_status() -> Dict[str, Dict[str, Any]]:
+    with _controllers_lock:
+        controllers = dict(_controllers)
+    return {host: controller.status() for host, controller in controllers.items()}
+
+
+# Номера для имен владельцев по умолчанию в пакетной обработке
+_batch_ids = itertools.count(1)
+
+
+def next_batch_tenant(prefix: str = "batch") -> str:
+    return f"{prefix}-{next(_batch_ids)}"
@@ -0,0 +1,395 @@
+"""
+Выбор затронутых тестов и долгоживущий Vitest для кода, созданного агентами
+Измененные файлы сопоставляются с проектами Nx (graph.json / project.json),
+и запускаются только связанные тесты в прогретом Vitest-воркере
+"""
+
+import atexit
+import itertools
+import json
+import os
+import queue
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+WORKER_SCRIPT = Path(__file__).resolve().parent / "vitest_worker.mjs"
+WORKER_MARKER = "@@VITEST_WORKER@@ "
+
+TEST_SUFFIXES = (".spec.ts", ".test.ts", ".spec.tsx", ".test.tsx", ".spec.js", ".test.js")
+VITEST_CONFIGS = ("vitest.config.ts", "vitest.config.mts", "vitest.config.js")
+# Проекты на Jest: корневой vitest.config.ts их исключает, воркер их не запускает
+JEST_CONFIGS = ("jest.config.ts", "jest.config.js", "jest.config.mjs", "jest.config.cjs")
+SKIP_DIRS = {"node_modules", "dist", "coverage", ".git", ".nx", ".angular"}
+
+# Сколько ждать ответа Vitest-воркера: запуск (прогрев) и один прогон тестов, сек
+VITEST_START_TIMEOUT = float(os.getenv("VITEST_START_TIMEOUT", "120"))
+VITEST_RUN_TIMEOUT = float(os.getenv("VITEST_RUN_TIMEOUT", "600"))
+
+
+# ============================================
+# ГРАФ ПРОЕКТОВ NX
+# ============================================
+
+@dataclass
+class Project:
+    name: str
+    root: str
+    dependencies: Set[str] = field(default_factory=set)
+
+
+class ProjectGraph:
+    """Проекты Nx и зависимости между ними"""
+
+    def __init__(self, projects: Dict[str, Project]):
+        self.projects = projects
+        self._dependents: Dict[str, Set[str]] = {name: set() for name in projects}
+        for project in projects.values():
+            for dependency in project.dependencies:
+                self._dependents.setdefault(dependency, set()).add(project.name)
+
+    @classmethod
+    def load(cls, repo_root: Path = REPO_ROOT) -> "ProjectGraph":
+        """
+        Загрузить граф: зависимости из graph.json (`nx graph --file=graph.json`),
+        корни проектов — из актуальных project.json
+        """
+        projects: Dict[str, Project] = {}
+        # graph.json не отслеживается git: в worktree агентов берется из основного дерева
+        graph_file = repo_root / "graph.json" if (repo_root / "graph.json").exists() else REPO_ROOT / "graph.json"
+        if graph_file.exists():
+            graph = json.loads(graph_file.read_text())["graph"]
+            for name, node in graph["nodes"].items():
+                projects[name] = Project(name=name, root=node["data"].get("root", ""))
+            for name, dependencies in graph.get("dependencies", {}).items():
+                if name in projects:
+                    projects[name].dependencies = {d["target"] for d in dependencies if d["target"] in graph["nodes"]}
+
+        for directory in ("apps", "libs"):
+            for dirpath, dirnames, filenames in os.walk(repo_root / directory):
+                dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+                if "project.json" not in filenames:
+                    continue
+                data = json.loads((Path(dirpath) / "project.json").read_text())
+                name = data.get("name") or Path(dirpath).name
+                root = os.path.relpath(dirpath, repo_root).replace(os.sep, "/")
+                project = projects.setdefault(name, Project(name=name, root=root))
+                project.root = root
+                project.dependencies |= set(data.get("implicitDependencies", []))
+        return cls(projects)
+
+    def owner(self, path: str) -> Optional[Project]:
+        """Проект, которому принадлежит файл (по самому длинному корню)"""
+        best = None
+        for project in self.projects.values():
+            root = project.root.rstrip("/")
+            if root and (path == root or path.startswith(root + "/")):
+                if best is None or len(root) > len(best.root):
+                    best = project
+        return best
+
+    def dependents(self, names: Iterable[str]) -> Set[str]:
+        """Все проекты, транзитивно зависящие от указанных"""
+        result: Set[str] = set()
+        stack = list(names)
+        while stack:
+            for dependent in self._dependents.get(stack.pop(), ()):
+                if dependent not in result:
+                    result.add(dependent)
+                    stack.append(dependent)
+        return result
+
+
+def _test_files(repo_root: Path, directory: str) -> List[str]:
+    files = []
+    for dirpath, dirnames, filenames in os.walk(repo_root / directory):
+        dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+        for name in filenames:
+            if name.endswith(TEST_SUFFIXES):
+                files.append(os.path.relpath(os.path.join(dirpath, name), repo_root).replace(os.sep, "/"))
+    return sorted(files)
+
+
+def _related_tests(repo_root: Path, changed: str) -> List[str]:
+    """Тесты рядом с измененным файлом: foo.service.ts → foo.service.spec.ts"""
+    if changed.endswith(TEST_SUFFIXES):
+        return [changed] if (repo_root / changed).exists() else []
+    stem, _ = os.path.splitext(changed)
+    directory, base = os.path.split(stem)
+    candidates = [f"{stem}{suffix}" for suffix in TEST_SUFFIXES]
+    candidates += [f"{directory}/__tests__/{base}{suffix}" for suffix in TEST_SUFFIXES]
+    return [c for c in candidates if (repo_root / c).exists()]
+
+
+@dataclass
+class TestSelection:
+    projects: Dict[str, List[str]]   # проект → тестовые файлы
+    changed: List[str]
+
+    @property
+    def files(self) -> List[str]:
+        return sorted({f for files in self.projects.values() for f in files})
+
+
+def select_tests(changed: Iterable[str], graph: Optional[ProjectGraph] = None,
+                 include_dependents: bool = True, repo_root: Path = REPO_ROOT) -> TestSelection:
+    """
+    Выбрать тесты, затронутые изменениями
+
+    Args:
+        changed: Измененные файлы (относительно корня репозитория)
+        graph: Граф проектов (по умолчанию загружается)
+        include_dependents: Добавить тесты проектов, зависящих от измененных
+
+    Returns:
+        Для измененных проектов — тесты рядом с измененными файлами (или все
+        тесты проекта, если таких нет); для зависимых — все тесты проекта
+    """
+    graph = graph or ProjectGraph.load(repo_root)
+    changed = [c for c in changed if c.endswith((".ts", ".tsx", ".js", ".json"))]
+    selected: Dict[str, Set[str]] = {}
+    direct: Set[str] = set()
+    for path in changed:
+        project = graph.owner(path)
+        if project is None:
+            continue
+        direct.add(project.name)
+        selected.setdefault(project.name, set()).update(_related_tests(repo_root, path))
+    for name in direct:
+        if not selected[name]:
+            selected[name].update(_test_files(repo_root, graph.projects[name].root))
+    if include_dependents:
+        for name in graph.dependents(direct) - direct:
+            selected[name] = set(_test_files(repo_root, graph.projects[name].root))
+    return TestSelection(projects={k: sorted(v) for k, v in selected.items() if v}, changed=changed)
+
+
+def git_changed_files(repo_root: Path = REPO_ROOT) -> List[str]:
+    """Файлы, измененные или созданные относительно HEAD (включая неотслеживаемые)"""
+    result = subprocess.run(
+        ["git", "status", "--porcelain", "-z", "--untracked-files=all"],
+        cwd=repo_root, capture_output=True, text=True, check=True,
+    )
+    files = []
+    records = iter(result.stdout.split("\0"))
+    for record in records:
+        if not record:
+            continue
+        status, path = record[:2], record[3:]
+        if "R" in status:
+            next(records, None)
+        if "D" not in status:
+            files.append(path)
+    return files
+
+
+def create_worktree(name: str, repo_root: Path = REPO_ROOT) -> Path:
+    """
+    Отдельное рабочее дерево (git worktree от HEAD) в .cache/worktrees
+
+    Лежит внутри репозитория, поэтому node_modules находится по родительским
+    каталогам и Vitest в нем работает без установки зависимостей.
+    """
+    path = repo_root / ".cache" / "worktrees" / name
+    if path.exists():
+        remove_worktree(path, repo_root)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    subprocess.run(["git", "worktree", "add", "--detach", str(path), "HEAD"],
+                   cwd=repo_root, capture_output=True, text=True, check=True)
+    return path
+
+
+def remove_worktree(path: Path, repo_root: Path = REPO_ROOT):
+    subprocess.run(["git", "worktree", "remove", "--force", str(path)], cwd=repo_root, capture_output=True)
+    subprocess.run(["git", "worktree", "prune"], cwd=repo_root, capture_output=True)
+
+
+# ============================================
+# VITEST-ВОРКЕР
+# ============================================
+
+class VitestWorker:
+    """
+    Node-процесс с прогретым Vitest для одного vitest.config
+
+    Stdout читает отдельный поток, поэтому ожидание ответа ограничено
+    таймаутом: зависший воркер (или ответ с нераспознанным id) завершается,
+    и следующий get_worker запускает новый.
+    """
+
+    def __init__(self, config: Optional[str], repo_root: Path = REPO_ROOT):
+        self.config = config
+        command = ["node", str(WORKER_SCRIPT), "--root", str(repo_root)]
+        if config:
+            command += ["--config", config]
+        self.process = subprocess.Popen(
+            command, cwd=repo_root, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, text=True, bufsize=1,
+        )
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._messages: "queue.Queue[Optional[Dict]]" = queue.Queue()
+        threading.Thread(target=self._reader, name="vitest-reader", daemon=True).start()
+        self._read_message(VITEST_START_TIMEOUT)  # {"ready": true}
+
+    def _reader(self):
+        for line in self.process.stdout:
+            if line.startswith(WORKER_MARKER):
+                try:
+                    self._messages.put(json.loads(line[len(WORKER_MARKER):]))
+                except ValueError:
+                    continue
+        self._messages.put(None)
+
+    def _read_message(self, timeout: float) -> Dict:
+        try:
+            message = self._messages.get(timeout=max(0.0, timeout))
+        except queue.Empty:
+            self.process.kill()
+            self.process.wait()
+            raise TimeoutError(f"Vitest-воркер не ответил за {timeout:.0f}s") from None
+        if message is None:
+            raise RuntimeError(f"Vitest-воркер завершился (код {self.process.poll()})")
+        return message
+
+    def run(self, files: List[str], changed: List[str], timeout: float = VITEST_RUN_TIMEOUT) -> Dict:
+        """Запустить тестовые файлы, предварительно сбросив кэш измененных модулей"""
+        with self._lock:
+            request_id = next(self._ids)
+            self.process.stdin.write(json.dumps({"id": request_id, "files": files, "changed": changed}) + "\n")
+            self.process.stdin.flush()
+            deadline = time.monotonic() + timeout
+            while True:
+                message = self._read_message(deadline - time.monotonic())
+                if message.get("id") == request_id:
+                    return message
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def close(self):
+        if self.alive():
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+_workers: Dict[Tuple[Path, Optional[str]], VitestWorker] = {}
+_workers_lock = threading.Lock()
+
+
+def get_worker(config: Optional[str], repo_root: Path = REPO_ROOT) -> VitestWorker:
+    """Воркер для конфига и рабочего дерева (создается один раз на процесс)"""
+    with _workers_lock:
+        worker = _workers.get((repo_root, config))
+        if worker is None or not worker.alive():
+            worker = _workers[repo_root, config] = VitestWorker(config, repo_root)
+        return worker
+
+
+@atexit.register
+def shutdown_workers():
+    with _workers_lock:
+        for worker in _workers.values():
+            worker.close()
+        _workers.clear()
+
+
+def _jest_project(repo_root: Path, project_root: str) -> bool:
+    return any((repo_root / project_root / name).exists() for name in JEST_CONFIGS)
+
+
+def _vitest_config(repo_root: Path, project_root: str) -> Optional[str]:
+    for name in VITEST_CONFIGS:
+        if (repo_root / project_root / name).exists():
+            return f"{project_root}/{name}"
+    return None
+
+
+# ============================================
+# ВАЛИДАЦИЯ
+# ============================================
+
+@dataclass
+class TestReport:
+    selection: TestSelection
+    results: List[Dict] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+    repo_root: Path = REPO_ROOT
+    not_run: List[str] = field(default_factory=list)  # выбраны, но Vitest их не запускал (Jest, exclude)
+
+    @property
+    def ok(self) -> bool:
+        """Все выбранные тесты запускались и прошли (пустой выбор или незапущенные файлы — не успех)"""
+        return (bool(self.selection.files) and bool(self.results) and not self.errors and not self.not_run
+                and all(result.get("ok") for result in self.results))
+
+    def summary(self, max_failures: int = 20) -> str:
+        """Краткий отчет для передачи агенту"""
+        if not self.selection.files:
+            return "Затронутых тестов не найдено."
+        lines = [f"Запущено тестовых файлов: {len(self.selection.files)} "
+                 f"(проекты: {', '.join(sorted(self.selection.projects))})"]
+        failures = []
+        for result in self.results:
+            for module in result.get("modules", []):
+                for error in module.get("errors", []):
+                    failures.append(f"{os.path.relpath(module['file'], self.repo_root)}: {error}")
+                for test in module.get("tests", []):
+                    if test["state"] == "failed":
+                        failures.append(f"{os.path.relpath(module['file'], self.repo_root)} › {test['name']}: "
+                                        + "; ".join(test["errors"])[:500])
+            failures.extend(result.get("unhandled_errors", []))
+            if result.get("error"):
+                failures.append(result["error"][:1000])
+        failures.extend(self.errors)
+        if self.not_run:
+            lines.append(f"⚠️  Не запущены (проекты Jest или исключены из vitest.config): {', '.join(self.not_run)}")
+        if not failures and not self.ok:
+            lines.append("❌ Тесты не выполнялись.")
+        elif not failures:
+            lines.append("✅ Все тесты прошли.")
+        else:
+            lines.append(f"❌ Ошибок: {len(failures)}")
+            lines.extend(f"- {failure}" for failure in failures[:max_failures])
+        return "\n".join(lines)
+
+
+def run_affected_tests(changed: Optional[Iterable[str]] = None, include_dependents: bool = True,
+                       repo_root: Path = REPO_ROOT) -> TestReport:
+    """
+    Запустить только затронутые тесты в долгоживущих Vitest-воркерах
+
+    Args:
+        changed: Измененные файлы (по умолчанию — git status; для кода агентов
+            передаются записанные файлы, иначе в выбор попадут чужие изменения)
+        include_dependents: Запускать ли тесты зависимых проектов
+    """
+    changed = list(changed) if changed is not None else git_changed_files(repo_root)
+    graph = ProjectGraph.load(repo_root)
+    selection = select_tests(changed, graph, include_dependents, repo_root)
+    report = TestReport(selection=selection, repo_root=repo_root)
+
+    by_config: Dict[Optional[str], List[str]] = {}
+    for name, files in selection.projects.items():
+        config = _vitest_config(repo_root, graph.projects[name].root)
+        if config is None and _jest_project(repo_root, graph.projects[name].root):
+            report.not_run.extend(files)
+            continue
+        by_config.setdefault(config, []).extend(files)
+
+    for config, files in by_config.items():
+        try:
+            result = get_worker(config, repo_root).run(files, selection.changed)
+        except (OSError, RuntimeError) as e:
+            report.errors.append(f"Vitest ({config or 'vitest.config.ts'}): {e}")
+            continue
+        report.results.append(result)
+        report.not_run.extend(result.get("not_run", []))
+    return report
@@ -0,0 +1,148 @@
+"""
+Клиент сервера агентов (agent_server.py)
+Только стандартная библиотека: без импорта AutoGen команда подключается к уже
+прогретому серверу за миллисекунды
+
+Использование:
+    python agent_client.py chat Coder "Создай DTO для users" [--session s1]
+    python agent_client.py pipeline review_files '[["libs/backend/domain/auth"]]'
+    python agent_client.py health | status | stop
+    (адрес: AGENT_SERVER_URL=http://127.0.0.1:8765 или unix:///путь/к/сокету;
+     токен для TCP берется из .cache/agent-server.pid или AGENT_SERVER_TOKEN)
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+DEFAULT_URL = os.getenv("AGENT_SERVER_URL", f"http://127.0.0.1:{os.getenv('AGENT_SERVER_PORT', '8765')}")
+
+PID_FILE = Path(__file__).resolve().parent.parent / ".cache" / "agent-server.pid"
+TOKEN_HEADER = "X-Agent-Token"
+
+PIPELINES = ("affected_tests", "review_changes", "review_files", "static_gate")
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def _connection(url: str, timeout: float) -> http.client.HTTPConnection:
+    if url.startswith("unix://"):
+        return _UnixConnection(url.removeprefix("unix://"), timeout)
+    host, _, port = url.removeprefix("http://").rstrip("/").partition(":")
+    return http.client.HTTPConnection(host, int(port or 80), timeout=timeout)
+
+
+def server_token() -> Optional[str]:
+    """Токен запущенного сервера: AGENT_SERVER_TOKEN или третье поле PID-файла"""
+    if os.getenv("AGENT_SERVER_TOKEN"):
+        return os.environ["AGENT_SERVER_TOKEN"]
+    try:
+        fields = PID_FILE.read_text().split()
+    except OSError:
+        return None
+    return fields[2] if len(fields) > 2 else None
+
+
+def request(method: str, path: str, body: Optional[Dict[str, Any]] = None, url: str = DEFAULT_URL,
+            timeout: float = 600) -> http.client.HTTPResponse:
+    """Запрос к серверу; ответ читается как JSON или через events() для SSE"""
+    connection = _connection(url, timeout)
+    payload = json.dumps(body, ensure_ascii=False).encode() if body is not None else None
+    headers = {"Content-Type": "application/json"} if payload is not None else {}
+    token = server_token()
+    if token:
+        headers[TOKEN_HEADER] = token
+    connection.request(method, path, body=payload, headers=headers)
+    return connection.getresponse()
+
+
+def events(response: http.client.HTTPResponse) -> Iterator[Tuple[str, Any]]:
+    """Разобрать поток SSE в пары (событие, данные)"""
+    event, data = "message", []
+    for raw in response:
+        line = raw.decode("utf-8").rstrip("\r\n")
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event: "):
+            event = line[7:]
+        elif line.startswith("data: "):
+            data.append(line[6:])
+
+
+def is_running(url: str = DEFAULT_URL) -> bool:
+    try:
+        return request("GET", "/health", url=url, timeout=2).status == 200
+    except (OSError, http.client.HTTPException):
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Клиент сервера агентов")
+    commands = parser.add_subparsers(dest="command", required=True)
+    chat_parser = commands.add_parser("chat", help="Спросить агента (ответ потоком)")
+    chat_parser.add_argument("agent")
+    chat_parser.add_argument("message")
+    chat_parser.add_argument("--session")
+    pipeline_parser = commands.add_parser("pipeline", help="Запустить пайплайн")
+    pipeline_parser.add_argument("name", choices=PIPELINES)
+    pipeline_parser.add_argument("args", nargs="?", default="[]", help="Аргументы JSON-списком")
+    commands.add_parser("status", help="Состояние сервера")
+    commands.add_parser("health", help="Проверить, что сервер запущен")
+    commands.add_parser("stop", help="Остановить сервер")
+    args = parser.parse_args()
+
+    try:
+        if args.command in ("status", "health"):
+            response = request("GET", f"/{args.command}", timeout=5)
+            print(json.dumps(json.loads(response.read()), ensure_ascii=False, indent=2))
+        elif args.command == "stop":
+            response = request("POST", "/shutdown", {}, timeout=5)
+            data = json.loads(response.read())
+            if response.status != 200:
+                sys.exit(data["error"])
+            print(data["status"])
+        elif args.command == "chat":
+            response = request("POST", "/chat", {"agent": args.agent, "message": args.message,
+                                                 "session": args.session})
+            if response.status != 200:
+                sys.exit(json.loads(response.read())["error"])
+            for event, data in events(response):
+                if event == "token":
+                    print(data["text"], end="", flush=True)
+                elif event == "done":
+                    print(f"\n\n[сессия {data['session']}, {data['seconds']}s]", file=sys.stderr)
+                elif event == "error":
+                    sys.exit(f"\n❌ {data['error']}")
+        elif args.command == "pipeline":
+            response = request("POST", "/pipeline", {"name": args.name, "args": json.loads(args.args)})
+            if response.status != 200:
+                sys.exit(json.loads(response.read())["error"])
+            for event, data in events(response):
+                if event == "log":
+                    print(data, end="", flush=True)
+                elif event == "result":
+                    print(json.dumps(data, ensure_ascii=False, indent=2))
+                elif event == "error":
+                    sys.exit(f"❌ {data}")
+    except (ConnectionRefusedError, FileNotFoundError):
+        sys.exit(f"Сервер агентов не запущен ({DEFAULT_URL}). Запуск: ./scripts/start-cursor-agent.sh")
+
+
+if __name__ == "__main__":
+    main()
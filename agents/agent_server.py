@@ -0,0 +1,417 @@
+"""
+Долгоживущий сервер агентов для интеграции с Cursor
+Один процесс держит импортированный AutoGen, созданных агентов, пулы
+HTTP-соединений, кэши и прогретые модели Ollama. Расширение Cursor и CLI
+подключаются по HTTP (127.0.0.1) или Unix-сокету и получают ответ потоком (SSE)
+
+Эндпоинты:
+    GET  /health                 — жив ли сервер, агенты, время работы
+    GET  /status                 — breaker'ы, допуск, кэши
+    POST /chat                   — {"agent", "message", "session"?, "stream"?}
+    POST /pipeline               — {"name", "args"?} (review_changes, review_files, static_gate, affected_tests)
+    POST /shutdown
+
+POST по TCP требует заголовок X-Agent-Token с токеном из PID-файла
+(.cache/agent-server.pid, права 0600) и отклоняется при заголовке Origin: другие
+пользователи машины и страницы в браузере не запускают пайплайны и не
+останавливают сервер. Unix-сокет защищен правами файла (0600).
+
+Использование:
+    python agent_server.py [--port 8765 | --socket .cache/agent-server.sock]
+    python agent_client.py chat Coder "Создай DTO для users"
+"""
+
+import argparse
+import importlib
+import io
+import json
+import os
+import queue
+import secrets
+import socketserver
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+import requests
+from autogen import ConversableAgent
+
+from admission import admission_status
+from llm_client import INTERACTIVE, OllamaModelClient, breaker_status, request_class
+from process_pool import to_jsonable
+from semantic_cache import semantic_cache_status
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+PID_FILE = REPO_ROOT / ".cache" / "agent-server.pid"
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = int(os.getenv("AGENT_SERVER_PORT", "8765"))
+AGENT_MODULE = os.getenv("AGENT_SERVER_MODULE", "cursor_agent")
+
+# Сколько держать модели в памяти Ollama после прогрева
+KEEP_ALIVE = os.getenv("AGENT_SERVER_KEEP_ALIVE", "30m")
+
+# Сколько сообщений сессии отправлять модели
+MAX_SESSION_MESSAGES = 20
+
+# Сессии чата: не больше MAX_SESSIONS (вытесняются давно не использованные),
+# неактивные дольше SESSION_TTL секунд удаляются
+MAX_SESSIONS = int(os.getenv("AGENT_SERVER_MAX_SESSIONS", "200"))
+SESSION_TTL = float(os.getenv("AGENT_SERVER_SESSION_TTL", "3600"))
+
+TOKEN_HEADER = "X-Agent-Token"
+
+# Разрешенные пайплайны: имя → "модуль:функция"
+PIPELINES = {
+    "review_changes": "cursor_agent:review_changes",
+    "review_files": "cursor_agent:review_files",
+    "static_gate": "static_gate:run_static_gate",
+    "affected_tests": "affected_tests:run_affected_tests",
+}
+
+
+# ============================================
+# ВЫВОД ПАЙПЛАЙНОВ
+# ============================================
+
+class _ThreadOutput(io.TextIOBase):
+    """sys.stdout, который перенаправляет print() потоков пайплайнов в их очереди"""
+
+    def __init__(self, default):
+        self.default = default
+        self.targets: Dict[int, queue.Queue] = {}
+
+    def write(self, text: str) -> int:
+        target = self.targets.get(threading.get_ident())
+        if target is None:
+            return self.default.write(text)
+        if text:
+            target.put(("log", text))
+        return len(text)
+
+    def flush(self):
+        self.default.flush()
+
+
+# ============================================
+# СОСТОЯНИЕ СЕРВЕРА
+# ============================================
+
+class AgentServer:
+    """
+    Прогретое состояние: модуль агентов, сессии чата, статистика запросов
+
+    Args:
+        module: Модуль с агентами (по умолчанию cursor_agent)
+    """
+
+    def __init__(self, module: str = AGENT_MODULE):
+        self.started = time.time()
+        self.module = importlib.import_module(module)
+        self.agents: Dict[str, ConversableAgent] = {
+            agent.name: agent for agent in vars(self.module).values()
+            if isinstance(agent, ConversableAgent) and agent.llm_config
+        }
+        # сессия → (время последнего использования, история); порядок — LRU
+        self.sessions: "OrderedDict[str, Tuple[float, Deque[Dict[str, str]]]]" = OrderedDict()
+        self.sessions_lock = threading.Lock()
+        self.sessions_expired = 0
+        self.requests = {"chat": 0, "pipeline": 0, "errors": 0}
+        self.output = _ThreadOutput(sys.stdout)
+        sys.stdout = self.output
+
+    def client(self, agent: ConversableAgent) -> OllamaModelClient:
+        for client in agent.client._clients:
+            if isinstance(client, OllamaModelClient):
+                return client
+        raise ValueError(f"Агент {agent.name} не использует OllamaModelClient")
+
+    def warm_up(self):
+        """Загрузить модели агентов в память Ollama (пустой запрос с keep_alive)"""
+        seen = set()
+        for agent in self.agents.values():
+            endpoint = self.client(agent).endpoints[0]
+            root = endpoint["base_url"].rstrip("/").removesuffix("/v1")
+            if (endpoint["model"], root) in seen:
+                continue
+            seen.add((endpoint["model"], root))
+            try:
+                requests.post(f"{root}/api/generate", json={"model": endpoint["model"], "keep_alive": KEEP_ALIVE},
+                              timeout=300).raise_for_status()
+                print(f"🔥 Модель прогрета: {endpoint['model']}")
+            except requests.RequestException as e:
+                print(f"⚠️  Не удалось прогреть {endpoint['model']}: {e}")
+
+    def _session(self, session: str) -> Deque[Dict[str, str]]:
+        """История сессии (новая, если нет); вытесняет устаревшие и лишние сессии. Под sessions_lock"""
+        now = time.monotonic()
+        while self.sessions:
+            oldest, (used, _) = next(iter(self.sessions.items()))
+            if now - used <= SESSION_TTL and len(self.sessions) < MAX_SESSIONS + (session in self.sessions):
+                break
+            del self.sessions[oldest]
+            self.sessions_expired += 1
+        _, history = self.sessions.pop(session, (now, deque(maxlen=MAX_SESSION_MESSAGES)))
+        self.sessions[session] = (now, history)
+        return history
+
+    def chat(self, agent_name: str, message: str, session: Optional[str]) -> Tuple[str, Iterator[str]]:
+        """Потоковый ответ агента с историей сессии; возвращает (session, куски ответа)"""
+        agent = self.agents.get(agent_name)
+        if agent is None:
+            raise KeyError(f"Нет агента {agent_name}; есть: {', '.join(sorted(self.agents))}")
+        client = self.client(agent)
+        session = session or uuid.uuid4().hex[:12]
+        with self.sessions_lock:
+            history = self._session(session)
+            messages = [{"role": "system", "content": agent.system_message}, *history,
+                        {"role": "user", "content": message}]
+        params: Dict[str, Any] = {"messages": messages}
+        if agent.llm_config.get("temperature") is not None:
+            params["temperature"] = agent.llm_config["temperature"]
+        self.requests["chat"] += 1
+
+        def generate() -> Iterator[str]:
+            parts: List[str] = []
+            with request_class(INTERACTIVE):
+                for part in client.stream(params):
+                    parts.append(part)
+                    yield part
+            with self.sessions_lock:
+                history.extend([{"role": "user", "content": message},
+                                {"role": "assistant", "content": "".join(parts)}])
+
+        return session, generate()
+
+    def pipeline(self, name: str, args: List[Any]) -> queue.Queue:
+        """Запустить пайплайн в потоке; события ("log"|"result"|"error", данные) идут в очередь"""
+        if name not in PIPELINES:
+            raise KeyError(f"Нет пайплайна {name}; есть: {', '.join(sorted(PIPELINES))}")
+        module_name, _, function_name = PIPELINES[name].partition(":")
+        function: Callable = getattr(importlib.import_module(module_name), function_name)
+        events: queue.Queue = queue.Queue()
+        self.requests["pipeline"] += 1
+
+        def run():
+            self.output.targets[threading.get_ident()] = events
+            try:
+                with request_class(INTERACTIVE):
+                    events.put(("result", to_jsonable(function(*args))))
+            except Exception as e:
+                self.requests["errors"] += 1
+                events.put(("error", f"{type(e).__name__}: {e}"))
+            finally:
+                self.output.targets.pop(threading.get_ident(), None)
+                events.put(None)
+
+        threading.Thread(target=run, name=f"pipeline-{name}", daemon=True).start()
+        return events
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            "module": self.module.__name__,
+            "agents": sorted(self.agents),
+            "sessions": len(self.sessions),
+            "sessions_expired": self.sessions_expired,
+            "requests": dict(self.requests),
+            "breakers": breaker_status(),
+            "admission": admission_status(),
+            "semantic_cache": semantic_cache_status(),
+        }
+
+
+# ============================================
+# HTTP
+# ============================================
+
+def _handler(server_state: AgentServer, token: Optional[str]):
+    """token — обязательный для POST токен (TCP); None — без проверки (Unix-сокет)"""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format: str, *args):
+            pass
+
+        def address_string(self) -> str:
+            # У Unix-сокета нет адреса клиента
+            return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+        def _json(self, status: int, data: Any):
+            body = json.dumps(data, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self) -> Dict[str, Any]:
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+        def _sse_start(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+
+        def _event(self, event: str, data: Any):
+            self.wfile.write(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode())
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._json(200, {"status": "ok", "uptime_s": round(time.time() - server_state.started, 1),
+                                 "agents": sorted(server_state.agents), "pid": os.getpid()})
+            elif self.path == "/status":
+                self._json(200, server_state.status())
+            else:
+                self._json(404, {"error": "not found"})
+
+        def _authorized(self) -> bool:
+            if self.headers.get("Origin") is not None:
+                self._json(403, {"error": "запросы из браузера запрещены"})
+                return False
+            if token is not None and not secrets.compare_digest(self.headers.get(TOKEN_HEADER, ""), token):
+                self._json(401, {"error": f"нужен заголовок {TOKEN_HEADER} (токен из {PID_FILE})"})
+                return False
+            return True
+
+        def do_POST(self):
+            if not self._authorized():
+                self.close_connection = True
+                return
+            try:
+                body = self._body()
+            except ValueError:
+                self._json(400, {"error": "тело запроса не JSON"})
+                return
+            if self.path == "/chat":
+                self._chat(body)
+            elif self.path == "/pipeline":
+                self._pipeline(body)
+            elif self.path == "/shutdown":
+                self._json(200, {"status": "stopping"})
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+            else:
+                self._json(404, {"error": "not found"})
+
+        def _chat(self, body: Dict[str, Any]):
+            try:
+                session, parts = server_state.chat(body["agent"], body["message"], body.get("session"))
+            except KeyError as e:
+                self._json(400, {"error": str(e).strip("'")})
+                return
+            except ValueError as e:
+                self._json(400, {"error": str(e)})
+                return
+            started = time.monotonic()
+            if not body.get("stream", True):
+                try:
+                    text = "".join(parts)
+                except Exception as e:
+                    server_state.requests["errors"] += 1
+                    self._json(502, {"error": f"{type(e).__name__}: {e}", "session": session})
+                    return
+                self._json(200, {"session": session, "text": text, "seconds": round(time.monotonic() - started, 3)})
+                return
+            self._sse_start()
+            self._event("start", {"session": session})
+            try:
+                for part in parts:
+                    self._event("token", {"text": part})
+            except (BrokenPipeError, ConnectionResetError):
+                parts.close()
+                return
+            except Exception as e:
+                server_state.requests["errors"] += 1
+                self._event("error", {"error": f"{type(e).__name__}: {e}"})
+                return
+            self._event("done", {"session": session, "seconds": round(time.monotonic() - started, 3)})
+
+        def _pipeline(self, body: Dict[str, Any]):
+            try:
+                events = server_state.pipeline(body["name"], list(body.get("args", [])))
+            except KeyError as e:
+                self._json(400, {"error": str(e).strip("'")})
+                return
+            self._sse_start()
+            try:
+                while True:
+                    item = events.get()
+                    if item is None:
+                        break
+                    self._event(*item)
+            except (BrokenPipeError, ConnectionResetError):
+                return
+
+    return Handler
+
+
+def write_pid_file(address: str, token: str):
+    """PID-файл "pid адрес токен", читаемый только владельцем"""
+    PID_FILE.parent.mkdir(parents=True, exist_ok=True)
+    PID_FILE.unlink(missing_ok=True)
+    fd = os.open(PID_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(f"{os.getpid()} {address} {token}\n")
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, unix_socket: Optional[str] = None,
+          module: str = AGENT_MODULE, warm_up: bool = True):
+    """Запустить сервер (блокирует до /shutdown или Ctrl+C)"""
+    started = time.monotonic()
+    state = AgentServer(module)
+    token = secrets.token_urlsafe(32)
+    if unix_socket:
+        Path(unix_socket).unlink(missing_ok=True)
+        umask = os.umask(0o177)  # сокет сразу 0600
+        try:
+            httpd = UnixHTTPServer(unix_socket, _handler(state, None))
+        finally:
+            os.umask(umask)
+        address = f"unix://{unix_socket}"
+    else:
+        httpd = ThreadingHTTPServer((host, port), _handler(state, token))
+        httpd.daemon_threads = True
+        address = f"http://{host}:{port}"
+    write_pid_file(address, token)
+    print(f"🤖 Сервер агентов {address} (агенты: {', '.join(sorted(state.agents))}), "
+          f"готов за {time.monotonic() - started:.1f}s")
+    if warm_up:
+        threading.Thread(target=state.warm_up, name="warm-up", daemon=True).start()
+    try:
+        httpd.serve_forever(poll_interval=0.2)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        PID_FILE.unlink(missing_ok=True)
+        if unix_socket:
+            Path(unix_socket).unlink(missing_ok=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сервер агентов для Cursor (клиент: agent_client.py)")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--socket", help="Unix-сокет вместо TCP")
+    parser.add_argument("--module", default=AGENT_MODULE, help="Модуль с агентами")
+    parser.add_argument("--no-warmup", action="store_true", help="Не прогревать модели")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.socket, args.module, warm_up=not args.no_warmup)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Артефакты шагов пайплайна
+Из ответа агента извлекаются блоки кода, пути файлов и принятые решения;
+следующему шагу передается только этот компактный артефакт, а не весь диалог
+"""
+
+import re
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+# Тот же шаблон, что использует AutoGen для поиска исполняемого кода
+CODE_BLOCK_PATTERN = re.compile(r"```[ \t]*([\w+-]+)?[ \t]*\r?\n(.*?)\r?\n[ \t]*```", re.DOTALL)
+
+FILE_PATH_PATTERN = re.compile(
+    r"(?<![\w/.-])((?:[\w@.-]+/)*(?:[\w@-][\w@.-]*\.(?:ts|tsx|js|mjs|json|py|ya?ml|prisma|sql|sh|md|html|scss|css)"
+    r"|Dockerfile(?:\.[\w-]+)?))(?![\w/-])"
+)
+
+# Явное имя файла в первой строке блока: "// filename: x.ts", "# file: x.py", "// libs/a/b.ts"
+FILENAME_COMMENT_PATTERN = re.compile(
+    r"^\s*(?://|#|<!--|/\*)\s*(?:file(?:name)?:\s*)?([\w@./-]+\.\w+|Dockerfile)\s*(?:-->|\*/)?\s*$",
+    re.IGNORECASE,
+)
+
+# Куда write_files может писать код агентов (каталоги проектов Nx)
+WRITABLE_DIRS = ("apps", "libs")
+
+DECISION_MARKERS = (
+    "решени", "решили", "используем", "будем", "выбираем", "выбрать", "паттерн", "архитектур",
+    "должен", "должны", "decision", "we will", "use ", "must",
+)
+
+HASH_COMMENT_LANGS = {"python", "py", "bash", "sh", "shell", "yaml", "yml", "dockerfile"}
+
+MAX_DECISIONS = 12
+MAX_DECISION_LENGTH = 240
+
+
+@dataclass
+class CodeBlock:
+    lang: str
+    code: str
+    path: Optional[str] = None
+
+
+@dataclass
+class StepArtifact:
+    """Компактный результат шага пайплайна"""
+    step: str
+    agent: str
+    code_blocks: List[CodeBlock] = field(default_factory=list)
+    files: List[str] = field(default_factory=list)
+    decisions: List[str] = field(default_factory=list)
+
+    def to_prompt(self, include_code: bool = True, max_chars: int = 12000) -> str:
+        """
+        Представить артефакт для передачи следующему агенту
+
+        Args:
+            include_code: Включать ли код (иначе только решения и файлы)
+            max_chars: Ограничение на объем кода в символах
+        """
+        lines = [f"### Результат шага «{self.step}» ({self.agent})"]
+        if self.decisions:
+            lines.append("Решения:")
+            lines.extend(f"- {decision}" for decision in self.decisions)
+        if self.files:
+            lines.append("Файлы: " + ", ".join(self.files))
+        if include_code:
+            budget = max_chars
+            for index, block in enumerate(self.code_blocks):
+                comment = "#" if block.lang in HASH_COMMENT_LANGS else "//"
+                header = f"{comment} filename: {block.path}\n" if block.path else ""
+                code = block.code if len(block.code) <= budget else block.code[:budget] + "\n... (обрезано)"
+                lines.append(f"```{block.lang}\n{header}{code}\n```")
+                budget -= len(block.code)
+                if budget <= 0:
+                    omitted = len(self.code_blocks) - index - 1
+                    if omitted:
+                        lines.append(f"(еще {omitted} блок(ов) кода опущено)")
+                    break
+        return "\n".join(lines)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "StepArtifact":
+        return cls(
+            step=data["step"],
+            agent=data["agent"],
+            code_blocks=[CodeBlock(**block) for block in data.get("code_blocks", [])],
+            files=list(data.get("files", [])),
+            decisions=list(data.get("decisions", [])),
+        )
+
+
+def _messages_from(agent_name: str, source: Any) -> List[str]:
+    """Тексты сообщений указанного агента из ChatResult или списка сообщений"""
+    history = getattr(source, "chat_history", source) or []
+    texts = []
+    for message in history:
+        if isinstance(message, str):
+            texts.append(message)
+        elif message.get("name") == agent_name and isinstance(message.get("content"), str):
+            texts.append(message["content"])
+    return texts
+
+
+def _path_before(text: str, position: int) -> Optional[str]:
+    """Путь файла, упомянутый в строке прямо перед блоком кода"""
+    preceding = text[:position].rstrip().rsplit("\n", 1)[-1]
+    matches = FILE_PATH_PATTERN.findall(preceding)
+    return matches[-1] if matches else None
+
+
+def _decisions(prose: str) -> List[str]:
+    """Строки текста (вне кода), похожие на принятые решения"""
+    decisions = []
+    for raw_line in prose.splitlines():
+        line = re.sub(r"^(?:[-*•]|\d+[.)])\s*", "", raw_line.strip()).strip("* ")
+        if len(line) < 12 or line.endswith(":"):
+            continue
+        if any(marker in line.lower() for marker in DECISION_MARKERS):
+            decisions.append(line[:MAX_DECISION_LENGTH])
+    return decisions
+
+
+def extract_artifact(step: str, agent: Any, source: Any) -> StepArtifact:
+    """
+    Извлечь артефакт шага из результата чата
+
+    Args:
+        step: Название шага (architecture, code, tests, review, deploy)
+        agent: Агент, чьи ответы разбираются (или его имя)
+        source: ChatResult из initiate_chat или список сообщений
+
+    Returns:
+        StepArtifact; более поздние версии файла заменяют ранние
+    """
+    agent_name = agent if isinstance(agent, str) else agent.name
+    artifact = StepArtifact(step=step, agent=agent_name)
+    blocks_by_path: Dict[str, CodeBlock] = {}
+    anonymous: List[CodeBlock] = []
+    files: List[str] = []
+
+    for text in _messages_from(agent_name, source):
+        prose_parts = []
+        last_end = 0
+        for match in CODE_BLOCK_PATTERN.finditer(text):
+            prose_parts.append(text[last_end:match.start()])
+            last_end = match.end()
+            lang = (match.group(1) or "").lower()
+            code = match.group(2)
+            first_line = code.split("\n", 1)[0]
+            comment = FILENAME_COMMENT_PATTERN.match(first_line)
+            path = comment.group(1) if comment else _path_before(text, match.start())
+            if comment:
+                code = code.split("\n", 1)[1] if "\n" in code else ""
+            block = CodeBlock(lang=lang, code=code, path=path)
+            if path:
+                blocks_by_path[path] = block
+            else:
+                anonymous.append(block)
+        prose_parts.append(text[last_end:])
+        prose = "\n".join(prose_parts)
+        files.extend(FILE_PATH_PATTERN.findall(prose))
+        artifact.decisions.extend(_decisions(prose))
+
+    artifact.code_blocks = list(blocks_by_path.values()) + anonymous
+    artifact.files = list(dict.fromkeys(files + list(blocks_by_path)))
+    artifact.decisions = list(dict.fromkeys(artifact.decisions))[-MAX_DECISIONS:]
+    return artifact
+
+
+def handoff_message(instruction: str, artifacts: Iterable[StepArtifact], include_code: bool = True,
+                    max_chars: int = 12000) -> str:
+    """
+    Сообщение для следующего шага: задача + компактные артефакты предыдущих
+
+    Args:
+        instruction: Задача для агента
+        artifacts: Артефакты предыдущих шагов
+        include_code: Передавать ли код
+        max_chars: Ограничение на объем кода на один артефакт
+    """
+    sections = [artifact.to_prompt(include_code, max_chars) for artifact in artifacts
+                if artifact.code_blocks or artifact.files or artifact.decisions]
+    if not sections:
+        return instruction
+    return instruction + "\n\nКонтекст предыдущих шагов:\n\n" + "\n\n".join(sections)
+
+
+def write_files(artifacts: Iterable[StepArtifact], root: Path) -> List[str]:
+    """
+    Записать блоки кода с путями в каталог (обычно корень репозитория)
+
+    Пишутся только пути внутри WRITABLE_DIRS (apps/, libs/): блоки без пути,
+    пути вне root, в .git, конфиги и манифесты корня пропускаются. Если путь
+    встречается в нескольких артефактах, побеждает более поздний.
+
+    Returns:
+        Записанные файлы относительно root
+    """
+    root = Path(root).resolve()
+    blocks: Dict[str, CodeBlock] = {}
+    for artifact in artifacts:
+        for block in artifact.code_blocks:
+            if not block.path:
+                continue
+            target = (root / block.path.strip().lstrip("/")).resolve()
+            if root not in target.parents:
+                continue
+            parts = target.relative_to(root).parts
+            if parts[0] in WRITABLE_DIRS and ".git" not in parts:
+                blocks[target.relative_to(root).as_posix()] = block
+    for path, block in blocks.items():
+        target = root / path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_text(block.code.rstrip("\n") + "\n", encoding="utf-8")
+    return sorted(blocks)
@@ -0,0 +1,269 @@
+"""
+Микробатчинг мелких запросов к LLM
+Много маленьких независимых промптов (классификация файлов, сообщения коммитов)
+отправляются не через initiate_chat по одному, а пачками: параллельно по числу
+слотов сервера (OLLAMA_NUM_PARALLEL) или упакованными в один JSON-промпт.
+Ошибка одного элемента не влияет на остальные
+
+Использование:
+    python batcher.py prompts.jsonl --system "Оцени приоритет ревью: high/medium/low" --pack 8
+    (строки prompts.jsonl: {"id": "...", "prompt": "..."}; результат — JSONL в stdout)
+"""
+
+import argparse
+import contextvars
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterable, List, Optional
+
+from admission import AdmissionCancelled, get_controller, next_batch_tenant, tenant
+from llm_client import BATCH, OllamaModelClient, request_class
+
+# Сколько запросов Ollama обрабатывает одновременно (OLLAMA_NUM_PARALLEL на сервере)
+DEFAULT_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+
+PACK_PROMPT = """Выполни задание для каждого элемента независимо.
+
+Задание: {system}
+
+Ответь строго JSON-объектом вида {{"results": [{{"id": "<id>", "output": "<ответ>"}}, ...]}}
+с ответом для каждого id, без пояснений.
+
+Элементы:
+{items}"""
+
+JSON_OBJECT = re.compile(r"\{.*\}", re.DOTALL)
+
+
+@dataclass
+class BatchItem:
+    id: str
+    prompt: str
+    system: Optional[str] = None
+
+
+@dataclass
+class BatchResult:
+    id: str
+    ok: bool
+    output: Optional[str] = None
+    error: Optional[str] = None
+    packed: bool = False
+    seconds: float = 0.0
+
+
+class MicroBatcher:
+    """
+    Сборщик мелких запросов
+
+    Args:
+        llm_config: llm_config агента (берется первая модель) или конфиг OllamaModelClient
+        parallel: Одновременных запросов (по числу слотов сервера)
+        pack_size: Сколько элементов упаковывать в один промпт (0 — не упаковывать)
+        max_pack_chars: Элементы длиннее не упаковываются
+        max_wait: Сколько ждать накопления пачки в submit(), сек
+        temperature: Температура для всех запросов
+
+    Упаковка безопасна только для коротких независимых задач с коротким ответом;
+    элементы, для которых упакованный ответ не разобрался, переотправляются по одному.
+    """
+
+    def __init__(self, llm_config: Dict[str, Any], parallel: int = DEFAULT_PARALLEL, pack_size: int = 0,
+                 max_pack_chars: int = 2000, max_wait: float = 0.05, temperature: float = 0.0):
+        config = llm_config["config_list"][0] if "config_list" in llm_config else llm_config
+        self.client = OllamaModelClient(config)
+        self.parallel = max(1, parallel)
+        self.pack_size = pack_size
+        self.max_pack_chars = max_pack_chars
+        self.max_wait = max_wait
+        self.temperature = temperature
+        # Владелец в очереди допуска: пачки разных сборщиков чередуются
+        self.tenant = next_batch_tenant()
+        self._executor = ThreadPoolExecutor(max_workers=self.parallel, thread_name_prefix="batcher")
+        self._pending: List[tuple] = []
+        self._ids = itertools.count()
+        self._pending_lock = threading.Lock()
+        self._flush_timer: Optional[threading.Timer] = None
+        self.stats = {"items": 0, "requests": 0, "packed_items": 0, "repacked_fallbacks": 0, "errors": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key: str, value: int = 1):
+        with self._stats_lock:
+            self.stats[key] += value
+
+    def _complete(self, messages: List[Dict[str, str]], json_mode: bool = False) -> str:
+        params: Dict[str, Any] = {"messages": messages, "temperature": self.temperature}
+        if json_mode:
+            params["response_format"] = {"type": "json_object"}
+        with request_class(BATCH), tenant(self.tenant):
+            response = self.client.create(params)
+        self._count("requests")
+        return response.choices[0].message.content or ""
+
+    def _run_one(self, item: BatchItem) -> BatchResult:
+        started = time.monotonic()
+        messages = ([{"role": "system", "content": item.system}] if item.system else []) + \
+            [{"role": "user", "content": item.prompt}]
+        try:
+            output = self._complete(messages)
+        except Exception as e:
+            # Любая ошибка элемента (сеть, допуск, разбор ответа) — его результат, не исключение пачки
+            self._count("errors")
+            return BatchResult(item.id, False, error=f"{type(e).__name__}: {e}",
+                               seconds=round(time.monotonic() - started, 3))
+        return BatchResult(item.id, True, output=output, seconds=round(time.monotonic() - started, 3))
+
+    def _run_packed(self, items: List[BatchItem]) -> List[BatchResult]:
+        """Один запрос на несколько элементов; неразобранные и без output — по одному"""
+        started = time.monotonic()
+        listing = "\n".join(json.dumps({"id": item.id, "input": item.prompt}, ensure_ascii=False) for item in items)
+        outputs: Dict[str, str] = {}
+        try:
+            content = self._complete([{"role": "user", "content": PACK_PROMPT.format(
+                system=items[0].system or "ответь на вход", items=listing)}], json_mode=True)
+            match = JSON_OBJECT.search(content)
+            for entry in json.loads(match.group(0) if match else content).get("results", []):
+                if not isinstance(entry, dict) or str(entry.get("id")) not in {item.id for item in items}:
+                    continue
+                output = entry.get("output")
+                if output is None:
+                    continue  # модель пропустила ответ: элемент переотправляется
+                outputs[str(entry["id"])] = output if isinstance(output, str) \
+                    else json.dumps(output, ensure_ascii=False)
+        except AdmissionCancelled as e:
+            self._count("errors", len(items))
+            return [BatchResult(item.id, False, error=str(e)) for item in items]
+        except Exception:
+            pass  # упакованный запрос не удался: элементы переотправляются по одному
+        seconds = round((time.monotonic() - started) / len(items), 3)
+        results = []
+        for item in items:
+            if item.id in outputs:
+                self._count("packed_items")
+                results.append(BatchResult(item.id, True, output=outputs[item.id], packed=True, seconds=seconds))
+            else:
+                self._count("repacked_fallbacks")
+                results.append(self._run_one(item))
+        return results
+
+    def _run_group(self, group: List[BatchItem]) -> List[BatchResult]:
+        return self._run_packed(group) if len(group) > 1 else [self._run_one(group[0])]
+
+    def _groups(self, items: List[BatchItem]) -> List[List[BatchItem]]:
+        """Разбить на пачки: упаковываются короткие элементы с одинаковым system"""
+        if self.pack_size <= 1:
+            return [[item] for item in items]
+        groups: List[List[BatchItem]] = []
+        by_system: Dict[Optional[str], List[BatchItem]] = {}
+        for item in items:
+            if len(item.prompt) > self.max_pack_chars:
+                groups.append([item])
+                continue
+            bucket = by_system.setdefault(item.system, [])
+            bucket.append(item)
+            if len(bucket) == self.pack_size:
+                groups.append(by_system.pop(item.system))
+        groups.extend(by_system.values())
+        return groups
+
+    def run(self, items: Iterable[BatchItem]) -> List[BatchResult]:
+        """
+        Выполнить элементы и вернуть результаты в исходном порядке
+
+        Args:
+            items: Независимые элементы (id должны быть уникальны)
+        """
+        items = list(items)
+        self._count("items", len(items))
+        # Копия контекста: запросы пачки попадают в трассу вызывающего
+        futures = [self._executor.submit(contextvars.copy_context().run, self._run_group, group)
+                   for group in self._groups(items)]
+        by_id = {result.id: result for future in futures for result in future.result()}
+        return [by_id[item.id] for item in items]
+
+    def map(self, prompts: Iterable[str], system: Optional[str] = None) -> List[BatchResult]:
+        """Короткая форма: список промптов с общим system (id — номер промпта)"""
+        return self.run(BatchItem(str(index), prompt, system) for index, prompt in enumerate(prompts))
+
+    def submit(self, prompt: str, system: Optional[str] = None, item_id: Optional[str] = None) -> Future:
+        """
+        Добавить запрос в текущую пачку; пачка отправляется через max_wait
+        или когда наберется parallel × max(pack_size, 1) элементов
+
+        Returns:
+            Future с BatchResult
+        """
+        future: Future = Future()
+        with self._pending_lock:
+            item = BatchItem(item_id or f"item-{next(self._ids)}", prompt, system)
+            self._pending.append((item, future))
+            if len(self._pending) >= self.parallel * max(self.pack_size, 1):
+                self._flush_locked()
+            elif self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.max_wait, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+        return future
+
+    def flush(self):
+        with self._pending_lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        pending, self._pending = self._pending, []
+        if pending:
+            threading.Thread(target=self._deliver, args=(pending,), daemon=True).start()
+
+    def _deliver(self, pending: List[tuple]):
+        try:
+            results = self.run(item for item, _ in pending)
+        except Exception as e:
+            for _, future in pending:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(pending, results):
+            future.set_result(result)
+
+    def cancel(self) -> int:
+        """Отменить еще не допущенные запросы этого сборщика (выполняющиеся дорабатывают)"""
+        return get_controller(self.client.endpoints[0]["base_url"]).cancel_pending("batch", self.tenant)
+
+    def close(self):
+        self.flush()
+        self._executor.shutdown(wait=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная обработка мелких промптов через Ollama")
+    parser.add_argument("input", help='JSONL: {"id": ..., "prompt": ...} в каждой строке ("-" — stdin)')
+    parser.add_argument("--system", help="Общая инструкция для всех элементов")
+    parser.add_argument("--model", default=os.getenv("OLLAMA_MODEL", "qwen2.5:7b"))
+    parser.add_argument("--base-url", default=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1"))
+    parser.add_argument("--parallel", type=int, default=DEFAULT_PARALLEL)
+    parser.add_argument("--pack", type=int, default=0, help="Элементов в одном промпте (0 — без упаковки)")
+    args = parser.parse_args()
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    items = [BatchItem(str(data.get("id", index)), data["prompt"], data.get("system", args.system))
+             for index, data in enumerate(json.loads(line) for line in source if line.strip())]
+    batcher = MicroBatcher({"model": args.model, "base_url": args.base_url}, parallel=args.parallel,
+                           pack_size=args.pack)
+    started = time.monotonic()
+    for result in batcher.run(items):
+        print(json.dumps(asdict(result), ensure_ascii=False))
+    batcher.close()
+    print(f"{len(items)} элементов за {time.monotonic() - started:.1f}s, статистика: {batcher.stats}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""
+Бенчмарк пайплайна агентов на фиксированном наборе фич
+Прогоняет create_feature-подобный пайплайн (архитектор → кодер → тестировщик →
+ревьюер) для каждой конфигурации агентов и сохраняет время, токены, число
+раундов LLM, время выполнения кода и сигнал качества (сгенерированный код
+компилируется, тесты проходят) — по конфигурации и коммиту
+
+Использование:
+    python benchmark.py --configs base optimized --features slugify retry
+    python benchmark.py --compare            # сравнить последние результаты
+"""
+
+import argparse
+import importlib
+import json
+import os
+import shutil
+import subprocess
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from autogen import Cache
+
+from artifacts import StepArtifact, extract_artifact, handoff_message
+from sandbox import SandboxedUserProxyAgent, SandboxLimits, sandbox_runs
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+BENCHMARK_DIR = Path(__file__).resolve().parent / "benchmarks"
+CORPUS_FILE = BENCHMARK_DIR / "corpus.json"
+RESULTS_DIR = REPO_ROOT / ".cache" / "benchmarks"
+WORK_DIR = REPO_ROOT / ".cache" / "benchmark"
+
+# Конфигурация → модуль с агентами (назначения моделей ролям)
+CONFIGS = {
+    "base": "devops_agent",
+    "starcoder": "devops_agent_starcoder",
+    "optimized": "devops_agent_optimized",
+    "complete": "devops_agent_complete",
+}
+
+# Шаги пайплайна: (шаг, роль-агент в модуле, задача, от каких шагов артефакты)
+PIPELINE = [
+    ("architecture", "architect", "Спроектируй решение: {feature}", []),
+    ("code", "coder", "Реализуй: {feature}\nКаждый файл — отдельный блок кода, первая строка — "
+                      "комментарий с путем: // filename: src/<имя>.ts", ["architecture"]),
+    ("tests", "tester", "Напиши тесты Vitest для реализованного кода. Каждый файл — отдельный блок, "
+                        "первая строка — // filename: src/<имя>.spec.ts", ["code"]),
+    ("review", "reviewer", "Проверь код и тесты, перечисли проблемы", ["code", "tests"]),
+]
+
+MAX_AUTO_REPLY = int(os.getenv("BENCHMARK_MAX_AUTO_REPLY", "2"))
+TOOL_TIMEOUT = 300
+
+VITEST_CONFIG = 'export default { test: { include: ["src/**/*.{spec,test}.ts"], watch: false } };\n'
+
+
+@dataclass
+class FeatureResult:
+    feature: str
+    wall_s: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    llm_rounds: int = 0
+    exec_s: float = 0.0
+    exec_runs: int = 0
+    files: List[str] = field(default_factory=list)
+    compiles: Optional[bool] = None
+    tests_passed: Optional[bool] = None
+    tests_total: int = 0
+    tests_failed: int = 0
+    quality_pass: bool = False
+    steps_s: Dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+def git_commit() -> str:
+    """Короткий хэш HEAD, с пометкой -dirty при незакоммиченных изменениях"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_ROOT,
+                               capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+
+def _model_of(agent) -> str:
+    config = agent.llm_config or {}
+    entries = config.get("config_list") or [config]
+    return entries[0].get("model", "?")
+
+
+def _usage(agents) -> Dict[str, int]:
+    totals = {"prompt_tokens": 0, "completion_tokens": 0}
+    for agent in agents:
+        summary = getattr(agent.client, "total_usage_summary", None) or {}
+        for model, usage in summary.items():
+            if isinstance(usage, dict):
+                totals["prompt_tokens"] += usage.get("prompt_tokens", 0)
+                totals["completion_tokens"] += usage.get("completion_tokens", 0)
+    return totals
+
+
+def _safe_path(path: str) -> str:
+    """Путь из ответа модели → путь внутри рабочего каталога"""
+    parts = [part for part in Path(path).parts if part not in ("/", "..", ".")]
+    if "src" in parts:
+        parts = parts[parts.index("src"):]
+    else:
+        parts = ["src", parts[-1]]
+    return "/".join(parts)
+
+
+def write_files(artifacts: List[StepArtifact], workdir: Path) -> List[str]:
+    files = []
+    for artifact in artifacts:
+        for block in artifact.code_blocks:
+            if block.path and block.path.endswith((".ts", ".tsx")):
+                target = _safe_path(block.path)
+                (workdir / target).parent.mkdir(parents=True, exist_ok=True)
+                (workdir / target).write_text(block.code + "\n", encoding="utf-8")
+                files.append(target)
+    return sorted(set(files))
+
+
+def check_quality(workdir: Path, files: List[str], result: FeatureResult):
+    """tsc --noEmit по сгенерированным файлам и Vitest по тестам"""
+    if not files:
+        return
+    try:
+        tsc = subprocess.run(
+            ["npx", "--no-install", "tsc", "--noEmit", "--strict", "--skipLibCheck", "--target", "es2022",
+             "--module", "esnext", "--moduleResolution", "bundler", "--pretty", "false", *files],
+            cwd=workdir, capture_output=True, text=True, timeout=TOOL_TIMEOUT,
+        )
+        if "error TS" in tsc.stdout or tsc.returncode == 0:
+            result.compiles = tsc.returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        pass
+
+    if not any(".spec." in f or ".test." in f for f in files):
+        result.tests_passed = False
+        return
+    (workdir / "vitest.config.mjs").write_text(VITEST_CONFIG)
+    report_file = workdir / "vitest-report.json"
+    try:
+        subprocess.run(
+            ["npx", "--no-install", "vitest", "run", "--config", "vitest.config.mjs", "--reporter=json",
+             f"--outputFile={report_file}"],
+            cwd=workdir, capture_output=True, text=True, timeout=TOOL_TIMEOUT,
+        )
+        report = json.loads(report_file.read_text())
+    except (OSError, subprocess.TimeoutExpired, ValueError):
+        return
+    result.tests_total = report.get("numTotalTests", 0)
+    result.tests_failed = report.get("numFailedTests", 0) + report.get("numFailedTestSuites", 0)
+    result.tests_passed = result.tests_total > 0 and result.tests_failed == 0 and report.get("success", False)
+
+
+def run_feature(module, feature: Dict[str, str], workdir: Path) -> FeatureResult:
+    """Прогнать пайплайн для одной фичи в отдельном рабочем каталоге и без кэша ответов"""
+    result = FeatureResult(feature=feature["id"])
+    agents = {role: getattr(module, role, None) for _, role, _, _ in PIPELINE}
+    assistants = [agent for agent in agents.values() if agent is not None]
+    for agent in assistants:
+        agent.client.clear_usage_summary()
+
+    driver = SandboxedUserProxyAgent(
+        name=f"Bench-{feature['id']}",
+        human_input_mode="NEVER",
+        max_consecutive_auto_reply=MAX_AUTO_REPLY,
+        code_execution_config={"work_dir": str(workdir), "use_docker": False},
+        sandbox=SandboxLimits(),
+    )
+    artifacts: Dict[str, StepArtifact] = {}
+    started = time.monotonic()
+    # Свежий кэш на каждую фичу: повторные прогоны не должны отвечать из кэша AutoGen
+    with Cache.disk(cache_seed=f"bench-{time.time_ns()}", cache_path_root=str(workdir / ".autogen-cache")) as cache:
+        try:
+            for step, role, task, inputs in PIPELINE:
+                agent = agents[role]
+                if agent is None:
+                    continue
+                step_started = time.monotonic()
+                chat = driver.initiate_chat(
+                    agent,
+                    message=handoff_message(task.format(feature=feature["description"]),
+                                            [artifacts[name] for name in inputs if name in artifacts]),
+                    cache=cache,
+                )
+                result.steps_s[step] = round(time.monotonic() - step_started, 2)
+                result.llm_rounds += sum(1 for message in chat.chat_history if message.get("name") == agent.name)
+                artifacts[step] = extract_artifact(step, agent, chat)
+        except Exception as e:
+            result.error = f"{type(e).__name__}: {e}"
+    result.wall_s = round(time.monotonic() - started, 2)
+
+    usage = _usage(assistants)
+    result.prompt_tokens, result.completion_tokens = usage["prompt_tokens"], usage["completion_tokens"]
+    runs = [run for run in sandbox_runs() if run["agent"] == driver.name]
+    result.exec_runs = len(runs)
+    result.exec_s = round(sum(run["wall_s"] for run in runs), 2)
+
+    result.files = write_files([artifacts[s] for s in ("code", "tests") if s in artifacts], workdir)
+    check_quality(workdir, result.files, result)
+    result.quality_pass = bool(result.tests_passed) and result.compiles is not False
+    return result
+
+
+def summarize(results: List[FeatureResult]) -> Dict[str, Any]:
+    wall = sum(r.wall_s for r in results)
+    completion = sum(r.completion_tokens for r in results)
+    return {
+        "features": len(results),
+        "wall_s": round(wall, 1),
+        "mean_wall_s": round(wall / len(results), 1) if results else 0.0,
+        "prompt_tokens": sum(r.prompt_tokens for r in results),
+        "completion_tokens": completion,
+        "completion_tokens_per_s": round(completion / wall, 2) if wall else 0.0,
+        "llm_rounds": sum(r.llm_rounds for r in results),
+        "exec_s": round(sum(r.exec_s for r in results), 1),
+        "quality_pass_rate": round(sum(r.quality_pass for r in results) / len(results), 3) if results else 0.0,
+        "errors": sum(r.error is not None for r in results),
+    }
+
+
+def run_benchmark(config: str, feature_ids: Optional[List[str]] = None, keep_workdirs: bool = False) -> Path:
+    """
+    Прогнать корпус для одной конфигурации и сохранить результат
+
+    Returns:
+        Путь к файлу результатов .cache/benchmarks/<config>/<commit>-<время>.json
+    """
+    corpus = json.loads(CORPUS_FILE.read_text(encoding="utf-8"))
+    features = [f for f in corpus["features"] if not feature_ids or f["id"] in feature_ids]
+    module = importlib.import_module(CONFIGS[config])
+    models = {role: _model_of(getattr(module, role)) for _, role, _, _ in PIPELINE if hasattr(module, role)}
+    commit = git_commit()
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+
+    print(f"\n📊 Бенчмарк {config} ({CONFIGS[config]}), коммит {commit}, фич: {len(features)}")
+    results = []
+    for feature in features:
+        workdir = WORK_DIR / f"{config}-{feature['id']}-{stamp}"
+        workdir.mkdir(parents=True, exist_ok=True)
+        result = run_feature(module, feature, workdir)
+        results.append(result)
+        status = "✅" if result.quality_pass else "❌"
+        print(f"   {status} {feature['id']}: {result.wall_s}s, токенов {result.completion_tokens}, "
+              f"раундов {result.llm_rounds}, тесты {result.tests_total - result.tests_failed}/{result.tests_total}"
+              + (f", ошибка: {result.error}" if result.error else ""))
+        if not keep_workdirs:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    record = {
+        "config": config,
+        "module": CONFIGS[config],
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "corpus_version": corpus["version"],
+        "models": models,
+        "summary": summarize(results),
+        "features": [asdict(r) for r in results],
+    }
+    path = RESULTS_DIR / config / f"{commit}-{stamp}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(record, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"   Итог: {record['summary']}\n   Результат: {path.relative_to(REPO_ROOT)}")
+    return path
+
+
+def compare(commit: Optional[str] = None):
+    """Таблица последних результатов каждой конфигурации (или для указанного коммита)"""
+    rows = []
+    for config_dir in sorted(RESULTS_DIR.glob("*")):
+        files = sorted(config_dir.glob(f"{commit}*.json" if commit else "*.json"), key=lambda p: p.stat().st_mtime)
+        if files:
+            rows.append(json.loads(files[-1].read_text(encoding="utf-8")))
+    if not rows:
+        print("Результатов нет")
+        return
+    header = f"{'конфигурация':<12} {'коммит':<14} {'фич':>4} {'ср.время':>9} {'ток/с':>7} {'раунды':>7} " \
+             f"{'код,с':>7} {'качество':>9}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        s = row["summary"]
+        print(f"{row['config']:<12} {row['commit']:<14} {s['features']:>4} {s['mean_wall_s']:>8}s "
+              f"{s['completion_tokens_per_s']:>7} {s['llm_rounds']:>7} {s['exec_s']:>7} {s['quality_pass_rate']:>9.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк конфигураций агентов")
+    parser.add_argument("--configs", nargs="+", choices=sorted(CONFIGS), default=["optimized"])
+    parser.add_argument("--features", nargs="+", help="id фич из corpus.json (по умолчанию все)")
+    parser.add_argument("--keep-workdirs", action="store_true", help="Не удалять сгенерированные файлы")
+    parser.add_argument("--compare", nargs="?", const="", metavar="COMMIT", help="Сравнить сохраненные результаты")
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        compare(args.compare or None)
+        return
+    for config in args.configs:
+        run_benchmark(config, args.features, args.keep_workdirs)
+    compare()
+
+
+if __name__ == "__main__":
+    main()
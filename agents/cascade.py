@@ -0,0 +1,410 @@
+"""
+Каскад моделей: от маленькой к большой
+Запрос сначала отвечает самая маленькая подходящая модель, ответ проверяет
+дешевый валидатор (синтаксис/компиляция, прогон тестов или структурированная
+самопроверка). К следующей, более крупной модели запрос уходит только при
+провале проверки. Статистика эскалаций по типу задачи определяет, с какой
+модели начинать: если маленькая модель на этом типе задач почти всегда
+проваливается, ее пропускают (с периодической перепроверкой)
+
+Использование:
+    from devops_agent_optimized import code_cascade
+    result = code_cascade.run("Напиши функцию slugify на TypeScript", task_type="ts-function")
+    print(result.output, result.model, result.escalations)
+"""
+
+import json
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from artifacts import StepArtifact, extract_artifact
+from llm_client import CircuitOpenError, OllamaModelClient
+from sandbox import SandboxLimits, run_sandboxed
+from structured_output import single_reply
+from tracing import span
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+STATS_DIR = REPO_ROOT / ".cache" / "cascade"
+
+# Сколько последних исходов учитывать на пару (тип задачи, модель)
+STATS_WINDOW = 50
+
+TOOL_TIMEOUT = 60
+
+# Синтаксические ошибки TypeScript — коды TS1xxx (остальные зависят от окружения)
+TS_SYNTAX_ERROR = re.compile(r"error (TS1\d{3}): (.*)")
+
+# Файлы проверяются по одному, без tsconfig: декораторы NestJS/Angular включены как в
+# tsconfig.base.json (иначе @Body()/@Inject() дают TS1206), moduleDetection force —
+# фрагмент без import/export тоже модуль (без --isolatedModules: TS1208 и TS1272
+# на таких фрагментах — не синтаксис)
+TSC_FLAGS = ("--noEmit", "--noResolve", "--skipLibCheck", "--experimentalDecorators", "--emitDecoratorMetadata",
+             "--moduleDetection", "force", "--target", "es2022", "--module", "esnext", "--pretty", "false")
+
+SELF_CHECK_PROMPT = """Проверь, решает ли ответ задачу. Оцени только явные ошибки:
+не то, что просили; незавершенный или нерабочий код; пропущенные требования.
+
+Задача:
+{task}
+
+Ответ:
+{reply}
+
+Ответь строго JSON-объектом {{"ok": true|false, "issues": ["..."]}}."""
+
+
+@dataclass
+class Verdict:
+    """Результат одного валидатора"""
+    ok: bool
+    validator: str
+    reason: str = ""
+
+
+# Валидатор: (задача, текст ответа, артефакт с блоками кода) -> Verdict
+Validator = Callable[[str, str, StepArtifact], Verdict]
+
+
+# ============================================
+# ВАЛИДАТОРЫ
+# ============================================
+
+def _tsc_syntax(files: List[Path], cwd: Path) -> Optional[str]:
+    """Синтаксические ошибки TS; None — ошибок нет или tsc недоступен"""
+    try:
+        result = subprocess.run(
+            ["npx", "--no-install", "tsc", *TSC_FLAGS, *[str(f) for f in files]],
+            cwd=cwd, capture_output=True, text=True, timeout=TOOL_TIMEOUT,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    errors = TS_SYNTAX_ERROR.findall(result.stdout)
+    return "; ".join(f"{code}: {message}" for code, message in errors[:5]) or None
+
+
+def syntax_check(task: str, reply: str, artifact: StepArtifact) -> Verdict:
+    """
+    Ответ содержит код, и код синтаксически корректен
+
+    Python — compile(), JSON — json.loads, JS — node --check,
+    TypeScript — tsc без разрешения импортов (учитываются только ошибки TS1xxx).
+    Если инструмента нет, соответствующая проверка пропускается.
+    """
+    if not artifact.code_blocks:
+        return Verdict(False, "syntax", "в ответе нет блока кода")
+    problems = []
+    with tempfile.TemporaryDirectory(prefix="cascade-") as tmp:
+        ts_files: List[Path] = []
+        for index, block in enumerate(artifact.code_blocks):
+            lang = (block.lang or "").lower()
+            suffix = Path(block.path).suffix.lower() if block.path else ""
+            if lang in ("python", "py") or suffix == ".py":
+                try:
+                    compile(block.code, block.path or f"<block {index}>", "exec")
+                except SyntaxError as e:
+                    problems.append(f"{block.path or 'python'}:{e.lineno}: {e.msg}")
+            elif lang == "json" or suffix == ".json":
+                try:
+                    json.loads(block.code)
+                except ValueError as e:
+                    problems.append(f"{block.path or 'json'}: {e}")
+            elif lang in ("javascript", "js", "mjs") or suffix in (".js", ".mjs"):
+                source = Path(tmp) / f"block{index}.mjs"
+                source.write_text(block.code, encoding="utf-8")
+                try:
+                    check = subprocess.run(["node", "--check", str(source)], capture_output=True, text=True,
+                                           timeout=TOOL_TIMEOUT)
+                except (OSError, subprocess.TimeoutExpired):
+                    continue
+                if check.returncode != 0:
+                    problems.append(f"{block.path or 'js'}: {check.stderr.strip().splitlines()[-1:]}")
+            elif lang in ("typescript", "ts", "tsx") or suffix in (".ts", ".tsx"):
+                source = Path(tmp) / f"block{index}{'.tsx' if suffix == '.tsx' or lang == 'tsx' else '.ts'}"
+                source.write_text(block.code, encoding="utf-8")
+                ts_files.append(source)
+        if ts_files:
+            ts_errors = _tsc_syntax(ts_files, REPO_ROOT)
+            if ts_errors:
+                problems.append(ts_errors)
+    return Verdict(not problems, "syntax", "; ".join(problems))
+
+
+class TestRunValidator:
+    """
+    Записать блоки кода с путями в рабочий каталог и выполнить команду тестов в песочнице
+
+    Args:
+        command: Команда, например ["npx", "--no-install", "vitest", "run"]
+        work_dir: Каталог (по умолчанию временный; в нем же запускается команда)
+        timeout: Таймаут команды, сек
+        limits: Ограничения песочницы
+    """
+
+    def __init__(self, command: Sequence[str], work_dir: Optional[str] = None, timeout: float = 300,
+                 limits: Optional[SandboxLimits] = None):
+        self.command = list(command)
+        self.work_dir = work_dir
+        self.timeout = timeout
+        self.limits = limits or SandboxLimits()
+
+    def __call__(self, task: str, reply: str, artifact: StepArtifact) -> Verdict:
+        blocks = [block for block in artifact.code_blocks if block.path and ".." not in Path(block.path).parts]
+        if not blocks:
+            return Verdict(False, "tests", "в ответе нет файлов с путями")
+        with tempfile.TemporaryDirectory(prefix="cascade-tests-") as tmp:
+            root = Path(self.work_dir or tmp)
+            for block in blocks:
+                target = root / block.path.lstrip("/")
+                target.parent.mkdir(parents=True, exist_ok=True)
+                target.write_text(block.code + "\n", encoding="utf-8")
+            run, stdout, stderr = run_sandboxed(self.command, str(root), self.limits, self.timeout,
+                                                agent="cascade", lang="sh")
+        if run.exitcode == 0:
+            return Verdict(True, "tests")
+        tail = (stdout + stderr).strip().splitlines()[-15:]
+        return Verdict(False, "tests", f"exitcode {run.exitcode}: " + "\n".join(tail))
+
+
+class SelfCheckValidator:
+    """
+    Структурированная самопроверка маленькой моделью (JSON-режим)
+
+    Неразобранный ответ проверяющей модели не считается провалом: ошибка
+    валидатора не должна тратить время большой модели.
+
+    Args:
+        llm_config: Конфиг проверяющей модели (llm_config агента или конфиг OllamaModelClient)
+    """
+
+    def __init__(self, llm_config: Dict[str, Any]):
+        config = llm_config["config_list"][0] if "config_list" in llm_config else llm_config
+        self.client = OllamaModelClient(config)
+
+    def __call__(self, task: str, reply: str, artifact: StepArtifact) -> Verdict:
+        try:
+            response = self.client.create({
+                "messages": [{"role": "user", "content": SELF_CHECK_PROMPT.format(task=task, reply=reply[:12000])}],
+                "temperature": 0.0,
+                "response_format": {"type": "json_object"},
+            })
+            data = json.loads(response.choices[0].message.content or "")
+        except (CircuitOpenError, ValueError, KeyError, IndexError):
+            return Verdict(True, "self_check", "самопроверка не выполнена")
+        if not isinstance(data, dict) or data.get("ok") is not False:
+            return Verdict(True, "self_check")
+        issues = data.get("issues") if isinstance(data.get("issues"), list) else []
+        return Verdict(False, "self_check", "; ".join(str(issue) for issue in issues[:5]) or "модель отклонила ответ")
+
+
+# ============================================
+# КАСКАД
+# ============================================
+
+@dataclass
+class CascadeAttempt:
+    tier: int
+    agent: str
+    model: str
+    ok: bool
+    seconds: float
+    verdicts: List[Verdict] = field(default_factory=list)
+
+
+@dataclass
+class CascadeResult:
+    output: str
+    ok: bool
+    tier: int
+    agent: str
+    model: str
+    task_type: str
+    attempts: List[CascadeAttempt] = field(default_factory=list)
+
+    @property
+    def escalations(self) -> int:
+        return max(0, len(self.attempts) - 1)
+
+    @property
+    def artifact(self) -> StepArtifact:
+        return extract_artifact("cascade", self.agent, [self.output])
+
+
+def _model_of(agent) -> str:
+    config = agent.llm_config or {}
+    entries = config.get("config_list") or [config]
+    return entries[0].get("model", "?")
+
+
+_cascades: Dict[str, "ModelCascade"] = {}
+
+
+class ModelCascade:
+    """
+    Каскад агентов от маленькой модели к большой
+
+    Args:
+        name: Имя каскада (файл статистики .cache/cascade/<name>.json)
+        tiers: Агенты в порядке возрастания размера модели
+        validators: Проверки ответа; ответ принят, если прошли все
+        min_samples: Сколько исходов нужно, прежде чем пропускать уровень
+        pass_threshold: Доля успехов, ниже которой уровень пропускается
+        explore_every: Каждый N-й запрос типа начинается с первого уровня,
+            чтобы статистика пропущенных уровней обновлялась
+        stats_dir: Каталог статистики (None — не сохранять на диск)
+    """
+
+    def __init__(self, name: str, tiers: Sequence[Any], validators: Sequence[Validator] = (syntax_check,),
+                 min_samples: int = 5, pass_threshold: float = 0.4, explore_every: int = 10,
+                 stats_dir: Optional[Path] = STATS_DIR):
+        if not tiers:
+            raise ValueError("Каскаду нужен хотя бы один агент")
+        self.name = name
+        self.tiers = list(tiers)
+        self.validators = list(validators)
+        self.min_samples = min_samples
+        self.pass_threshold = pass_threshold
+        self.explore_every = explore_every
+        self.stats_file = stats_dir / f"{name}.json" if stats_dir else None
+        self._lock = threading.Lock()
+        # тип задачи -> агент -> последние исходы (1 — прошел проверку)
+        self._outcomes: Dict[str, Dict[str, deque]] = {}
+        self._requests: Dict[str, int] = {}
+        self._load()
+        _cascades[name] = self
+
+    # ---------- статистика ----------
+
+    def _load(self):
+        if not self.stats_file or not self.stats_file.exists():
+            return
+        try:
+            data = json.loads(self.stats_file.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        for task_type, by_agent in data.get("outcomes", {}).items():
+            self._outcomes[task_type] = {agent: deque(values, maxlen=STATS_WINDOW) for agent, values in by_agent.items()}
+        self._requests = {key: int(value) for key, value in data.get("requests", {}).items()}
+
+    def _save_locked(self):
+        if not self.stats_file:
+            return
+        self.stats_file.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "outcomes": {task_type: {agent: list(values) for agent, values in by_agent.items()}
+                         for task_type, by_agent in self._outcomes.items()},
+            "requests": self._requests,
+        }
+        temporary = self.stats_file.with_suffix(".tmp")
+        temporary.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(temporary, self.stats_file)
+
+    def _record(self, task_type: str, attempts: List[CascadeAttempt]):
+        with self._lock:
+            by_agent = self._outcomes.setdefault(task_type, {})
+            for attempt in attempts:
+                by_agent.setdefault(attempt.agent, deque(maxlen=STATS_WINDOW)).append(int(attempt.ok))
+            self._save_locked()
+
+    def pass_rate(self, task_type: str, tier: int) -> Optional[float]:
+        outcomes = self._outcomes.get(task_type, {}).get(self.tiers[tier].name)
+        if not outcomes or len(outcomes) < self.min_samples:
+            return None
+        return sum(outcomes) / len(outcomes)
+
+    def start_tier(self, task_type: str) -> int:
+        """Первый уровень, у которого мало данных или достаточная доля успехов"""
+        for tier in range(len(self.tiers) - 1):
+            rate = self.pass_rate(task_type, tier)
+            if rate is None or rate >= self.pass_threshold:
+                return tier
+        return len(self.tiers) - 1
+
+    # ---------- выполнение ----------
+
+    def _validate(self, task: str, reply: str) -> List[Verdict]:
+        artifact = extract_artifact("cascade", "reply", [reply])
+        verdicts = []
+        for validator in self.validators:
+            verdict = validator(task, reply, artifact)
+            verdicts.append(verdict)
+            if not verdict.ok:
+                break
+        return verdicts
+
+    def run(self, task: str, task_type: str = "default", start: Optional[int] = None) -> CascadeResult:
+        """
+        Выполнить задачу каскадом
+
+        Args:
+            task: Задача (одно сообщение пользователя)
+            task_type: Тип задачи для статистики (например "ts-function", "dockerfile")
+            start: Начать с указанного уровня (по умолчанию — по статистике)
+
+        Returns:
+            CascadeResult с принятым ответом или ответом последнего уровня, если не прошел ни один
+        """
+        with self._lock:
+            self._requests[task_type] = self._requests.get(task_type, 0) + 1
+            explore = self.explore_every > 0 and self._requests[task_type] % self.explore_every == 0
+        if start is None:
+            start = 0 if explore else self.start_tier(task_type)
+
+        attempts: List[CascadeAttempt] = []
+        reply = ""
+        message = task
+        with span(f"cascade {self.name}", "step", task_type=task_type, start_tier=start) as cascade_span:
+            for tier in range(start, len(self.tiers)):
+                agent = self.tiers[tier]
+                started = time.monotonic()
+                with span(agent.name, "step", tier=tier, model=_model_of(agent)) as attempt_span:
+                    raw = single_reply(agent, message)
+                    reply = raw if isinstance(raw, str) else (raw or {}).get("content") or ""
+                    verdicts = self._validate(task, reply)
+                    ok = all(verdict.ok for verdict in verdicts)
+                    attempt_span.set(ok=ok)
+                attempts.append(CascadeAttempt(tier, agent.name, _model_of(agent), ok,
+                                               round(time.monotonic() - started, 2), verdicts))
+                if ok:
+                    break
+                # Следующий уровень получает причину провала, но не сам неудачный ответ
+                reasons = "; ".join(f"{v.validator}: {v.reason}" for v in verdicts if not v.ok)
+                message = f"{task}\n\nПредыдущее решение не прошло проверку ({reasons}). Учти это."
+            cascade_span.set(final_tier=attempts[-1].tier, escalations=len(attempts) - 1)
+
+        self._record(task_type, attempts)
+        last = attempts[-1]
+        return CascadeResult(reply, last.ok, last.tier, last.agent, last.model, task_type, attempts)
+
+    def status(self) -> Dict[str, Any]:
+        """Доля успехов по уровням и текущий стартовый уровень для каждого типа задач"""
+        with self._lock:
+            task_types = sorted(self._outcomes)
+            return {
+                task_type: {
+                    "start": self.tiers[self.start_tier(task_type)].name,
+                    "requests": self._requests.get(task_type, 0),
+                    "tiers": {
+                        agent.name: {
+                            "samples": len(self._outcomes[task_type].get(agent.name, ())),
+                            "pass_rate": None if self.pass_rate(task_type, tier) is None
+                            else round(self.pass_rate(task_type, tier), 3),
+                        }
+                        for tier, agent in enumerate(self.tiers)
+                    },
+                }
+                for task_type in task_types
+            }
+
+
+def cascade_status() -> Dict[str, Dict[str, Any]]:
+    """Статистика всех созданных каскадов"""
+    return {name: cascade.status() for name, cascade in _cascades.items()}
+
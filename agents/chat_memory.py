@@ -0,0 +1,251 @@
+"""
+История чатов долгоживущих агентов с ограничением памяти
+Агенты devops_agent_complete — синглтоны модуля: AutoGen хранит историю с
+каждым собеседником (_oai_messages) до следующего чата с ним, и в процессе
+воркера или ноутбука она копится между прогонами, отнимая RAM у Ollama.
+
+Прогон (create_feature, update_service...) — область истории: сообщения
+записываются в стенограмму прогона, по его завершении история агентов
+очищается. В памяти остаются последние CHAT_HISTORY_RUNS стенограмм (не больше
+CHAT_HISTORY_MB), более старые выгружаются на диск в .cache/chat-history.
+
+Использование:
+    memory = ChatMemory([user, coder, tester])
+
+    @memory.scoped("create_feature")
+    def create_feature(...): ...
+
+    memory_status()  # сообщения и объем истории по агентам, RSS процесса
+    memory.runs[-1].messages  # стенограмма последнего прогона
+"""
+
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+from autogen import ConversableAgent
+
+HISTORY_DIR = Path(os.getenv("CHAT_HISTORY_DIR", Path(__file__).resolve().parent.parent / ".cache" / "chat-history"))
+CHAT_HISTORY_RUNS = int(os.getenv("CHAT_HISTORY_RUNS", "3"))
+CHAT_HISTORY_MB = float(os.getenv("CHAT_HISTORY_MB", "32"))
+
+MB = 1024 * 1024
+
+
+def message_bytes(message: Any) -> int:
+    """Приблизительный объем сообщения (текст, вызовы инструментов) в байтах"""
+    if isinstance(message, str):
+        return len(message.encode("utf-8"))
+    return len(json.dumps(message, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+# ============================================
+# СТЕНОГРАММА ПРОГОНА
+# ============================================
+
+@dataclass
+class RunHistory:
+    """Сообщения одного прогона в порядке отправки"""
+    id: int
+    name: str
+    started_at: str
+    seconds: float = 0.0
+    messages: List[Dict[str, Any]] = field(default_factory=list)
+    bytes: int = 0
+    path: Optional[str] = None  # файл, если стенограмма выгружена на диск
+
+    def add(self, sender: str, recipient: str, message: Any):
+        entry = {"sender": sender, "recipient": recipient,
+                 **({"content": message} if isinstance(message, str) else message)}
+        self.messages.append(entry)
+        self.bytes += message_bytes(message)
+
+    def spill(self, directory: Path = HISTORY_DIR) -> str:
+        """Записать стенограмму на диск и освободить сообщения в памяти"""
+        directory.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.fromisoformat(self.started_at).strftime("%Y%m%d-%H%M%S")
+        path = directory / f"{self.name}-{stamp}-{os.getpid()}-{self.id}.json"
+        path.write_text(json.dumps(asdict(self), ensure_ascii=False, default=str), encoding="utf-8")
+        self.path = str(path)
+        self.messages = []
+        return self.path
+
+
+def load_run(path: str) -> RunHistory:
+    """Прочитать выгруженную стенограмму"""
+    return RunHistory(**json.loads(Path(path).read_text(encoding="utf-8")))
+
+
+_current_run: ContextVar[Optional[RunHistory]] = ContextVar("chat_run", default=None)
+
+
+# ============================================
+# ПАМЯТЬ АГЕНТОВ
+# ============================================
+
+class ChatMemory:
+    """
+    Области истории для группы агентов
+
+    Args:
+        agents: Агенты, чья история очищается по завершении прогона
+        max_runs: Сколько последних стенограмм держать в памяти
+        max_mb: Предел объема стенограмм в памяти
+        directory: Каталог выгруженных стенограмм
+    """
+
+    def __init__(self, agents: Iterable[ConversableAgent] = (), max_runs: int = CHAT_HISTORY_RUNS,
+                 max_mb: float = CHAT_HISTORY_MB, directory: Path = HISTORY_DIR):
+        self.agents: List[ConversableAgent] = []
+        self.max_runs = max_runs
+        self.max_bytes = int(max_mb * MB)
+        self.directory = directory
+        self.runs: Deque[RunHistory] = deque()
+        self.spilled: Deque[str] = deque(maxlen=100)
+        self.completed = 0
+        self.released_bytes = 0
+        self._ids = itertools.count(1)
+        self._active = 0
+        self._lock = threading.Lock()
+        self.track(*agents)
+        _memories.append(self)
+
+    def track(self, *agents: ConversableAgent):
+        """Записывать отправленные агентами сообщения в стенограмму текущего прогона"""
+        for agent in agents:
+            if agent not in self.agents:
+                agent.register_hook("process_message_before_send", _record)
+                self.agents.append(agent)
+
+    @contextmanager
+    def run(self, name: str):
+        """
+        Область истории одного прогона
+
+        Вложенный прогон пишет в стенограмму внешнего. История агентов
+        очищается, когда завершается последний из параллельных прогонов.
+        """
+        if _current_run.get() is not None:
+            yield _current_run.get()
+            return
+        history = RunHistory(next(self._ids), name, datetime.now().isoformat(timespec="seconds"))
+        token = _current_run.set(history)
+        with self._lock:
+            self._active += 1
+        started = time.monotonic()
+        try:
+            yield history
+        finally:
+            history.seconds = round(time.monotonic() - started, 3)
+            _current_run.reset(token)
+            with self._lock:
+                self._active -= 1
+                self.completed += 1
+                self.runs.append(history)
+                self._evict()
+                if self._active == 0:
+                    self.released_bytes += self.release()
+
+    def scoped(self, name: str):
+        """Декоратор: функция выполняется как прогон run(name)"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.run(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _evict(self):
+        """Выгрузить старые стенограммы сверх max_runs / max_bytes"""
+        while self.runs and (len(self.runs) > self.max_runs or self.retained_bytes() > self.max_bytes):
+            self.spilled.append(self.runs.popleft().spill(self.directory))
+
+    def retained_bytes(self) -> int:
+        return sum(run.bytes for run in self.runs)
+
+    def release(self, agents: Optional[Iterable[ConversableAgent]] = None) -> int:
+        """
+        Очистить историю агентов (по умолчанию всех отслеживаемых)
+
+        Returns:
+            Освобожденный объем в байтах
+        """
+        released = 0
+        for agent in agents or self.agents:
+            released += agent_memory(agent)["bytes"]
+            agent.clear_history()
+            agent._human_input = []
+        return released
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "runs_completed": self.completed,
+                "runs_active": self._active,
+                "runs_in_memory": len(self.runs),
+                "retained_kb": round(self.retained_bytes() / 1024, 1),
+                "runs_spilled": len(self.spilled),
+                "released_kb": round(self.released_bytes / 1024, 1),
+            }
+
+
+_memories: List[ChatMemory] = []
+
+
+def _record(sender: ConversableAgent, message: Any, recipient: Any, silent: bool) -> Any:
+    history = _current_run.get()
+    if history is not None:
+        history.add(sender.name, getattr(recipient, "name", str(recipient)), message)
+    return message
+
+
+# ============================================
+# УЧЕТ ПАМЯТИ
+# ============================================
+
+def agent_memory(agent: ConversableAgent) -> Dict[str, Any]:
+    """Собеседники, число сообщений и объем истории агента"""
+    histories = [messages for messages in agent.chat_messages.values() if messages]
+    return {
+        "partners": len(histories),
+        "messages": sum(len(messages) for messages in histories),
+        "bytes": sum(message_bytes(message) for messages in histories for message in messages)
+                 + sum(message_bytes(text) for text in getattr(agent, "_human_input", [])),
+    }
+
+
+def process_rss_mb() -> Optional[float]:
+    """Резидентная память процесса (Linux), МБ"""
+    try:
+        with open("/proc/self/status", encoding="utf-8") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def memory_status() -> Dict[str, Any]:
+    """История по агентам, стенограммы прогонов и RSS процесса (аналогично sandbox_status)"""
+    agents: Dict[str, Dict[str, Any]] = {}
+    runs: Dict[str, Any] = {}
+    for memory in _memories:
+        for agent in memory.agents:
+            stats = agent_memory(agent)
+            agents[agent.name] = {"partners": stats["partners"], "messages": stats["messages"],
+                                  "kb": round(stats["bytes"] / 1024, 1)}
+        for key, value in memory.status().items():
+            runs[key] = runs.get(key, 0) + value
+    return {"agents": agents, "runs": runs, "rss_mb": process_rss_mb()}
@@ -0,0 +1,539 @@
+"""
+Рефакторинг больших файлов по частям (map-reduce)
+Файл целиком в одном сообщении Refactorer'у обрезается по контексту модели,
+а задолго до этого оценка промпта на CPU становится очень медленной.
+Здесь файл делится по синтаксическим границам (классы и функции: ast для
+Python, сканер скобок для TypeScript/JavaScript), части перерабатываются
+параллельно по слотам Ollama с общей сводкой символов файла, затем
+собираются обратно и проверяются. Часть, ответ на которую не прошел проверку,
+остается исходной
+
+Использование:
+    from devops_agent_optimized import refactorer
+    result = refactor_file(refactorer, "libs/backend/domain/auth/src/auth.service.ts",
+                           "Вынеси повторяющуюся валидацию в приватные методы")
+    result.valid, result.summary(); result.write()
+
+    python chunked_refactor.py path/to/file.ts "Упрости обработку ошибок" [--write]
+"""
+
+import argparse
+import ast
+import contextvars
+import importlib
+import os
+import re
+import sys
+import textwrap
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from artifacts import CODE_BLOCK_PATTERN, CodeBlock, StepArtifact
+from cascade import Verdict, syntax_check
+from structured_output import single_reply
+from tracing import span
+
+# Сколько запросов Ollama обрабатывает одновременно (OLLAMA_NUM_PARALLEL на сервере)
+DEFAULT_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+
+# Размер части в символах (~1500 токенов: промпт части оценивается за секунды, а не минуты)
+DEFAULT_CHUNK_CHARS = int(os.getenv("REFACTOR_CHUNK_CHARS", "6000"))
+
+MAX_SUMMARY_CHARS = 3000
+
+LANGS = {".py": "python", ".ts": "typescript", ".tsx": "tsx", ".js": "javascript", ".mjs": "javascript"}
+
+REFACTOR_PROMPT = """Отрефактори часть {index}/{total} файла {path}.
+
+Задача: {instruction}
+
+Символы всего файла (на них ссылаются другие части — имена и сигнатуры не меняй):
+{summary}
+
+Часть файла{note}:
+```{lang}
+{code}
+```
+
+Верни только переработанную часть одним блоком ```{lang}``` — без остального файла и без пояснений."""
+
+# Объявления верхнего уровня в TS/JS
+TS_DECLARATION = re.compile(
+    r"^([ \t]*)(?:export\s+)?(?:default\s+)?(?:declare\s+)?(?:abstract\s+)?(?:async\s+)?"
+    r"(?:function\*?|class|interface|type|enum|const|let|var|namespace)\s+([A-Za-z_$][\w$]*)",
+    re.MULTILINE,
+)
+
+# Член класса TS/JS: отступ и имя метода, свойства, конструктора или аксессора
+TS_MEMBER = re.compile(
+    r"^([ \t]*)(?:(?:public|private|protected|static|async|readonly|override|abstract|declare|get|set)\s+)*"
+    r"([A-Za-z_$#][\w$]*)\s*[(<:=?!;]",
+    re.MULTILINE,
+)
+
+# Строки, которыми продолжается предыдущая конструкция TS (цепочки, else, catch)
+TS_CONTINUATION = re.compile(r"^\s*(?:[.?:)\]}]|else\b|catch\b|finally\b|extends\b|implements\b)")
+
+
+# ============================================
+# РАЗБИЕНИЕ
+# ============================================
+
+@dataclass
+class Unit:
+    """Синтаксическая единица файла: текст, признак переработки и отступ"""
+    code: str
+    refactor: bool
+    label: str = ""
+    indent: str = ""
+
+
+def _python_units(source: str, max_chars: int) -> List[Unit]:
+    """
+    Единицы верхнего уровня Python; классы больше max_chars делятся на методы
+
+    Комментарии и пустые строки перед узлом относятся к нему.
+    """
+    tree = ast.parse(source)
+    lines = source.splitlines(keepends=True)
+    units: List[Unit] = []
+    previous_end = 0
+    for node in tree.body:
+        end = node.end_lineno or node.lineno
+        code = "".join(lines[previous_end:end])
+        is_definition = isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+        if isinstance(node, ast.ClassDef) and len(code) > max_chars:
+            units.extend(_python_class_units(node, lines, previous_end))
+        else:
+            units.append(Unit(code, is_definition, getattr(node, "name", "")))
+        previous_end = end
+    if previous_end < len(lines):
+        tail = "".join(lines[previous_end:])
+        if units:
+            units[-1].code += tail
+        else:
+            units.append(Unit(tail, False))
+    return units
+
+
+def _python_class_units(node: ast.ClassDef, lines: List[str], start: int) -> List[Unit]:
+    methods = [item for item in node.body if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef))]
+    if not methods:
+        return [Unit("".join(lines[start:node.end_lineno]), True, node.name)]
+    first = min([methods[0].lineno] + [decorator.lineno for decorator in methods[0].decorator_list])
+    units = [Unit("".join(lines[start:first - 1]), False, node.name)]
+    previous_end = first - 1
+    for method in methods:
+        code = "".join(lines[previous_end:method.end_lineno])
+        units.append(Unit(code, True, f"{node.name}.{method.name}", " " * method.col_offset))
+        previous_end = method.end_lineno
+    if previous_end < node.end_lineno:
+        units[-1].code += "".join(lines[previous_end:node.end_lineno])
+    return units
+
+
+def _line_depths(lines: List[str]) -> List[Tuple[int, bool]]:
+    """
+    Глубина скобок в конце каждой строки TS/JS и признак «внутри строки/комментария»
+
+    Строки, комментарии и шаблонные строки (с ${...}) не влияют на глубину;
+    литералы регулярных выражений со скобками не распознаются (редкость
+    на уровне объявлений, и собранный файл все равно проверяется целиком).
+    """
+    depths: List[Tuple[int, bool]] = []
+    depth = 0
+    state = None             # None, "'", '"', "`", "//", "/*"
+    template_depth: List[int] = []
+    for line in lines:
+        index = 0
+        while index < len(line):
+            char, pair = line[index], line[index:index + 2]
+            if state == "//":
+                break
+            if state == "/*":
+                if pair == "*/":
+                    state, index = None, index + 1
+            elif state in ("'", '"'):
+                if char == "\\":
+                    index += 1
+                elif char == state or char == "\n":
+                    state = None
+            elif state == "`":
+                if char == "\\":
+                    index += 1
+                elif char == "`":
+                    state = None
+                elif pair == "${":
+                    template_depth.append(depth)
+                    depth += 1
+                    state, index = None, index + 1
+            elif pair in ("//", "/*"):
+                state, index = pair, index + 1
+            elif char in "'\"`":
+                state = char
+            elif char in "{([":
+                depth += 1
+            elif char in "})]":
+                depth -= 1
+                if template_depth and depth == template_depth[-1] and char == "}":
+                    template_depth.pop()
+                    state = "`"
+            index += 1
+        if state == "//":
+            state = None
+        depths.append((depth, state is not None))
+    return depths
+
+
+def _significant(text: str) -> bool:
+    text = text.strip()
+    return bool(text) and not text.startswith(("//", "/*", "*", "@"))
+
+
+def _brace_segments(lines: List[str], depths: List[Tuple[int, bool]], level: int) -> List[List[str]]:
+    """
+    Разрезать строки там, где глубина возвращается к level
+
+    Конструкция заканчивается, если следующая строка ее не продолжает;
+    комментарии и декораторы присоединяются к следующему объявлению.
+    """
+    segments: List[List[str]] = []
+    current: List[str] = []
+    declared = False         # в текущем куске есть строка кода вне декораторов
+    decorator = False        # внутри многострочного декоратора (@ApiResponse({...}))
+    for number, line in enumerate(lines):
+        current.append(line)
+        before = depths[number - 1][0] if number else level
+        depth, open_literal = depths[number]
+        if before == level and line.strip().startswith("@"):
+            decorator = True
+        elif not decorator and _significant(line):
+            declared = True
+        if decorator and depth == level:
+            decorator = False
+        following = next((text for text in lines[number + 1:] if text.strip()), "")
+        if depth == level and not open_literal and declared and not TS_CONTINUATION.match(following):
+            segments.append(current)
+            current = []
+            declared = False
+    if current:
+        if segments:
+            segments[-1].extend(current)
+        else:
+            segments.append(current)
+    return segments
+
+
+def _brace_units(source: str, max_chars: int) -> List[Unit]:
+    """Единицы верхнего уровня TS/JS; классы больше max_chars делятся на члены"""
+    lines = source.splitlines(keepends=True)
+    depths = _line_depths(lines)
+    units: List[Unit] = []
+    position = 0
+    for segment in _brace_segments(lines, depths, 0):
+        code = "".join(segment)
+        name = TS_DECLARATION.search(code)
+        label = name.group(2) if name else ""
+        segment_depths = depths[position:position + len(segment)]
+        position += len(segment)
+        if len(code) > max_chars and re.search(r"^\s*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\b",
+                                               code, re.MULTILINE):
+            units.extend(_brace_class_units(segment, segment_depths, label))
+        else:
+            units.append(Unit(code, "{" in code and not code.lstrip().startswith("import"), label))
+    return units
+
+
+def _brace_class_units(lines: List[str], depths: List[Tuple[int, bool]], name: str) -> List[Unit]:
+    """Класс TS/JS: заголовок, члены класса по отдельности, закрывающая скобка"""
+    opening = next((number for number, (depth, _) in enumerate(depths) if depth == 1), None)
+    closing = len(lines) - 1
+    while closing > 0 and not lines[closing].strip():
+        closing -= 1
+    if opening is None or opening >= closing or depths[closing - 1][0] != 1:
+        return [Unit("".join(lines), True, name)]
+    body = lines[opening + 1:closing]
+    units = [Unit("".join(lines[:opening + 1]), False, name)]
+    for segment in _brace_segments(body, depths[opening + 1:closing], 1):
+        code = "".join(segment)
+        first = next((text for text in segment if text.strip()), segment[0])
+        indent = first[:len(first) - len(first.lstrip())]
+        member = next((match for match in TS_MEMBER.finditer(code) if match.group(1) == indent), None)
+        units.append(Unit(code, True, f"{name}.{member.group(2)}" if member else name, indent))
+    units.append(Unit("".join(lines[closing:]), False, name))
+    return units
+
+
+def split_units(source: str, lang: str, max_chars: int = DEFAULT_CHUNK_CHARS) -> List[Unit]:
+    """Синтаксические единицы файла; "".join(unit.code) == source"""
+    if lang == "python":
+        return _python_units(source, max_chars)
+    return _brace_units(source, max_chars)
+
+
+@dataclass
+class Chunk:
+    index: int
+    units: List[Unit]
+    refactor: bool
+
+    @property
+    def code(self) -> str:
+        return "".join(unit.code for unit in self.units)
+
+    @property
+    def indent(self) -> str:
+        return self.units[0].indent
+
+    @property
+    def labels(self) -> List[str]:
+        return [unit.label for unit in self.units if unit.label]
+
+
+def make_chunks(units: List[Unit], max_chars: int = DEFAULT_CHUNK_CHARS) -> List[Chunk]:
+    """
+    Соседние единицы объединяются в части до max_chars
+
+    Начальные импорты и прочие единицы без переработки идут отдельными
+    неизменяемыми частями; методы одного класса не смешиваются с кодом
+    верхнего уровня (у них свой отступ).
+    """
+    chunks: List[Chunk] = []
+    for unit in units:
+        last = chunks[-1] if chunks else None
+        if (last is not None and last.refactor == unit.refactor and last.indent == unit.indent
+                and len(last.code) + len(unit.code) <= max_chars):
+            last.units.append(unit)
+        else:
+            chunks.append(Chunk(len(chunks), [unit], unit.refactor))
+    return chunks
+
+
+def symbol_summary(source: str, lang: str, units: List[Unit]) -> str:
+    """Импорты и сигнатуры объявлений файла — общий контекст для всех частей"""
+    lines: List[str] = []
+    if lang == "python":
+        tree = ast.parse(source)
+        for node in tree.body:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                lines.append(ast.get_source_segment(source, node) or "")
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                lines.append(source.splitlines()[node.lineno - 1].strip())
+                if isinstance(node, ast.ClassDef):
+                    lines.extend("    " + source.splitlines()[item.lineno - 1].strip() for item in node.body
+                                 if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)))
+    else:
+        for unit in units:
+            for line in unit.code.splitlines():
+                text = line.strip()
+                if text and not text.startswith(("//", "/*", "*", "@")):
+                    lines.append(text[:160])
+                    break
+    summary = "\n".join(line for line in lines if line)
+    return summary if len(summary) <= MAX_SUMMARY_CHARS else summary[:MAX_SUMMARY_CHARS] + "\n..."
+
+
+def defined_names(code: str, lang: str) -> Set[str]:
+    """Имена, объявленные в части (для проверки, что переработка их сохранила)"""
+    if lang == "python":
+        tree = ast.parse(textwrap.dedent(code))
+        return {node.name for node in tree.body
+                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))}
+    # Только объявления уровня части: локальные переменные внутри функций можно переименовывать
+    indent = min((len(line) - len(line.lstrip()) for line in code.splitlines() if _significant(line)), default=0)
+    pattern = TS_MEMBER if indent else TS_DECLARATION
+    return {match.group(2) for match in pattern.finditer(code) if len(match.group(1)) == indent}
+
+
+# ============================================
+# ПЕРЕРАБОТКА
+# ============================================
+
+@dataclass
+class ChunkOutcome:
+    index: int
+    status: str  # refactored | unchanged | rejected | kept
+    chars: int
+    labels: List[str] = field(default_factory=list)
+    reason: str = ""
+    seconds: float = 0.0
+
+
+@dataclass
+class RefactorResult:
+    path: str
+    code: str
+    original: str
+    valid: bool
+    chunks: List[ChunkOutcome]
+    seconds: float
+    reason: str = ""
+
+    @property
+    def changed(self) -> bool:
+        return self.valid and self.code != self.original
+
+    def summary(self) -> Dict[str, Any]:
+        statuses = [chunk.status for chunk in self.chunks]
+        return {
+            "path": self.path,
+            "valid": self.valid,
+            "chunks": len(self.chunks),
+            **{status: statuses.count(status) for status in ("refactored", "unchanged", "rejected", "kept")},
+            "seconds": self.seconds,
+            "reason": self.reason,
+        }
+
+    def write(self) -> bool:
+        """Записать результат, если он прошел проверку и отличается от исходного"""
+        if not self.changed:
+            return False
+        Path(self.path).write_text(self.code, encoding="utf-8")
+        return True
+
+
+def _reply_code(reply: str, chunk: Chunk) -> Optional[str]:
+    """Самый длинный блок кода ответа с пустыми строками по краям как у исходной части"""
+    blocks = [match.group(2) for match in CODE_BLOCK_PATTERN.finditer(reply or "")]
+    if not blocks:
+        return None
+    code = max(blocks, key=len).strip("\n")
+    if chunk.indent and not code.startswith(chunk.indent):
+        # Модель убрала отступ методов — вернуть его
+        code = textwrap.indent(textwrap.dedent(code), chunk.indent)
+    stripped = chunk.code.strip("\n")
+    leading = chunk.code[:chunk.code.index(stripped)] if stripped else ""
+    return leading + code + chunk.code[len(leading) + len(stripped):]
+
+
+def _balanced(code: str) -> bool:
+    """Скобки TS/JS сбалансированы (проверка без tsc — для членов классов и при недоступном tsc)"""
+    depths = _line_depths(code.splitlines(keepends=True))
+    return not depths or (depths[-1] == (0, False) and min(depth for depth, _ in depths) >= 0)
+
+
+def _check_chunk(code: str, chunk: Chunk, lang: str, path: str) -> Optional[str]:
+    """Причина отклонить переработанную часть; None — часть годится"""
+    if lang == "python":
+        try:
+            compile(textwrap.dedent(code), path, "exec")
+        except SyntaxError as e:
+            return f"синтаксис: {e.msg} (строка {e.lineno})"
+    elif not _balanced(code):
+        return "несбалансированные скобки"
+    elif not chunk.indent:
+        verdict = syntax_check("", "", StepArtifact("refactor", "", [CodeBlock(lang, code, Path(path).name)]))
+        if not verdict.ok:
+            return f"синтаксис: {verdict.reason}"
+    try:
+        missing = defined_names(chunk.code, lang) - defined_names(code, lang)
+    except SyntaxError:
+        missing = set()
+    if missing:
+        return f"пропали объявления: {', '.join(sorted(missing))}"
+    return None
+
+
+def refactor_file(agent: Any, path: str, instruction: str, max_chars: int = DEFAULT_CHUNK_CHARS,
+                  parallel: int = DEFAULT_PARALLEL) -> RefactorResult:
+    """
+    Переработать файл по частям
+
+    Args:
+        agent: Агент-рефакторер (single_reply: без счетчика ответов и общей истории)
+        path: Файл (.py, .ts, .tsx, .js, .mjs)
+        instruction: Что сделать с кодом
+        max_chars: Размер части в символах
+        parallel: Сколько частей обрабатывать одновременно (по слотам Ollama)
+
+    Returns:
+        RefactorResult; файл не меняется до result.write()
+    """
+    started = time.monotonic()
+    lang = LANGS.get(Path(path).suffix.lower())
+    if lang is None:
+        raise ValueError(f"Неподдерживаемый тип файла: {path} (поддерживаются {', '.join(sorted(LANGS))})")
+    source = Path(path).read_text(encoding="utf-8")
+    units = split_units(source, lang, max_chars)
+    chunks = make_chunks(units, max_chars)
+    summary = symbol_summary(source, lang, units)
+    total = sum(chunk.refactor for chunk in chunks)
+
+    def process(chunk: Chunk) -> tuple:
+        chunk_started = time.monotonic()
+        if not chunk.refactor:
+            return chunk.code, ChunkOutcome(chunk.index, "kept", len(chunk.code), chunk.labels)
+        note = f" (методы класса, отступ «{len(chunk.indent)} пробелов» сохранить)" if chunk.indent else ""
+        message = REFACTOR_PROMPT.format(index=chunk.index + 1, total=len(chunks), path=path, instruction=instruction,
+                                         summary=summary, note=note, lang=lang, code=chunk.code.strip("\n"))
+        with span(f"chunk {chunk.index + 1}/{len(chunks)}", "step", labels=",".join(chunk.labels),
+                  chars=len(chunk.code)) as chunk_span:
+            raw = single_reply(agent, message)
+            reply = raw if isinstance(raw, str) else (raw or {}).get("content") or ""
+            code = _reply_code(reply, chunk)
+            reason = "в ответе нет блока кода" if code is None else _check_chunk(code, chunk, lang, path)
+            chunk_span.set(ok=reason is None)
+        seconds = round(time.monotonic() - chunk_started, 2)
+        if reason is not None:
+            return chunk.code, ChunkOutcome(chunk.index, "rejected", len(chunk.code), chunk.labels, reason, seconds)
+        status = "unchanged" if code == chunk.code else "refactored"
+        return code, ChunkOutcome(chunk.index, status, len(chunk.code), chunk.labels, seconds=seconds)
+
+    with span(f"refactor {Path(path).name}", "step", chunks=len(chunks), refactor_chunks=total) as refactor_span:
+        with ThreadPoolExecutor(max_workers=max(1, parallel), thread_name_prefix="refactor") as pool:
+            # Копия контекста на каждую часть: спаны, класс запросов и владелец — как у вызывающего
+            futures = [pool.submit(contextvars.copy_context().run, process, chunk) for chunk in chunks]
+            results = [future.result() for future in futures]
+        code = "".join(part for part, _ in results)
+        outcomes = [outcome for _, outcome in results]
+
+        # Сборка целиком: части проверены по отдельности, но стыки — только здесь
+        verdict = syntax_check("", "", StepArtifact("refactor", "", [CodeBlock(lang, code, Path(path).name)]))
+        if verdict.ok and lang != "python" and not _balanced(code):
+            verdict = Verdict(False, "syntax", "несбалансированные скобки")
+        refactor_span.set(valid=verdict.ok)
+
+    return RefactorResult(path, code if verdict.ok else source, source, verdict.ok, outcomes,
+                          round(time.monotonic() - started, 2), "" if verdict.ok else verdict.reason)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Рефакторинг большого файла по частям")
+    parser.add_argument("path")
+    parser.add_argument("instruction")
+    parser.add_argument("--write", action="store_true", help="Записать результат, если он прошел проверку")
+    parser.add_argument("--max-chars", type=int, default=DEFAULT_CHUNK_CHARS)
+    parser.add_argument("--parallel", type=int, default=DEFAULT_PARALLEL)
+    parser.add_argument("--module", default="devops_agent_optimized", help="Модуль с агентом refactorer")
+    parser.add_argument("--plan", action="store_true", help="Только показать разбиение на части")
+    args = parser.parse_args()
+
+    if args.plan:
+        lang = LANGS.get(Path(args.path).suffix.lower())
+        if lang is None:
+            sys.exit(f"Неподдерживаемый тип файла: {args.path}")
+        for chunk in make_chunks(split_units(Path(args.path).read_text(encoding="utf-8"), lang, args.max_chars),
+                                 args.max_chars):
+            mark = "✏️ " if chunk.refactor else "📌"
+            print(f"{mark} #{chunk.index + 1}: {len(chunk.code)} символов {', '.join(chunk.labels)}")
+        return
+
+    agent = importlib.import_module(args.module).refactorer
+    result = refactor_file(agent, args.path, args.instruction, args.max_chars, args.parallel)
+    for chunk in result.chunks:
+        if chunk.status == "rejected":
+            print(f"⚠️  часть {chunk.index + 1} ({', '.join(chunk.labels)}): {chunk.reason}")
+    print(result.summary())
+    if not result.valid:
+        sys.exit(f"❌ Сборка не прошла проверку: {result.reason}")
+    if args.write:
+        print("✅ Записано" if result.write() else "Без изменений")
+    else:
+        sys.stdout.write(result.code)
+
+
+if __name__ == "__main__":
+    main()
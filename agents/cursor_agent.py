@@ -5,8 +5,14 @@ Cursor IDE Agent с использованием Ollama
 
 from autogen import AssistantAgent, UserProxyAgent
 import os
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
 
+from llm_client import INTERACTIVE, register_ollama_client, resilient_llm_config
+from review_cache import REPO_ROOT, ReviewCache, expand_paths, rules_fingerprint
+from static_gate import GateResult, run_static_gate
+from structured_output import single_reply
+
 # Загрузить переменные окружения
 load_dotenv()
 
@@ -21,6 +27,15 @@ OLLAMA_CONFIG = {
     "max_retries": 3,
 }
 
+# Запросы из IDE идут как интерактивные: при ночных пакетных задачах на том же
+# хосте они получают слот первыми (admission.py)
+LLM_CONFIG = resilient_llm_config(OLLAMA_CONFIG, request_class=INTERACTIVE)
+
+REVIEW_MODEL = OLLAMA_CONFIG["model"]
+
+# Максимальный размер файла, отправляемого на ревью целиком
+MAX_REVIEW_FILE_CHARS = 24000
+
 # ==================== АГЕНТЫ ====================
 
 # Агент-кодер (использует llama3.1:8b-instruct-q4_K_M)
@@ -52,7 +67,7 @@ coder = AssistantAgent(
 - apps/ только контроллеры и подключение из libs
 - Минимум 85% покрытие для shared библиотек
 """,
-    llm_config=OLLAMA_CONFIG
+    llm_config=LLM_CONFIG
 )
 
 # Агент-тестировщик
@@ -73,7 +88,7 @@ tester = AssistantAgent(
 - Jest для frontend тестов
 - Storybook для UI компонентов
 """,
-    llm_config=OLLAMA_CONFIG
+    llm_config=LLM_CONFIG
 )
 
 # Агент-ревьюер кода
@@ -94,9 +109,11 @@ reviewer = AssistantAgent(
 - См. .specify/specs-optimized/core/git-workflow.md
 - См. .specify/specs-optimized/process/testing.md
 """,
-    llm_config=OLLAMA_CONFIG
+    llm_config=LLM_CONFIG
 )
 
+register_ollama_client(coder, tester, reviewer)
+
 # Пользовательский агент
 user = UserProxyAgent(
     name="User",
@@ -108,6 +125,89 @@ user = UserProxyAgent(
     }
 )
 
+# ==================== ФУНКЦИИ ====================
+
+def review_changes(files: Optional[List[str]] = None) -> GateResult:
+    """
+    Code review с предварительной статической проверкой
+
+    Сначала инкрементальный tsc и ESLint по затронутым файлам. Если есть
+    ошибки, ревью моделью не запускается: механические ошибки нужно исправить
+    до того, как тратить на них генерацию.
+
+    Args:
+        files: Файлы для ревью (по умолчанию — измененные по git status)
+
+    Returns:
+        Результат статической проверки
+    """
+    gate = run_static_gate(files)
+    print(f"\n🔎 {gate.to_prompt()}")
+    if not gate.files:
+        print("Нет измененных TS/JS файлов для ревью")
+        return gate
+    if gate.errors:
+        print("\n⛔ Ревью пропущено: сначала исправьте ошибки статической проверки")
+        return gate
+    if not gate.passed:
+        print("\n⛔ Ревью пропущено: tsc/ESLint не запустились, код не проверен")
+        return gate
+
+    user.initiate_chat(
+        reviewer,
+        message=(
+            f"Проверь изменения в файлах: {', '.join(gate.files)}\n\n"
+            f"{gate.to_prompt()}\n\n"
+            "Типы и правила ESLint уже проверены компилятором и линтером — "
+            "сосредоточься на архитектуре, логике, тестах и i18n."
+        )
+    )
+    return gate
+
+def review_files(paths: List[str], use_cache: bool = True) -> Dict[str, str]:
+    """
+    Ревью файлов по одному с кэшем результатов
+
+    Замечания кэшируются по пути и хэшу содержимого файла, промпту и правилам
+    ревьюера и модели, поэтому повторное ревью библиотеки отправляет
+    модели только измененные файлы. Сброс: python review_cache.py --invalidate <путь>
+
+    Args:
+        paths: Файлы или каталоги (относительно корня репозитория)
+        use_cache: Использовать кэш (False — пересмотреть все и обновить кэш)
+
+    Returns:
+        Замечания по каждому файлу
+    """
+    cache = ReviewCache(REVIEW_MODEL, rules_fingerprint(reviewer.system_message))
+    files = expand_paths(paths)
+    results: Dict[str, str] = {}
+    reviewed = 0
+    for path in files:
+        data = (REPO_ROOT / path).read_bytes()
+        entry = cache.get(path, data) if use_cache else None
+        if entry is not None:
+            results[path] = entry.findings
+            continue
+        code = data.decode("utf-8", errors="replace")[:MAX_REVIEW_FILE_CHARS]
+        reply = single_reply(
+            reviewer,
+            f"Проверь файл {path}. Перечисли только конкретные замечания "
+            f"(строка, проблема, как исправить) или ответь «Замечаний нет».\n\n```\n{code}\n```",
+        )
+        reviewed += 1
+        # Пустой ответ или вызов инструмента — не замечания: не кэшируется, файл проверится снова
+        if not isinstance(reply, str) or not reply.strip():
+            results[path] = "⚠️ Ревьюер не вернул замечаний текстом (не кэшировано)"
+            continue
+        cache.put(path, data, reply)
+        results[path] = reply
+
+    for path, findings in results.items():
+        print(f"\n📄 {path}\n{findings}")
+    print(f"\n🗂️  Файлов: {len(files)}, отправлено модели: {reviewed}, из кэша: {len(files) - reviewed}")
+    return results
+
 # Пример использования
 if __name__ == "__main__":
     print("🚀 Cursor IDE Agent запущен!")
@@ -121,3 +221,5 @@ if __name__ == "__main__":
     print("  user.initiate_chat(coder, message='Создай новый сервис для авторизации')")
     print("  user.initiate_chat(tester, message='Создай тесты для AuthService')")
     print("  user.initiate_chat(reviewer, message='Проверь код в libs/domain/auth')")
+    print("  review_changes()  # tsc + ESLint, затем ревью моделью")
+    print("  review_files(['libs/backend/domain/auth'])  # ревью по файлам, неизмененные — из кэша")
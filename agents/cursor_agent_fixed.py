@@ -8,6 +8,9 @@ from autogen import AssistantAgent, UserProxyAgent
 import os
 from dotenv import load_dotenv
 
+from llm_client import INTERACTIVE, register_ollama_client, resilient_llm_config
+from spec_digest import role_context
+
 # Загрузить переменные окружения
 load_dotenv()
 
@@ -25,8 +28,20 @@ OLLAMA_CONFIG = {
     "max_retries": 3,
 }
 
+# Запросы из IDE идут как интерактивные: при ночных пакетных задачах на том же
+# хосте они получают слот первыми (admission.py)
+LLM_CONFIG = {
+    **resilient_llm_config(OLLAMA_CONFIG["config_list"][0], timeout=OLLAMA_CONFIG["timeout"],
+                           request_class=INTERACTIVE),
+    "temperature": OLLAMA_CONFIG["temperature"],
+}
+
 # ==================== АГЕНТЫ ====================
 
+# В системные промпты добавляются дайджесты правил из .specify (spec_digest.py):
+# собираются маленькой моделью отдельным шагом (python spec_digest.py) и берутся
+# из кэша, пока спеки не менялись; импорт модель не вызывает. SPEC_DIGEST=0 отключает
+
 # Агент-кодер (использует llama3.1:8b-instruct-q4_K_M)
 coder = AssistantAgent(
     name="Coder",
@@ -55,8 +70,8 @@ coder = AssistantAgent(
 - Вся бизнес-логика в libs/
 - apps/ только контроллеры и подключение из libs
 - Минимум 85% покрытие для shared библиотек
-""",
-    llm_config=OLLAMA_CONFIG
+""" + role_context("coder"),
+    llm_config=LLM_CONFIG
 )
 
 # Агент-тестировщик
@@ -76,8 +91,8 @@ tester = AssistantAgent(
 - Vitest для backend тестов
 - Jest для frontend тестов
 - Storybook для UI компонентов
-""",
-    llm_config=OLLAMA_CONFIG
+""" + role_context("tester"),
+    llm_config=LLM_CONFIG
 )
 
 # Агент-ревьюер кода
@@ -97,10 +112,12 @@ reviewer = AssistantAgent(
 - См. .specify/specs-optimized/core/development.md
 - См. .specify/specs-optimized/core/git-workflow.md
 - См. .specify/specs-optimized/process/testing.md
-""",
-    llm_config=OLLAMA_CONFIG
+""" + role_context("reviewer"),
+    llm_config=LLM_CONFIG
 )
 
+register_ollama_client(coder, tester, reviewer)
+
 # Пользовательский агент
 user = UserProxyAgent(
     name="User",
@@ -3,13 +3,46 @@ Complete DevOps Agent с использованием AutoGen и Ollama
 Полноценная команда агентов для автоматизации разработки и деплоя
 """
 
-from autogen import AssistantAgent, UserProxyAgent
+from autogen import AssistantAgent
 import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
 
+from admission import admission_status, cancel_batch
+from affected_tests import create_worktree, remove_worktree, run_affected_tests
+from artifacts import StepArtifact, extract_artifact, handoff_message, write_files
+from chat_memory import ChatMemory, memory_status
+from native_tools import MODEL_TOOLS, REVIEW_TOOLS, register_tools, tool_status
+from process_pool import AgentProcessPool, WorkerError
+from sandbox import SandboxedUserProxyAgent, SandboxLimits, sandbox_status
+from structured_output import (
+    DEPLOY_SCHEMA,
+    MODEL_PLAN_SCHEMA,
+    REVIEW_SCHEMA,
+    StructuredOutputError,
+    ask_structured,
+    deploy_artifact,
+    review_artifact,
+    structured_agent,
+)
+from tracing import span, trace_run
+
+from llm_client import (
+    INTERACTIVE,
+    hedge_status,
+    register_ollama_client,
+    request_class,
+    resilient_llm_config,
+)
+
 # Загрузить переменные окружения
 load_dotenv()
 
+# Сколько раз тестировщик может исправлять упавшие тесты
+MAX_TEST_FIX_ITERATIONS = int(os.getenv("AGENT_TEST_FIX_ITERATIONS", "3"))
+
 # Конфигурация LLM для Ollama
 OLLAMA_CONFIG = {
     "model": os.getenv("OLLAMA_MODEL", "qwen2.5:7b"),
@@ -19,6 +52,19 @@ OLLAMA_CONFIG = {
     "temperature": float(os.getenv("AUTOGEN_TEMPERATURE", "0.7")),
 }
 
+# Дополнительные хосты Ollama с той же моделью (через запятую).
+# Если заданы, запросы интерактивных сессий дублируются на второй хост,
+# когда первый токен не пришел за p95-задержку (не более 10% запросов)
+HEDGE_BASE_URLS = [url.strip() for url in os.getenv("OLLAMA_HEDGE_BASE_URLS", "").split(",") if url.strip()]
+
+LLM_CONFIG = resilient_llm_config(
+    OLLAMA_CONFIG,
+    hedge={
+        "endpoints": [{"model": OLLAMA_CONFIG["model"], "base_url": url} for url in HEDGE_BASE_URLS],
+        "max_extra_load": float(os.getenv("OLLAMA_HEDGE_MAX_EXTRA_LOAD", "0.1")),
+    },
+)
+
 # ==================== АГЕНТЫ ====================
 
 # 1. Агент-кодер (Coder)
@@ -40,7 +86,7 @@ coder = AssistantAgent(
 - eslint и prettier compliant
 - Комментарии на русском для документации
 """,
-    llm_config=OLLAMA_CONFIG
+    llm_config=LLM_CONFIG
 )
 
 # 2. Агент-тестировщик (Tester)
@@ -62,7 +108,7 @@ tester = AssistantAgent(
 - @testing-library для UI
 - Storybook для компонентов
 """,
-    llm_config=OLLAMA_CONFIG
+    llm_config=LLM_CONFIG
 )
 
 # 3. Агент-деплоер (Deployer)
@@ -85,7 +131,7 @@ deployer = AssistantAgent(
 - Security best practices
 - ArgoCD совместимость
 """,
-    llm_config=OLLAMA_CONFIG
+    llm_config=LLM_CONFIG
 )
 
 # 4. Агент-архитектор (Architect)
@@ -107,7 +153,7 @@ architect = AssistantAgent(
 - Microservices architecture
 - Event-driven patterns
 """,
-    llm_config=OLLAMA_CONFIG
+    llm_config=LLM_CONFIG
 )
 
 # 5. Агент-ревьюер (Reviewer)
@@ -129,8 +175,14 @@ reviewer = AssistantAgent(
 - Test coverage
 - Типизация TypeScript
 - Соответствие спецификациям проекта
+
+Инструменты (вызывай их, а не пиши shell-команды):
+- read_file(path, start, end) - прочитать строки файла репозитория
+- grep_repo(pattern, path, glob) - найти использования в репозитории
+- git_diff(path, base, staged) - текущие изменения
+- list_nx_projects(name_filter, file) - проекты Nx и их зависимости
 """,
-    llm_config=OLLAMA_CONFIG
+    llm_config=LLM_CONFIG
 )
 
 # 6. Агент для управления моделями Ollama (ModelManager)
@@ -140,18 +192,20 @@ model_manager = AssistantAgent(
 
 Твои задачи:
 - Загружать модели через команду ollama pull
-- Проверять установленные модели через ollama list
+- Проверять установленные модели через инструмент ollama_models
 - Управлять версиями моделей
 - Проверять доступность моделей
 - Рекомендовать модели для разных задач
 - Проверять системные требования перед загрузкой
 
-Команды Ollama:
+Инструменты (вызывай их, а не пиши shell-команды — результат сразу в JSON):
+- ollama_models() - установленные и загруженные в память модели
+- ollama_model_info(model) - параметры, квантование и длина контекста модели
+- system_resources() - место на диске, RAM и загрузка CPU
+
+Команды Ollama (только для действий, которых нет среди инструментов):
 - ollama pull <model> - загрузить модель
-- ollama list - показать установленные модели
-- ollama show <model> - показать информацию о модели
 - ollama run <model> - запустить модель
-- ollama ps - показать запущенные модели
 
 Примеры моделей:
 - qwen2.5:7b - компактная модель (рекомендуется для начала, ~4.5GB)
@@ -164,110 +218,294 @@ model_manager = AssistantAgent(
 - Всегда проверяй доступное место на диске перед загрузкой больших моделей
 - Проверяй доступную RAM перед загрузкой больших моделей
 - Рекомендуй подходящие модели в зависимости от задач
-- Используй df -h для проверки диска
-- Используй free -h для проверки RAM
+- Для проверки диска и RAM используй system_resources, а не df -h / free -h
 """,
-    llm_config=OLLAMA_CONFIG
+    llm_config=LLM_CONFIG
 )
 
+register_ollama_client(coder, tester, deployer, architect, reviewer, model_manager)
+
+# Варианты агентов со структурированным ответом: Ollama декодирует строго по
+# JSON-схеме, следующий шаг разбирает ответ через json.loads
+reviewer_json = structured_agent(reviewer, REVIEW_SCHEMA)
+deployer_json = structured_agent(deployer, DEPLOY_SCHEMA)
+model_manager_json = structured_agent(model_manager, MODEL_PLAN_SCHEMA)
+
+
+class InteractiveUserProxyAgent(SandboxedUserProxyAgent):
+    """Пользовательский агент, чьи чаты идут как интерактивные запросы (с hedging)"""
+
+    def initiate_chat(self, *args, **kwargs):
+        with request_class(INTERACTIVE):
+            return super().initiate_chat(*args, **kwargs)
+
+
 # 7. Пользовательский агент (User)
-user = UserProxyAgent(
+# Код агентов выполняется в песочнице на ядрах, не занятых Ollama (OLLAMA_CPUS);
+# чаты и выполнение кода попадают в трассу прогона (.cache/traces)
+user = SandboxedUserProxyAgent(
     name="User",
     human_input_mode="NEVER",  # Автоматический режим (без ввода пользователя)
     max_consecutive_auto_reply=10,
     code_execution_config={
         "work_dir": ".",
         "use_docker": False
-    }
+    },
+    sandbox=SandboxLimits(),
 )
 
 # Интерактивный пользовательский агент
-user_interactive = UserProxyAgent(
+user_interactive = InteractiveUserProxyAgent(
     name="UserInteractive",
     human_input_mode="ALWAYS",  # Интерактивный режим
     max_consecutive_auto_reply=10,
     code_execution_config={
         "work_dir": ".",
         "use_docker": False
-    }
+    },
+    sandbox=SandboxLimits(cpus=1),
 )
 
+# Нативные инструменты: агент вызывает функцию за один раунд и получает JSON,
+# а не пишет скрипт для песочницы. Регистрируются после structured_agent —
+# JSON-варианты агентов отвечают строго по схеме, без вызова инструментов
+register_tools(reviewer, [user, user_interactive], REVIEW_TOOLS)
+register_tools(model_manager, [user, user_interactive], MODEL_TOOLS)
+
+# Агенты и user — синглтоны модуля: история чатов ограничена прогоном
+# (create_feature, update_service...), после него очищается; стенограммы
+# последних прогонов — в memory.runs, более старые — в .cache/chat-history
+memory = ChatMemory([architect, coder, tester, reviewer, deployer, model_manager, user, user_interactive])
+
 # ==================== ФУНКЦИИ ====================
 
-def create_feature(feature_description: str):
+@trace_run("create_feature")
+@memory.scoped("create_feature")
+def create_feature(feature_description: str, workspace: Optional[str] = None) -> Dict[str, StepArtifact]:
     """
     Создать полную фичу с кодом, тестами и деплоем
 
+    Каждый шаг получает не весь предыдущий диалог, а компактные артефакты
+    (код, файлы, решения) нужных ему шагов. Время шагов, запросов к LLM и
+    выполнения кода сохраняется в трассу (см. tracing.py).
+
     Args:
         feature_description: Описание фичи
+        workspace: Рабочее дерево для файлов, кода агентов и тестов (у параллельных
+            фич — свой worktree; по умолчанию тесты идут во временном worktree)
+
+    Returns:
+        Артефакты шагов по имени шага
     """
     print(f"\n🚀 Создание фичи: {feature_description}\n")
     print("=" * 60)
+    artifacts: Dict[str, StepArtifact] = {}
+    if workspace:
+        # Воркер create_features_parallel: агенты этого процесса работают только в своем дереве
+        user._code_execution_config["work_dir"] = workspace
 
     # Шаг 1: Архитектор проектирует решение
     print("\n📐 Шаг 1: Проектирование архитектуры...")
-    user.initiate_chat(
+    result = user.initiate_chat(
         architect,
         message=f"Спроектируй архитектуру для: {feature_description}"
     )
+    artifacts["architecture"] = extract_artifact("architecture", architect, result)
 
     # Шаг 2: Кодер пишет код
     print("\n💻 Шаг 2: Написание кода...")
-    user.initiate_chat(
+    result = user.initiate_chat(
         coder,
-        message=f"Реализуй следующую фичу: {feature_description}"
+        message=handoff_message(
+            f"Реализуй следующую фичу: {feature_description}",
+            [artifacts["architecture"]],
+        )
     )
+    artifacts["code"] = extract_artifact("code", coder, result)
 
     # Шаг 3: Тестировщик создает тесты
     print("\n🧪 Шаг 3: Создание тестов...")
-    user.initiate_chat(
+    result = user.initiate_chat(
         tester,
-        message="Создай тесты для реализованного кода с покрытием 85%+"
+        message=handoff_message(
+            "Создай тесты для реализованного кода с покрытием 85%+",
+            [artifacts["code"]],
+        )
     )
+    artifacts["tests"] = extract_artifact("tests", tester, result)
+    run_test_fix_loop(artifacts, workspace=Path(workspace) if workspace else None)
 
-    # Шаг 4: Ревьюер проверяет код
+    # Шаг 4: Ревьюер проверяет код (ответ — JSON по REVIEW_SCHEMA)
     print("\n👀 Шаг 4: Code review...")
-    user.initiate_chat(
-        reviewer,
-        message="Проверь качество кода, найди потенциальные проблемы"
+    review_message = handoff_message(
+        "Проверь качество кода, найди потенциальные проблемы",
+        [artifacts["code"], artifacts["tests"]],
     )
-
-    # Шаг 5: Деплоер готовит деплой
+    try:
+        with span("review", "chat"):
+            review = ask_structured(reviewer_json, review_message)
+        artifacts["review"] = review_artifact(review, reviewer.name)
+        print(f"   Вердикт: {review['verdict']}, замечаний: {len(review['issues'])}")
+    except StructuredOutputError as e:
+        # JSON мог оборваться на пределе контекста — ревью обычным текстом
+        print(f"   ⚠️  {e}; ревью текстом")
+        result = user.initiate_chat(reviewer, message=review_message)
+        artifacts["review"] = extract_artifact("review", reviewer, result)
+
+    # Шаг 5: Деплоер готовит деплой (коду достаточно списка файлов и решений;
+    # ответ — JSON по DEPLOY_SCHEMA, манифесты сразу становятся файлами артефакта)
     print("\n🚢 Шаг 5: Подготовка к деплою...")
-    user.initiate_chat(
-        deployer,
-        message="Создай Kubernetes манифесты и Dockerfile для деплоя"
+    deploy_message = handoff_message(
+        "Создай Kubernetes манифесты и Dockerfile для деплоя",
+        [artifacts["architecture"], artifacts["code"]],
+        include_code=False,
     )
+    try:
+        with span("deploy", "chat"):
+            deploy = ask_structured(deployer_json, deploy_message)
+        artifacts["deploy"] = deploy_artifact(deploy, deployer.name)
+    except StructuredOutputError as e:
+        print(f"   ⚠️  {e}; манифесты текстом")
+        result = user.initiate_chat(deployer, message=deploy_message)
+        artifacts["deploy"] = extract_artifact("deploy", deployer, result)
+    print(f"   Манифесты: {', '.join(artifacts['deploy'].files) or 'нет'}")
 
     print("\n✅ Фича готова к деплою!")
     print("=" * 60)
+    return artifacts
+
+def run_test_fix_loop(artifacts: Dict[str, StepArtifact], max_iterations: int = MAX_TEST_FIX_ITERATIONS,
+                      workspace: Optional[Path] = None) -> bool:
+    """
+    Прогнать затронутые тесты и вернуть ошибки тестировщику на исправление
+
+    Блоки кода и тестов с путями записываются в workspace, и запускаются
+    только тесты проектов Nx, затронутых этими файлами, в долгоживущем
+    Vitest-воркере, поэтому итерация занимает секунды. Прочие незакоммиченные
+    изменения рабочего дерева в выбор не попадают.
 
-def update_service(service_name: str, update_description: str):
+    Args:
+        artifacts: Артефакты шагов (артефакт "tests" обновляется)
+        max_iterations: Максимум итераций исправления
+        workspace: Куда записывать файлы; по умолчанию — временный worktree от HEAD,
+            чтобы сгенерированные файлы не попадали в рабочую копию разработчика
+
+    Returns:
+        True, если тесты запускались и прошли
+    """
+    if workspace is not None:
+        return _test_fix_iterations(artifacts, max_iterations, workspace)
+    worktree = create_worktree(f"test-fix-{os.getpid()}-{time.monotonic_ns()}")
+    try:
+        return _test_fix_iterations(artifacts, max_iterations, worktree)
+    finally:
+        remove_worktree(worktree)
+
+def _test_fix_iterations(artifacts: Dict[str, StepArtifact], max_iterations: int, workspace: Path) -> bool:
+    for iteration in range(1, max_iterations + 1):
+        changed = write_files([artifacts["code"], artifacts["tests"]], workspace)
+        if not changed:
+            print("\n🧪 В коде и тестах нет файлов с путями — тесты не запускаются")
+            return False
+        with span(f"vitest #{iteration}", "tests"):
+            report = run_affected_tests(changed, repo_root=workspace)
+        print(f"\n🧪 Проверка тестов (итерация {iteration}):\n{report.summary()}")
+        if report.ok:
+            return True
+        if not report.selection.files or report.not_run:
+            # Тестировщик это не исправит: тестов нет или их не запускает Vitest
+            return False
+        result = user.initiate_chat(
+            tester,
+            message=handoff_message(
+                f"Тесты не проходят, исправь код тестов или реализации:\n{report.summary()}",
+                [artifacts["code"], artifacts["tests"]],
+            )
+        )
+        artifacts["tests"] = extract_artifact("tests", tester, result)
+    changed = write_files([artifacts["code"], artifacts["tests"]], workspace)
+    with span("vitest (final)", "tests"):
+        return run_affected_tests(changed, repo_root=workspace).ok
+
+@trace_run("update_service")
+@memory.scoped("update_service")
+def update_service(service_name: str, update_description: str) -> Dict[str, StepArtifact]:
     """
     Обновить существующий сервис
 
     Args:
         service_name: Имя сервиса
         update_description: Описание обновления
+
+    Returns:
+        Артефакты шагов по имени шага
     """
     print(f"\n🔄 Обновление сервиса: {service_name}")
     print(f"Описание: {update_description}\n")
     print("=" * 60)
+    artifacts: Dict[str, StepArtifact] = {}
 
     # Кодер обновляет код
-    user.initiate_chat(
+    result = user.initiate_chat(
         coder,
         message=f"Обнови сервис '{service_name}': {update_description}"
     )
+    artifacts["code"] = extract_artifact("code", coder, result)
 
     # Тестировщик обновляет тесты
-    user.initiate_chat(
+    result = user.initiate_chat(
         tester,
-        message="Обнови тесты для измененного кода"
+        message=handoff_message("Обнови тесты для измененного кода", [artifacts["code"]])
     )
+    artifacts["tests"] = extract_artifact("tests", tester, result)
+    run_test_fix_loop(artifacts)
 
     print("\n✅ Сервис обновлен!")
+    return artifacts
+
+def create_features_parallel(feature_descriptions: List[str], workers: Optional[int] = None,
+                             keep_worktrees: bool = False) -> Dict[str, Dict[str, StepArtifact]]:
+    """
+    Создать несколько фич параллельно в отдельных процессах
 
+    Каждая фича проходит create_feature в своем воркере (со своими агентами)
+    и в своем git worktree (.cache/worktrees): файлы фич не перезаписывают
+    друг друга, и каждая запускает только тесты своих файлов. Вывод воркеров
+    пишется в .cache/agent-workers.
+
+    Args:
+        feature_descriptions: Описания фич
+        workers: Число процессов (по умолчанию — по числу фич, не больше ядер)
+        keep_worktrees: Оставить worktree фич (иначе удаляются; код остается в артефактах)
+
+    Returns:
+        Артефакты шагов по описанию фичи (упавшие фичи пропускаются)
+    """
+    workers = workers or min(len(feature_descriptions), os.cpu_count() or 1)
+    results: Dict[str, Dict[str, StepArtifact]] = {}
+    worktrees = {description: create_worktree(f"feature-{os.getpid()}-{index}")
+                 for index, description in enumerate(feature_descriptions)}
+    try:
+        with AgentProcessPool(workers=workers, preload=["devops_agent_complete"]) as pool:
+            futures = {description: pool.submit("devops_agent_complete:create_feature", description,
+                                                 workspace=str(worktrees[description]))
+                       for description in feature_descriptions}
+            for description, future in futures.items():
+                try:
+                    results[description] = {step: StepArtifact.from_dict(data)
+                                            for step, data in future.result().items()}
+                    print(f"✅ {description}")
+                except WorkerError as e:
+                    print(f"❌ {description}: {e}")
+    finally:
+        for description, path in worktrees.items():
+            if keep_worktrees:
+                print(f"🌳 {description}: {path}")
+            else:
+                remove_worktree(path)
+    return results
+
+@memory.scoped("deploy_to_kubernetes")
 def deploy_to_kubernetes(service_name: str):
     """
     Задеплоить сервис в Kubernetes
@@ -294,6 +532,7 @@ def deploy_to_kubernetes(service_name: str):
 
     print("\n✅ Конфигурация для деплоя готова!")
 
+@memory.scoped("pull_ollama_model")
 def pull_ollama_model(model_name: str = "qwen:32b"):
     """
     Загрузить модель Ollama через агента ModelManager
@@ -308,11 +547,10 @@ def pull_ollama_model(model_name: str = "qwen:32b"):
         model_manager,
         message=f"""Загрузи модель Ollama '{model_name}':
 
-        1. Проверь доступное место на диске
-        2. Проверь доступную RAM
-        3. Выполни команду: ollama pull {model_name}
-        4. Проверь успешность загрузки через ollama list
-        5. Покажи информацию о загруженной модели через ollama show {model_name}
+        1. Проверь место на диске и доступную RAM (system_resources)
+        2. Выполни команду: ollama pull {model_name}
+        3. Проверь успешность загрузки (ollama_models)
+        4. Покажи информацию о загруженной модели (ollama_model_info)
 
         Если места недостаточно или модель слишком большая, предложи альтернативу.
         """
@@ -338,6 +576,9 @@ def example_usage():
     print("\n2. Обновить сервис:")
     print("   update_service('api-auth', 'Добавить rate limiting')")
 
+    print("\n   Несколько фич параллельно (в отдельных процессах):")
+    print("   create_features_parallel(['OAuth2 через GitHub', 'Rate limiting'])")
+
     print("\n3. Задеплоить в Kubernetes:")
     print("   deploy_to_kubernetes('api-auth')")
 
@@ -353,6 +594,21 @@ def example_usage():
 
     print("\n6. Интерактивный режим:")
     print("   user_interactive.initiate_chat(coder, message='Твоя задача')")
+    print("   hedge_status()  # метрики hedged-запросов (OLLAMA_HEDGE_BASE_URLS)")
+    print("   sandbox_status()  # время, CPU и память выполненного кода по агентам")
+    print("   admission_status()  # очереди и слоты Ollama по классам interactive/pipeline/batch")
+    print("   memory_status()  # история чатов по агентам, стенограммы прогонов, RSS процесса")
+    print("   memory.runs[-1].messages  # стенограмма последнего прогона")
+    print("   tool_status()  # вызовы нативных инструментов агентов (read_file, grep_repo, ollama_models...)")
+    print("   cancel_batch()  # отменить ожидающие пакетные запросы")
+
+    print("\n   Структурированные ответы (JSON по схеме, без разбора текста):")
+    print("   ask_structured(reviewer_json, 'Проверь код: ...')['issues']")
+    print("   ask_structured(model_manager_json, 'Хватит ли RAM для qwen:32b?')['action']")
+
+    print("\n7. Много мелких запросов (классификация файлов, сообщения коммитов):")
+    print("   from batcher import MicroBatcher")
+    print("   MicroBatcher(LLM_CONFIG, pack_size=8).map(files, system='Приоритет ревью: high/medium/low')")
 
     print("\n" + "=" * 60)
     print("✨ Все агенты работают полностью офлайн через Ollama!")
@@ -365,6 +621,8 @@ if __name__ == "__main__":
     print(f"📦 Модель: {OLLAMA_CONFIG['model']}")
     print(f"🔗 URL: {OLLAMA_CONFIG['base_url']}")
     print(f"🌡️  Temperature: {OLLAMA_CONFIG['temperature']}")
+    if HEDGE_BASE_URLS:
+        print(f"🔀 Hedging интерактивных запросов: {', '.join(HEDGE_BASE_URLS)}")
 
     print("\n📝 Доступные агенты:")
     print("   - coder:         Пишет код")
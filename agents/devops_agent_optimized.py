@@ -3,8 +3,16 @@
 Использует квантованные модели для максимальной производительности
 """
 
+import os
+
 from autogen import AssistantAgent, UserProxyAgent
 
+from cascade import ModelCascade, cascade_status, syntax_check
+from chunked_refactor import refactor_file
+from llm_client import breaker_status, register_ollama_client, resilient_llm_config, timing_status
+from model_scheduler import ModelScheduler, Step, scheduler_status
+from semantic_cache import semantic_cache_status
+
 # ============================================
 # КОНФИГУРАЦИИ МОДЕЛЕЙ (оптимизированы для CPU)
 # ============================================
@@ -37,13 +45,43 @@ STARCODER_CONFIG = {
 }
 
 # Qwen 2.5 7B - РЕЗЕРВНАЯ (уже установлена)
+# Можно вынести на отдельный хост через OLLAMA_FALLBACK_BASE_URL
 QWEN_CONFIG = {
     "model": "qwen2.5:7b",
-    "base_url": "http://localhost:11434/v1",
+    "base_url": os.getenv("OLLAMA_FALLBACK_BASE_URL", "http://localhost:11434/v1"),
     "api_key": "ollama",
     "api_type": "open_ai"
 }
 
+# ============================================
+# ОТКАЗОУСТОЙЧИВОСТЬ
+# ============================================
+
+# Основная модель получает короткий таймаут: зависший или выгруженный Mistral
+# размыкает свой breaker, и запросы сразу уходят на резервную модель
+# вместо ожидания 300s × 3 повтора
+PRIMARY_TIMEOUT = float(os.getenv("OLLAMA_PRIMARY_TIMEOUT", "120"))
+
+# ============================================
+# НАТИВНЫЙ API OLLAMA
+# ============================================
+
+# /api/chat вместо /v1: модели остаются в памяти между задачами (keep_alive),
+# контекст задается явно (по умолчанию Ollama обрезает промпт до 2-4k),
+# а в ответе приходят длительности load / prompt_eval / eval (timing_status())
+# OLLAMA_API=openai — вернуть OpenAI-совместимый путь
+NATIVE = {
+    "api": os.getenv("OLLAMA_API", "ollama"),
+    "keep_alive": os.getenv("OLLAMA_KEEP_ALIVE", "30m"),
+    # num_thread по умолчанию не задается: Ollama берет число физических ядер
+    "options": {"num_ctx": int(os.getenv("OLLAMA_NUM_CTX", "8192")),
+                **({"num_thread": int(os.environ["OLLAMA_NUM_THREAD"])} if os.getenv("OLLAMA_NUM_THREAD") else {})},
+}
+
+MISTRAL_LLM = resilient_llm_config(MISTRAL_CONFIG, QWEN_CONFIG, timeout=PRIMARY_TIMEOUT, **NATIVE)
+LLAMA_LLM = resilient_llm_config(LLAMA_CONFIG, MISTRAL_CONFIG, QWEN_CONFIG, timeout=PRIMARY_TIMEOUT, **NATIVE)
+STARCODER_LLM = resilient_llm_config(STARCODER_CONFIG, QWEN_CONFIG, timeout=PRIMARY_TIMEOUT, **NATIVE)
+
 # ============================================
 # АГЕНТЫ
 # ============================================
@@ -54,7 +92,7 @@ coder = AssistantAgent(
     system_message="Ты опытный разработчик. Пишешь чистый, документированный код. "
                    "Следуешь best practices, SOLID принципам и создаешь качественные решения. "
                    "Используешь TypeScript, Python, JavaScript и другие языки.",
-    llm_config=MISTRAL_CONFIG
+    llm_config=MISTRAL_LLM
 )
 
 # Агент-кодер быстрый (StarCoder - для прототипирования)
@@ -62,7 +100,7 @@ fast_coder = AssistantAgent(
     name="FastCoder",
     system_message="Ты эксперт в быстром написании кода. Создаешь рабочие прототипы быстро. "
                    "Специализируешься на генерации кода и автодополнении.",
-    llm_config=STARCODER_CONFIG
+    llm_config=STARCODER_LLM
 )
 
 # Агент-архитектор (LLaMA - для сложных задач с большим контекстом)
@@ -71,7 +109,7 @@ architect = AssistantAgent(
     system_message="Ты системный архитектор. Проектируешь масштабируемые решения, "
                    "анализируешь большие кодовые базы и принимаешь технические решения. "
                    "Работаешь с длинными документами и сложными системами.",
-    llm_config=LLAMA_CONFIG
+    llm_config=LLAMA_LLM
 )
 
 # Агент-ревьюер (Mistral - для code review)
@@ -79,7 +117,7 @@ reviewer = AssistantAgent(
     name="CodeReviewer",
     system_message="Ты опытный code reviewer. Проверяешь код на качество, безопасность, "
                    "производительность и соответствие стандартам. Даешь конструктивную обратную связь.",
-    llm_config=MISTRAL_CONFIG
+    llm_config=MISTRAL_LLM
 )
 
 # Агент-тестировщик (Mistral)
@@ -88,7 +126,7 @@ tester = AssistantAgent(
     system_message="Ты QA инженер. Создаешь unit-тесты, integration-тесты. "
                    "Пишешь тесты на pytest, jest, junit и других фреймворках. "
                    "Проверяешь покрытие кода и edge cases.",
-    llm_config=MISTRAL_CONFIG
+    llm_config=MISTRAL_LLM
 )
 
 # Агент-рефакторер (LLaMA - для работы с большими файлами)
@@ -97,9 +135,46 @@ refactorer = AssistantAgent(
     system_message="Ты эксперт в рефакторинге кода. Улучшаешь существующий код, "
                    "делаешь его более читаемым, производительным и поддерживаемым. "
                    "Работаешь с большими файлами и сложными системами.",
-    llm_config=LLAMA_CONFIG
+    llm_config=LLAMA_LLM
 )
 
+register_ollama_client(coder, fast_coder, architect, reviewer, tester, refactorer)
+
+# ============================================
+# КАСКАД
+# ============================================
+
+# Сначала StarCoder2 3B, при провале проверки синтаксиса — Mistral 7B.
+# Статистика по типам задач (.cache/cascade/code.json) решает, с какой модели начинать
+code_cascade = ModelCascade("code", [fast_coder, coder], validators=[syntax_check])
+
+# ============================================
+# ПЛАНИРОВАНИЕ ШАГОВ ПО МОДЕЛЯМ
+# ============================================
+
+# Независимые шаги группируются по модели, модель следующего шага
+# загружается заранее, если помещается в память вместе с текущей
+scheduler = ModelScheduler("optimized")
+
+
+def feature_steps(task: str) -> list:
+    """
+    Шаги фичи: архитектура, реализация, прототип, план рефакторинга, ревью и тесты
+
+    В исходном порядке модели чередуются LLaMA → Mistral → StarCoder → LLaMA → Mistral;
+    scheduler.run выполняет их с учетом зависимостей и загруженных моделей.
+    """
+    return [
+        Step("design", architect, f"Спроектируй решение: {task}"),
+        Step("implement", coder, lambda out: f"Реализуй по архитектуре:\n{out['design']}\n\nЗадача: {task}",
+             depends_on=("design",)),
+        Step("prototype", fast_coder, f"Набросай минимальный прототип API для задачи: {task}"),
+        Step("refactor-plan", refactorer, lambda out: f"Что в этой архитектуре придется рефакторить при росте "
+                                                      f"нагрузки?\n{out['design']}", depends_on=("design",)),
+        Step("review", reviewer, lambda out: f"Проверь код:\n{out['implement']}", depends_on=("implement",)),
+        Step("tests", tester, lambda out: f"Напиши тесты для кода:\n{out['implement']}", depends_on=("implement",)),
+    ]
+
 # Пользовательский агент
 user = UserProxyAgent(
     name="Developer",
@@ -140,8 +215,27 @@ if __name__ == "__main__":
     print("4. Архитектурное решение:")
     print("   user.initiate_chat(architect, message='Спроектируй микросервисную архитектуру')")
     print("")
+    print("5. Каскад: StarCoder2 3B, при ошибке проверки — Mistral 7B:")
+    print("   result = code_cascade.run('Напиши функцию slugify на TypeScript', task_type='ts-function')")
+    print("   result.output, result.model, result.escalations")
+    print("")
+    print("6. Фича целиком, шаги сгруппированы по моделям:")
+    print("   result = scheduler.run(feature_steps('Сервис уведомлений по email'))")
+    print("   result.order, result.switches_avoided, result.outputs['review']")
+    print("")
+    print("7. Большой файл по частям (классы и функции параллельно, сборка с проверкой):")
+    print("   result = refactor_file(refactorer, 'libs/.../admin-auth.service.ts', 'Упрости обработку ошибок')")
+    print("   result.summary(); result.write()")
+    print("")
     print("📊 Модели (оптимизированы для CPU):")
     print(f"   • Mistral 7B Q4: {MISTRAL_CONFIG['model']} (32k контекст)")
     print(f"   • LLaMA 3.1 8B Q4: {LLAMA_CONFIG['model']} (128k контекст)")
     print(f"   • StarCoder2 3B: {STARCODER_CONFIG['model']} (быстрый кодинг)")
+    print(f"   • Qwen 2.5 7B: {QWEN_CONFIG['model']} (резерв при отказе основной модели)")
+    print("")
+    print("🛡️  Состояние circuit breaker'ов: breaker_status()")
+    print("⏱️  Загрузка / промпт / генерация по моделям: timing_status()")
+    print("🔀 Переключения и предзагрузка моделей: scheduler_status()")
+    print("🪜 Статистика каскада: cascade_status()")
+    print("🧲 Семантический кэш (Coder, FastCoder, Architect): semantic_cache_status()")
 
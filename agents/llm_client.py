@@ -0,0 +1,932 @@
+"""
+LLM клиент для агентов AutoGen поверх Ollama
+Circuit breaker на каждую модель и автоматический переход на резервную модель,
+hedged-запросы на второй хост для снижения хвостовых задержек,
+семантический кэш первых запросов диалога (semantic_cache.py),
+допуск запросов по приоритету класса (admission.py),
+нативный API Ollama (/api/chat) с keep_alive, options и длительностями ответа
+"""
+
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+import requests
+
+import semantic_cache
+from admission import get_controller
+from tracing import record_ollama_timings, span
+
+# ============================================
+# CIRCUIT BREAKER
+# ============================================
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Настройки по умолчанию (переопределяются ключом "breaker" в конфиге)
+DEFAULT_BREAKER = {
+    "window": 20,                # сколько последних вызовов учитывать
+    "min_calls": 5,              # минимум вызовов для оценки доли ошибок
+    "error_rate": 0.5,           # доля ошибок, после которой цепь размыкается
+    "consecutive_failures": 3,   # подряд идущие ошибки размыкают цепь сразу
+    "slow_call_seconds": 120.0,  # вызов дольше этого считается медленным
+    "slow_rate": 0.8,            # доля медленных вызовов для размыкания
+    "open_seconds": 30.0,        # сколько цепь остается разомкнутой
+    "half_open_probes": 1,       # пробных запросов в полуоткрытом состоянии
+}
+
+
+class CircuitOpenError(Exception):
+    """Все модели недоступны: цепи разомкнуты или запросы завершились ошибкой"""
+
+
+class CircuitBreaker:
+    """Circuit breaker для одной модели на одном хосте"""
+
+    def __init__(self, name: str, **settings):
+        self.name = name
+        self.settings = {**DEFAULT_BREAKER, **settings}
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.trips = 0
+        self._calls = deque(maxlen=self.settings["window"])
+        self._consecutive_failures = 0
+        self._probes_in_flight = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Можно ли сейчас отправить запрос"""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.settings["open_seconds"]:
+                    return False
+                self.state = HALF_OPEN
+                self._probes_in_flight = 0
+            if self.state == HALF_OPEN:
+                if self._probes_in_flight >= self.settings["half_open_probes"]:
+                    return False
+                self._probes_in_flight += 1
+            return True
+
+    def record(self, success: bool, latency: float):
+        """Учесть результат вызова"""
+        with self._lock:
+            slow = latency >= self.settings["slow_call_seconds"]
+            self._calls.append((success, slow))
+            self._consecutive_failures = 0 if success else self._consecutive_failures + 1
+
+            if self.state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if success and not slow:
+                    self.state = CLOSED
+                    self._calls.clear()
+                else:
+                    self._open()
+                return
+
+            if self.state == CLOSED and self._should_open():
+                self._open()
+
+    def release(self):
+        """Вернуть пробный слот без учета результата (запрос отменен, а не провален)"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def _should_open(self) -> bool:
+        if self._consecutive_failures >= self.settings["consecutive_failures"]:
+            return True
+        calls = len(self._calls)
+        if calls < self.settings["min_calls"]:
+            return False
+        errors = sum(1 for success, _ in self._calls if not success)
+        slow = sum(1 for _, is_slow in self._calls if is_slow)
+        return errors / calls >= self.settings["error_rate"] or slow / calls >= self.settings["slow_rate"]
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.trips += 1
+
+    def status(self) -> Dict[str, Any]:
+        """Текущее состояние для метрик"""
+        with self._lock:
+            calls = len(self._calls)
+            errors = sum(1 for success, _ in self._calls if not success)
+            return {
+                "state": self.state,
+                "trips": self.trips,
+                "window_calls": calls,
+                "window_error_rate": round(errors / calls, 3) if calls else 0.0,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(model: str, base_url: str, **settings) -> CircuitBreaker:
+    """Общий для процесса breaker модели (все агенты с этой моделью делят его)"""
+    key = f"{model}@{base_url}"
+    with _breakers_lock:
+        if key not in _breakers:
+            _breakers[key] = CircuitBreaker(key, **settings)
+        return _breakers[key]
+
+
+def breaker_status() -> Dict[str, Dict[str, Any]]:
+    """Состояние всех breaker'ов процесса"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.status() for breaker in breakers}
+
+
+# ============================================
+# КЛАСС ЗАПРОСА
+# ============================================
+
+INTERACTIVE = "interactive"
+PIPELINE = "pipeline"
+BATCH = "batch"
+
+# Класс текущих запросов к LLM (задается вызывающим кодом на время чата;
+# если не задан — берется request_class из конфига клиента, иначе PIPELINE)
+_request_class: ContextVar[Optional[str]] = ContextVar("request_class", default=None)
+
+
+@contextmanager
+def request_class(name: str):
+    """
+    Задать класс запросов к LLM внутри блока
+
+    Пример:
+        with request_class(INTERACTIVE):
+            user_interactive.initiate_chat(coder, message="...")
+    """
+    token = _request_class.set(name)
+    try:
+        yield
+    finally:
+        _request_class.reset(token)
+
+
+def current_request_class(default: str = PIPELINE) -> str:
+    return _request_class.get() or default
+
+
+# ============================================
+# HTTP
+# ============================================
+
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(base_url: str) -> requests.Session:
+    """Пул HTTP-соединений на хост (переиспользуется всеми агентами)"""
+    with _sessions_lock:
+        if base_url not in _sessions:
+            _sessions[base_url] = requests.Session()
+        return _sessions[base_url]
+
+
+# ============================================
+# ОТВЕТ В ФОРМАТЕ AutoGen ModelClient
+# ============================================
+
+@dataclass
+class ChatMessage:
+    role: str
+    content: Optional[str]
+    tool_calls: Optional[List[Dict[str, Any]]] = None
+
+
+@dataclass
+class ChatChoice:
+    message: ChatMessage
+    finish_reason: Optional[str] = None
+
+
+@dataclass
+class ChatResponse:
+    model: str
+    choices: List[ChatChoice]
+    usage: Dict[str, int] = field(default_factory=dict)
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    endpoint: str = ""
+    fallback_used: bool = False
+    cost: float = 0.0
+    timings: Dict[str, int] = field(default_factory=dict)  # длительности Ollama, нс
+    ttft: Optional[float] = None
+
+
+# ============================================
+# HEDGED-ЗАПРОСЫ
+# ============================================
+
+# Настройки по умолчанию (переопределяются ключом "hedge" в конфиге)
+DEFAULT_HEDGE = {
+    "endpoints": [],               # хосты для дубля: [{"model", "base_url"}]
+    "classes": [INTERACTIVE],      # для каких классов запросов включено
+    "max_extra_load": 0.1,         # не больше 10% запросов дублируются
+    "percentile": 0.95,            # задержка дубля = p95 времени до первого токена
+    "min_delay": 0.5,              # нижняя граница задержки, сек
+    "default_delay": 3.0,          # пока статистики мало, сек
+    "min_samples": 20,
+}
+
+
+class HedgeStats:
+    """Статистика TTFT и hedged-запросов одного клиента"""
+
+    def __init__(self, settings: Dict[str, Any]):
+        self.settings = settings
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.hedge_errors = 0
+        self.budget_denied = 0
+        self._ttft = deque(maxlen=500)
+        self._lock = threading.Lock()
+
+    def delay(self) -> float:
+        """Сколько ждать первого токена перед отправкой дубля"""
+        with self._lock:
+            samples = sorted(self._ttft)
+        if len(samples) < self.settings["min_samples"]:
+            return self.settings["default_delay"]
+        index = min(len(samples) - 1, int(self.settings["percentile"] * len(samples)))
+        return max(self.settings["min_delay"], samples[index])
+
+    def try_hedge(self) -> bool:
+        """Разрешить дубль, если не превышен лимит дополнительной нагрузки"""
+        with self._lock:
+            if (self.hedged + 1) / (self.requests + 1) > self.settings["max_extra_load"]:
+                self.budget_denied += 1
+                return False
+            self.hedged += 1
+            return True
+
+    def cancel(self):
+        """Разрешенный дубль не отправлен (нет хоста с замкнутой цепью)"""
+        with self._lock:
+            self.hedged -= 1
+
+    def record(self, ttft: Optional[float], hedge_won: bool, hedge_error: bool = False):
+        with self._lock:
+            self.requests += 1
+            if ttft is not None:
+                self._ttft.append(ttft)
+            if hedge_won:
+                self.hedge_wins += 1
+            if hedge_error:
+                self.hedge_errors += 1
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            requests_count, hedged, wins, denied = self.requests, self.hedged, self.hedge_wins, self.budget_denied
+            errors = self.hedge_errors
+        return {
+            "requests": requests_count,
+            "hedged": hedged,
+            "hedge_rate": round(hedged / requests_count, 3) if requests_count else 0.0,
+            "hedge_wins": wins,
+            "hedge_win_rate": round(wins / hedged, 3) if hedged else 0.0,
+            "hedge_errors": errors,
+            "budget_denied": denied,
+            "delay_s": round(self.delay(), 3),
+        }
+
+
+_hedge_stats: Dict[str, HedgeStats] = {}
+
+
+def hedge_status() -> Dict[str, Dict[str, Any]]:
+    """Метрики hedged-запросов по основным моделям"""
+    return {name: stats.status() for name, stats in list(_hedge_stats.items())}
+
+
+class _HedgeRace:
+    """
+    Гонка нескольких потоковых запросов: побеждает первый, выдавший токен
+
+    Ответы участников регистрируются (attach), и победитель сразу закрывает
+    ответы проигравших: соединение не ждет их первого токена.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.winner: Optional[str] = None
+        self.first_token = threading.Event()
+        self.done = threading.Event()
+        self.started = 0
+        self.finished = 0
+        self.ttft: Dict[str, float] = {}
+        self.latency: Dict[str, float] = {}
+        self.results: Dict[str, ChatResponse] = {}
+        self.errors: Dict[str, Exception] = {}
+        self.responses: Dict[str, requests.Response] = {}
+
+    def attach(self, name: str, response: requests.Response) -> bool:
+        """Зарегистрировать ответ участника; False — гонка уже проиграна"""
+        with self.lock:
+            if self.winner is not None and self.winner != name:
+                return False
+            self.responses[name] = response
+            return True
+
+    def claim(self, name: str, ttft: float) -> bool:
+        with self.lock:
+            losers = []
+            if self.winner is None:
+                self.winner = name
+                self.ttft[name] = ttft
+                self.first_token.set()
+                losers = [response for other, response in self.responses.items() if other != name]
+            won = self.winner == name
+        for response in losers:
+            response.close()
+        return won
+
+    def lost(self, name: str) -> bool:
+        return self.winner is not None and self.winner != name
+
+    def finish(self, name: str):
+        with self.lock:
+            self.finished += 1
+            if self.winner == name or self.finished == self.started:
+                self.done.set()
+
+
+# Таймаут запроса, если он не задан для модели явно
+DEFAULT_TIMEOUT = 300
+
+# Длительности, которые Ollama возвращает в ответе (нативный формат)
+TIMING_FIELDS = ("total_duration", "load_duration", "prompt_eval_duration", "eval_duration")
+
+# Параметры запроса, которые передаются в Ollama как есть
+PASSTHROUGH_PARAMS = ("temperature", "top_p", "max_tokens", "stop", "seed", "tools", "tool_choice",
+                      "response_format")
+
+# API хоста: OpenAI-совместимый /v1/chat/completions или нативный /api/chat
+OPENAI_API = "openai"
+OLLAMA_API = "ollama"
+
+# Параметры OpenAI → options нативного API
+NATIVE_OPTIONS = {"temperature": "temperature", "top_p": "top_p", "max_tokens": "num_predict", "seed": "seed",
+                  "stop": "stop"}
+
+# Ключи конфига, которые задаются отдельно для каждой модели (основной и резервных)
+ENDPOINT_KEYS = ("model", "base_url", "timeout", "api", "keep_alive", "options")
+
+
+def _endpoint_entry(config: Dict[str, Any]) -> Dict[str, Any]:
+    entry = {key: config[key] for key in ENDPOINT_KEYS if key in config}
+    if config.get("api_type") == OLLAMA_API:
+        entry["api"] = OLLAMA_API
+    return entry
+
+
+def _endpoints(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [_endpoint_entry(config), *config.get("fallbacks", [])]
+
+
+def _timings(data: Dict[str, Any]) -> Dict[str, int]:
+    return {key: data[key] for key in TIMING_FIELDS if data.get(key)}
+
+
+def _native_usage(data: Dict[str, Any]) -> Dict[str, int]:
+    prompt, completion = data.get("prompt_eval_count", 0), data.get("eval_count", 0)
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+
+def _native_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Сообщения OpenAI → /api/chat: content — строка, arguments вызовов — объект"""
+    converted = []
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, list):
+            content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+        item: Dict[str, Any] = {"role": message["role"], "content": content}
+        if message.get("tool_calls"):
+            item["tool_calls"] = []
+            for call in message["tool_calls"]:
+                arguments = call["function"].get("arguments") or {}
+                if isinstance(arguments, str):
+                    try:
+                        arguments = json.loads(arguments)
+                    except ValueError:
+                        arguments = {}
+                item["tool_calls"].append({"function": {"name": call["function"]["name"], "arguments": arguments}})
+        converted.append(item)
+    return converted
+
+
+def _native_tool_calls(calls: Optional[List[Dict[str, Any]]]) -> Optional[List[Dict[str, Any]]]:
+    """Вызовы инструментов /api/chat → формат OpenAI (AutoGen ждет id и arguments строкой)"""
+    if not calls:
+        return None
+    return [
+        {
+            "id": f"call_{uuid.uuid4().hex[:12]}",
+            "type": "function",
+            "function": {"name": call["function"]["name"],
+                         "arguments": json.dumps(call["function"].get("arguments") or {}, ensure_ascii=False)},
+        }
+        for call in calls
+    ]
+
+
+def _native_format(response_format: Optional[Dict[str, Any]]) -> Any:
+    """response_format OpenAI → format /api/chat (JSON-схема или "json")"""
+    if not response_format:
+        return None
+    if response_format.get("type") == "json_schema":
+        return response_format["json_schema"]["schema"]
+    if response_format.get("type") == "json_object":
+        return "json"
+    return None
+
+
+class TimingStats:
+    """Длительности ответов нативного API по модели (load / prompt_eval / eval)"""
+
+    # load_duration дольше этого — модель загружалась с диска
+    COLD_LOAD_NS = 1_000_000_000
+
+    def __init__(self):
+        self.requests = 0
+        self.cold_loads = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.totals = dict.fromkeys(TIMING_FIELDS, 0)
+        self._lock = threading.Lock()
+
+    def record(self, timings: Dict[str, int], usage: Dict[str, int]):
+        with self._lock:
+            self.requests += 1
+            self.cold_loads += timings.get("load_duration", 0) > self.COLD_LOAD_NS
+            self.prompt_tokens += usage.get("prompt_tokens", 0)
+            self.completion_tokens += usage.get("completion_tokens", 0)
+            for key in TIMING_FIELDS:
+                self.totals[key] += timings.get(key, 0)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            requests_count = self.requests or 1
+            prompt_s = self.totals["prompt_eval_duration"] / 1e9
+            eval_s = self.totals["eval_duration"] / 1e9
+            return {
+                "requests": self.requests,
+                "cold_loads": self.cold_loads,
+                **{f"{key.removesuffix('_duration')}_avg_s": round(self.totals[key] / 1e9 / requests_count, 3)
+                   for key in TIMING_FIELDS},
+                "prompt_tokens_per_s": round(self.prompt_tokens / prompt_s, 1) if prompt_s else 0.0,
+                "eval_tokens_per_s": round(self.completion_tokens / eval_s, 1) if eval_s else 0.0,
+            }
+
+
+_timing_stats: Dict[str, TimingStats] = {}
+_timing_lock = threading.Lock()
+
+
+def _record_timings(model: str, base_url: str, timings: Dict[str, int], usage: Dict[str, int]):
+    if not timings:
+        return
+    key = f"{model}@{base_url.rstrip('/').removesuffix('/v1')}"
+    with _timing_lock:
+        stats = _timing_stats.setdefault(key, TimingStats())
+    stats.record(timings, usage)
+
+
+def timing_status() -> Dict[str, Dict[str, Any]]:
+    """Средние длительности и скорость (токенов/с) по моделям нативного API"""
+    with _timing_lock:
+        stats = dict(_timing_stats)
+    return {name: item.status() for name, item in stats.items()}
+
+
+class OllamaModelClient:
+    """
+    Клиент модели для AutoGen (register_model_client)
+
+    Ключи конфига помимо стандартных:
+        fallbacks: Список резервных {"model", "base_url", "timeout"} в порядке приоритета
+        breaker: Настройки circuit breaker (см. DEFAULT_BREAKER)
+        hedge: Настройки hedged-запросов (см. DEFAULT_HEDGE)
+        request_class: Класс запросов агента по умолчанию (INTERACTIVE для IDE-агентов)
+        api: OPENAI_API (по умолчанию) или OLLAMA_API — нативный /api/chat;
+            у модели задается также через "api_type": "ollama" в ее конфиге
+        keep_alive: Сколько Ollama держит модель в памяти ("30m", -1 — всегда);
+            только нативный API
+        options: Параметры модели Ollama (num_ctx, num_thread, ...); только нативный API
+
+    В нативном API ChatResponse.timings заполняется длительностями Ollama
+    (load / prompt_eval / eval), сводка — timing_status().
+    """
+
+    def __init__(self, config: Dict[str, Any], **kwargs):
+        self.config = config
+        # Имя агента задает register_ollama_client (для семантического кэша)
+        self.agent_name: Optional[str] = config.get("agent_name")
+        self.default_class = config.get("request_class", PIPELINE)
+        self.api = config.get("api", OPENAI_API)
+        self.endpoints = _endpoints(config)
+        self.breaker_settings = config.get("breaker", {})
+        self.hedge = {**DEFAULT_HEDGE, **config["hedge"]} if config.get("hedge") else None
+        if self.hedge and self.hedge["endpoints"]:
+            key = f"{self.endpoints[0]['model']}@{self.endpoints[0]['base_url']}"
+            self.hedge_stats = _hedge_stats.setdefault(key, HedgeStats(self.hedge))
+
+    def _native(self, endpoint: Dict[str, Any]) -> bool:
+        return endpoint.get("api", self.api) == OLLAMA_API
+
+    def _url(self, endpoint: Dict[str, Any]) -> str:
+        base_url = endpoint["base_url"].rstrip("/")
+        if self._native(endpoint):
+            return f"{base_url.removesuffix('/v1')}/api/chat"
+        return f"{base_url}/chat/completions"
+
+    def _payload(self, endpoint: Dict[str, Any], params: Dict[str, Any], stream: bool) -> Dict[str, Any]:
+        if self._native(endpoint):
+            return self._native_payload(endpoint, params, stream)
+        payload = {"model": endpoint["model"], "messages": params["messages"], "stream": stream}
+        payload.update({key: params[key] for key in PASSTHROUGH_PARAMS if params.get(key) is not None})
+        if stream:
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    def _native_payload(self, endpoint: Dict[str, Any], params: Dict[str, Any], stream: bool) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {"model": endpoint["model"], "messages": _native_messages(params["messages"]),
+                                   "stream": stream}
+        options = {**self.config.get("options", {}), **endpoint.get("options", {})}
+        options.update({name: params[key] for key, name in NATIVE_OPTIONS.items() if params.get(key) is not None})
+        if isinstance(options.get("stop"), str):
+            options["stop"] = [options["stop"]]
+        if options:
+            payload["options"] = options
+        keep_alive = endpoint.get("keep_alive", self.config.get("keep_alive"))
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        response_format = _native_format(params.get("response_format"))
+        if response_format is not None:
+            payload["format"] = response_format
+        if params.get("tools"):
+            payload["tools"] = params["tools"]
+        return payload
+
+    def _native_response(self, endpoint: Dict[str, Any], data: Dict[str, Any]) -> ChatResponse:
+        message = data.get("message", {})
+        tool_calls = _native_tool_calls(message.get("tool_calls"))
+        finish_reason = "tool_calls" if tool_calls else data.get("done_reason", "stop")
+        return ChatResponse(
+            model=data.get("model", endpoint["model"]),
+            choices=[ChatChoice(ChatMessage(message.get("role", "assistant"), message.get("content"), tool_calls),
+                                finish_reason)],
+            usage=_native_usage(data),
+            endpoint=endpoint["base_url"].rstrip("/"),
+            timings=_timings(data),
+        )
+
+    def _chunks(self, endpoint: Dict[str, Any], response: requests.Response) -> Iterator[Dict[str, Any]]:
+        """Куски потокового ответа в общем виде: content, finish_reason, usage, model, timings"""
+        native = self._native(endpoint)
+        for line in response.iter_lines(chunk_size=None):
+            text = line.decode("utf-8") if line else ""
+            if not native:
+                text = text.removeprefix("data: ")
+            if not text or text == "[DONE]":
+                continue
+            data = json.loads(text)
+            if native:
+                done = data.get("done", False)
+                yield {"content": data.get("message", {}).get("content"),
+                       "finish_reason": data.get("done_reason") if done else None,
+                       "usage": _native_usage(data) if done else {},
+                       "model": data.get("model"), "timings": _timings(data)}
+            else:
+                choice = (data.get("choices") or [{}])[0]
+                yield {"content": choice.get("delta", {}).get("content"), "finish_reason": choice.get("finish_reason"),
+                       "usage": data.get("usage") or {}, "model": data.get("model"), "timings": {}}
+
+    def _post(self, endpoint: Dict[str, Any], params: Dict[str, Any]) -> ChatResponse:
+        base_url = endpoint["base_url"].rstrip("/")
+        response = get_session(base_url).post(
+            self._url(endpoint),
+            json=self._payload(endpoint, params, stream=False),
+            timeout=endpoint.get("timeout", DEFAULT_TIMEOUT),
+        )
+        response.raise_for_status()
+        data = response.json()
+        if self._native(endpoint):
+            return self._native_response(endpoint, data)
+        choices = [
+            ChatChoice(
+                message=ChatMessage(
+                    role=choice["message"].get("role", "assistant"),
+                    content=choice["message"].get("content"),
+                    tool_calls=choice["message"].get("tool_calls"),
+                ),
+                finish_reason=choice.get("finish_reason"),
+            )
+            for choice in data.get("choices", [])
+        ]
+        return ChatResponse(model=data.get("model", endpoint["model"]), choices=choices,
+                            usage=data.get("usage", {}), endpoint=base_url, timings=_timings(data))
+
+    def _stream(self, race: _HedgeRace, name: str, endpoint: Dict[str, Any], params: Dict[str, Any],
+                admit: Optional[str] = None):
+        """
+        Потоковый запрос — участник гонки; соединение проигравшего закрывается
+
+        admit — класс запроса, если участник сам занимает слот admission своего
+        хоста (дубль на другой хост; слот основного держит _create)
+        """
+        base_url = endpoint["base_url"].rstrip("/")
+        started = time.monotonic()
+        try:
+            with ExitStack() as stack:
+                if admit is not None:
+                    stack.enter_context(get_controller(base_url).slot(admit, timeout=endpoint.get("timeout")))
+                    if race.lost(name):
+                        return
+                    started = time.monotonic()
+                response = stack.enter_context(get_session(base_url).post(
+                    self._url(endpoint),
+                    json=self._payload(endpoint, params, stream=True),
+                    timeout=endpoint.get("timeout", DEFAULT_TIMEOUT),
+                    stream=True,
+                ))
+                if not race.attach(name, response):
+                    return
+                response.raise_for_status()
+                parts: List[str] = []
+                usage: Dict[str, int] = {}
+                timings: Dict[str, int] = {}
+                model = endpoint["model"]
+                finish_reason = None
+                for chunk in self._chunks(endpoint, response):
+                    if race.lost(name):
+                        return
+                    usage = chunk["usage"] or usage
+                    timings = chunk["timings"] or timings
+                    model = chunk["model"] or model
+                    finish_reason = chunk["finish_reason"] or finish_reason
+                    if chunk["content"]:
+                        if not race.claim(name, time.monotonic() - started):
+                            return
+                        parts.append(chunk["content"])
+                if race.claim(name, time.monotonic() - started):
+                    race.results[name] = ChatResponse(
+                        model=model,
+                        choices=[ChatChoice(ChatMessage("assistant", "".join(parts)), finish_reason)],
+                        usage=usage,
+                        endpoint=base_url,
+                        timings=timings,
+                        ttft=race.ttft.get(name),
+                    )
+        except Exception as e:
+            # Ошибка проигравшего — следствие закрытого соединения, не сбой хоста
+            if not race.lost(name):
+                race.errors[name] = e
+        finally:
+            race.latency[name] = time.monotonic() - started
+            race.finish(name)
+
+    def _hedged_post(self, endpoint: Dict[str, Any], params: Dict[str, Any], breaker: CircuitBreaker) -> ChatResponse:
+        """
+        Отправить запрос; если первый токен не пришел за p95-задержку —
+        продублировать его на другой хост и взять ответ того, кто начнет первым
+
+        Результат дубля учитывается breaker'ом его хоста при любом исходе
+        (проигрыш — без вердикта), а основного — здесь, если победил дубль;
+        иначе основной учитывает _create.
+        """
+        race = _HedgeRace()
+        timeout = endpoint.get("timeout", DEFAULT_TIMEOUT)
+
+        # Поток не наследует контекст: класс запроса передается дублю явно
+        cls = current_request_class(self.default_class)
+
+        def start(name: str, target: Dict[str, Any], admit: Optional[str] = None):
+            with race.lock:
+                race.started += 1
+                race.done.clear()
+            threading.Thread(target=self._stream, args=(race, name, target, params, admit), daemon=True).start()
+
+        start("primary", endpoint)
+        deadline = time.monotonic() + self.hedge_stats.delay()
+        while time.monotonic() < deadline and not race.first_token.is_set() and not race.done.is_set():
+            race.first_token.wait(0.05)
+
+        hedge_breaker: Optional[CircuitBreaker] = None
+        # Сначала бюджет, потом breaker: allow() занимает пробный слот полуоткрытой цепи
+        if not race.first_token.is_set() and not race.done.is_set() and self.hedge_stats.try_hedge():
+            target = None
+            for candidate in self.hedge["endpoints"]:
+                if candidate["base_url"] == endpoint["base_url"]:
+                    continue
+                candidate_breaker = get_breaker(candidate["model"], candidate["base_url"], **self.breaker_settings)
+                if candidate_breaker.allow():
+                    target, hedge_breaker = candidate, candidate_breaker
+                    break
+            if target is None:
+                self.hedge_stats.cancel()
+            else:
+                start("hedge", {**target, "timeout": target.get("timeout", timeout)}, admit=cls)
+
+        race.done.wait(timeout)
+        winner = race.winner
+        hedge_error = race.errors.get("hedge")
+        self.hedge_stats.record(race.ttft.get(winner), hedge_won=winner == "hedge", hedge_error=hedge_error is not None)
+        if hedge_breaker is not None:
+            if winner == "hedge" and winner in race.results:
+                hedge_breaker.record(True, race.latency.get("hedge", 0.0))
+            elif isinstance(hedge_error, (requests.RequestException, ValueError, KeyError)):
+                hedge_breaker.record(False, race.latency.get("hedge", 0.0))
+            else:
+                hedge_breaker.release()
+        if winner in race.results:
+            if winner == "hedge":
+                primary_error = race.errors.get("primary")
+                if isinstance(primary_error, (requests.RequestException, ValueError, KeyError)):
+                    breaker.record(False, race.latency.get("primary", 0.0))
+                else:
+                    breaker.release()
+            return race.results[winner]
+        error = race.errors.get("primary") or next(iter(race.errors.values()), None)
+        if isinstance(error, (requests.RequestException, ValueError, KeyError)):
+            raise error
+        raise requests.Timeout(f"Нет ответа от {endpoint['base_url']} за {timeout}s")
+
+    def _use_hedge(self, index: int, params: Dict[str, Any]) -> bool:
+        return (
+            index == 0
+            and self.hedge is not None
+            and bool(self.hedge["endpoints"])
+            and current_request_class(self.default_class) in self.hedge["classes"]
+            and not params.get("tools")
+        )
+
+    def create(self, params: Dict[str, Any]) -> ChatResponse:
+        """Ответ из семантического кэша или запрос первой доступной модели, при ошибке — следующей"""
+        primary = self.endpoints[0]
+        cached = semantic_cache.lookup(self.agent_name, primary["model"], primary["base_url"], params)
+        if cached is not None and cached.answer is not None:
+            with span("semantic-cache", "llm", agent=self.agent_name, similarity=round(cached.similarity, 4)):
+                return ChatResponse(model=primary["model"], choices=[ChatChoice(ChatMessage("assistant", cached.answer),
+                                                                                "stop")],
+                                    endpoint="semantic-cache")
+        if cached is not None and cached.adapt_messages is not None:
+            params = {**params, "messages": cached.adapt_messages}
+        response = self._create(params)
+        if cached is not None:
+            choice = response.choices[0] if response.choices else None
+            if choice and not choice.message.tool_calls and choice.finish_reason != "length":
+                cached.store(choice.message.content)
+        return response
+
+    def _create(self, params: Dict[str, Any]) -> ChatResponse:
+        errors = []
+        cls = current_request_class(self.default_class)
+        for index, endpoint in enumerate(self.endpoints):
+            breaker = get_breaker(endpoint["model"], endpoint["base_url"], **self.breaker_settings)
+            if not breaker.allow():
+                errors.append(f"{breaker.name}: circuit open")
+                continue
+            # Слот хоста по приоритету класса; ожидание не входит в задержку breaker'а
+            queued = time.monotonic()
+            with get_controller(endpoint["base_url"]).slot(cls):
+                started = time.monotonic()
+                with span(endpoint["model"], "llm", endpoint=endpoint["base_url"], attempt=index, request_class=cls,
+                          queued_s=round(started - queued, 3), messages=len(params["messages"])) as current:
+                    try:
+                        if self._use_hedge(index, params):
+                            response = self._hedged_post(endpoint, params, breaker)
+                        else:
+                            response = self._post(endpoint, params)
+                    except (requests.RequestException, ValueError, KeyError) as e:
+                        breaker.record(False, time.monotonic() - started)
+                        errors.append(f"{breaker.name}: {e}")
+                        current.set(error=str(e))
+                        continue
+                    # Ответ дубля с другого хоста: основной уже учтен в _hedged_post
+                    if response.endpoint == endpoint["base_url"].rstrip("/"):
+                        breaker.record(True, time.monotonic() - started)
+                    response.fallback_used = index > 0
+                    current.set(prompt_tokens=response.usage.get("prompt_tokens", 0),
+                                completion_tokens=response.usage.get("completion_tokens", 0),
+                                served_by=response.endpoint, fallback=response.fallback_used)
+                    if response.ttft is not None:
+                        current.set(ttft_s=round(response.ttft, 3))
+            record_ollama_timings(current, response.timings)
+            _record_timings(response.model, response.endpoint, response.timings, response.usage)
+            return response
+        raise CircuitOpenError("; ".join(errors))
+
+    def stream(self, params: Dict[str, Any]) -> Iterator[str]:
+        """
+        Потоковый ответ первой доступной модели (куски текста по мере генерации)
+
+        Для IDE и agent_server: без hedging и кэшей; на резервную модель
+        переходит только ошибка до первого куска.
+        """
+        errors = []
+        cls = current_request_class(self.default_class)
+        for endpoint in self.endpoints:
+            breaker = get_breaker(endpoint["model"], endpoint["base_url"], **self.breaker_settings)
+            if not breaker.allow():
+                errors.append(f"{breaker.name}: circuit open")
+                continue
+            base_url = endpoint["base_url"].rstrip("/")
+            with get_controller(base_url).slot(cls):
+                started = time.monotonic()
+                streamed = False
+                try:
+                    with get_session(base_url).post(
+                        self._url(endpoint),
+                        json=self._payload(endpoint, params, stream=True),
+                        timeout=endpoint.get("timeout", DEFAULT_TIMEOUT),
+                        stream=True,
+                    ) as response:
+                        response.raise_for_status()
+                        for chunk in self._chunks(endpoint, response):
+                            if chunk["timings"]:
+                                _record_timings(endpoint["model"], base_url, chunk["timings"], chunk["usage"])
+                            if chunk["content"]:
+                                streamed = True
+                                yield chunk["content"]
+                except (requests.RequestException, ValueError) as e:
+                    breaker.record(False, time.monotonic() - started)
+                    if streamed:
+                        raise
+                    errors.append(f"{breaker.name}: {e}")
+                    continue
+                breaker.record(True, time.monotonic() - started)
+                return
+        raise CircuitOpenError("; ".join(errors))
+
+    def message_retrieval(self, response: ChatResponse) -> List[Any]:
+        return [
+            choice.message.content if not choice.message.tool_calls else {
+                "role": choice.message.role,
+                "content": choice.message.content,
+                "tool_calls": choice.message.tool_calls,
+            }
+            for choice in response.choices
+        ]
+
+    def cost(self, response: ChatResponse) -> float:
+        return 0.0
+
+    @staticmethod
+    def get_usage(response: ChatResponse) -> Dict[str, Any]:
+        return {
+            "prompt_tokens": response.usage.get("prompt_tokens", 0),
+            "completion_tokens": response.usage.get("completion_tokens", 0),
+            "total_tokens": response.usage.get("total_tokens", 0),
+            "cost": 0.0,
+            "model": response.model,
+        }
+
+
+# ============================================
+# ХЕЛПЕРЫ ДЛЯ КОНФИГУРАЦИЙ АГЕНТОВ
+# ============================================
+
+def resilient_llm_config(primary: Dict[str, Any], *fallbacks: Dict[str, Any], **options) -> Dict[str, Any]:
+    """
+    Собрать llm_config с резервными моделями
+
+    Args:
+        primary: Основная конфигурация (как MISTRAL_CONFIG)
+        fallbacks: Резервные конфигурации в порядке приоритета
+        options: Доп. ключи клиента (timeout, breaker, hedge, api, keep_alive, options, ...)
+
+    Returns:
+        llm_config для AssistantAgent; после создания агента вызвать
+        register_ollama_client(agent)
+    """
+    entry = {key: value for key, value in primary.items() if key != "api_type"}
+    entry.update(_endpoint_entry(primary))
+    entry["model_client_cls"] = OllamaModelClient.__name__
+    entry["fallbacks"] = [_endpoint_entry(fallback) for fallback in fallbacks]
+    entry.update(options)
+    return {"config_list": [entry]}
+
+
+def register_ollama_client(*agents):
+    """Подключить OllamaModelClient к агентам, созданным с resilient_llm_config"""
+    for agent in agents:
+        agent.register_model_client(model_client_cls=OllamaModelClient)
+        for client in agent.client._clients:
+            if isinstance(client, OllamaModelClient):
+                client.agent_name = agent.name
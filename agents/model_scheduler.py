@@ -0,0 +1,404 @@
+"""
+Планирование шагов с учетом загруженных в Ollama моделей
+На CPU-хосте с ограниченной памятью чередование Mistral / LLaMA / StarCoder
+между шагами заставляет Ollama выгружать одну модель ради другой, и каждое
+переключение стоит секунды-десятки секунд. Планировщик знает, какие модели
+уже в памяти (/api/ps) и сколько памяти отведено под модели, группирует
+независимые шаги по модели и, пока идет текущий шаг, заранее загружает модель
+следующего, если обе помещаются в бюджет
+
+Использование:
+    from devops_agent_optimized import feature_steps, scheduler
+    result = scheduler.run(feature_steps("Сервис уведомлений по email"))
+    result.outputs["review"], result.order, result.switches_avoided
+
+Настройка (переменные окружения):
+    OLLAMA_RAM_BUDGET_GB — память под модели (по умолчанию 75% RAM хоста)
+    OLLAMA_KEEP_ALIVE    — сколько держать загруженную заранее модель (30m)
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import requests
+
+from llm_client import OLLAMA_API
+from structured_output import single_reply
+from tracing import span
+
+KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Модель в памяти занимает больше файла весов (KV-кэш, буферы)
+LOAD_OVERHEAD = 1.2
+
+# Размер модели, если Ollama о ней ничего не сообщила
+DEFAULT_MODEL_SIZE = 5 * 1024 ** 3
+
+GB = 1024 ** 3
+
+
+def _root(base_url: str) -> str:
+    return base_url.rstrip("/").removesuffix("/v1")
+
+
+def _normalize(model: str) -> str:
+    return model if ":" in model else f"{model}:latest"
+
+
+def ram_budget() -> int:
+    """Память под модели, байт: OLLAMA_RAM_BUDGET_GB или 75% RAM хоста (0 — неизвестно)"""
+    if os.getenv("OLLAMA_RAM_BUDGET_GB"):
+        return int(float(os.environ["OLLAMA_RAM_BUDGET_GB"]) * GB)
+    try:
+        with open("/proc/meminfo", encoding="utf-8") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemTotal:"):
+                    return int(int(line.split()[1]) * 1024 * 0.75)
+    except OSError:
+        pass
+    return 0
+
+
+# ============================================
+# ЗАГРУЖЕННЫЕ МОДЕЛИ
+# ============================================
+
+class ResidencyMonitor:
+    """
+    Какие модели загружены на хосте Ollama и сколько они занимают
+
+    Размер незагруженной модели берется из прошлых наблюдений /api/ps,
+    иначе — размер файла из /api/tags с запасом LOAD_OVERHEAD.
+    """
+
+    def __init__(self, base_url: str, budget: Optional[int] = None):
+        self.root = _root(base_url)
+        self.budget = ram_budget() if budget is None else budget
+        self._sizes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def resident(self) -> Dict[str, int]:
+        """Загруженные модели: имя → байт в памяти (пусто, если хост недоступен)"""
+        try:
+            response = requests.get(f"{self.root}/api/ps", timeout=5)
+            response.raise_for_status()
+            models = {_normalize(item["name"]): int(item.get("size", 0)) for item in response.json().get("models", [])}
+        except (requests.RequestException, ValueError, KeyError):
+            return {}
+        with self._lock:
+            self._sizes.update({name: size for name, size in models.items() if size})
+        return models
+
+    def size(self, model: str) -> int:
+        model = _normalize(model)
+        with self._lock:
+            if model in self._sizes:
+                return self._sizes[model]
+        try:
+            response = requests.get(f"{self.root}/api/tags", timeout=5)
+            response.raise_for_status()
+            for item in response.json().get("models", []):
+                if _normalize(item["name"]) == model and item.get("size"):
+                    size = int(item["size"] * LOAD_OVERHEAD)
+                    with self._lock:
+                        self._sizes.setdefault(model, size)
+                    return size
+        except (requests.RequestException, ValueError, KeyError):
+            pass
+        return DEFAULT_MODEL_SIZE
+
+    def fits(self, models: Sequence[str]) -> bool:
+        """Помещаются ли модели в бюджет одновременно"""
+        return self.budget > 0 and sum(self.size(model) for model in set(models)) <= self.budget
+
+    def prefetch(self, model: str, keep_alive: Union[str, int] = KEEP_ALIVE,
+                 options: Optional[Dict[str, Any]] = None) -> threading.Thread:
+        """
+        Загрузить модель в фоне (пустой /api/generate с keep_alive)
+
+        options должны совпадать с options запросов шага: при другом num_ctx
+        Ollama перезапускает раннер, и первый запрос загрузит модель заново.
+        """
+        payload: Dict[str, Any] = {"model": model, "keep_alive": keep_alive}
+        if options:
+            payload["options"] = options
+
+        def load():
+            try:
+                requests.post(f"{self.root}/api/generate", json=payload, timeout=600).raise_for_status()
+            except requests.RequestException:
+                pass
+
+        thread = threading.Thread(target=load, name=f"prefetch-{model}", daemon=True)
+        thread.start()
+        return thread
+
+
+_monitors: Dict[str, ResidencyMonitor] = {}
+_monitors_lock = threading.Lock()
+
+
+def get_monitor(base_url: str) -> ResidencyMonitor:
+    with _monitors_lock:
+        return _monitors.setdefault(_root(base_url), ResidencyMonitor(base_url))
+
+
+# ============================================
+# ПЛАН
+# ============================================
+
+@dataclass
+class Step:
+    """
+    Шаг пайплайна: одно сообщение агенту
+
+    Args:
+        name: Имя шага (ключ в результатах)
+        agent: Агент AutoGen
+        message: Текст задачи или функция от ответов предыдущих шагов
+        depends_on: Имена шагов, ответы которых нужны этому шагу
+    """
+    name: str
+    agent: Any
+    message: Union[str, Callable[[Dict[str, str]], str]]
+    depends_on: Tuple[str, ...] = ()
+
+    def _endpoint(self) -> Dict[str, Any]:
+        config = self.agent.llm_config or {}
+        return (config.get("config_list") or [config])[0]
+
+    @property
+    def model(self) -> str:
+        return _normalize(self._endpoint().get("model", "?"))
+
+    @property
+    def base_url(self) -> str:
+        return _root(self._endpoint().get("base_url", ""))
+
+    @property
+    def options(self) -> Dict[str, Any]:
+        """options нативного API Ollama, с которыми модель шага загружается"""
+        endpoint = self._endpoint()
+        return dict(endpoint.get("options", {})) if endpoint.get("api") == OLLAMA_API else {}
+
+    @property
+    def keep_alive(self) -> Optional[Union[str, int]]:
+        endpoint = self._endpoint()
+        return endpoint.get("keep_alive") if endpoint.get("api") == OLLAMA_API else None
+
+
+def _touch(cache: List[str], model: str, sizes: Dict[str, int], budget: int) -> bool:
+    """Отметить использование модели в памяти хоста (LRU); True — модель пришлось загружать"""
+    loaded = model not in cache
+    if not loaded:
+        cache.remove(model)
+    cache.append(model)
+    while len(cache) > 1 and sum(sizes[name] for name in cache) > budget:
+        cache.pop(0)
+    return loaded
+
+
+def count_switches(order: Sequence[Step]) -> int:
+    """Сколько раз подряд идущие шаги меняют модель"""
+    return sum(1 for previous, step in zip(order, order[1:]) if previous.model != step.model)
+
+
+def simulate_loads(order: Sequence[Step], resident: Sequence[str], sizes: Dict[str, int], budget: int) -> int:
+    """Сколько загрузок моделей потребует порядок шагов при заданном бюджете"""
+    cache = list(resident)
+    return sum(_touch(cache, step.model, sizes, budget) for step in order)
+
+
+def plan(steps: Sequence[Step], resident: Sequence[str], sizes: Dict[str, int], budget: int) -> List[Step]:
+    """
+    Порядок шагов с минимумом переключений моделей
+
+    Из готовых шагов (все зависимости выполнены) берется шаг на текущей модели,
+    затем — на уже загруженной, иначе — на модели, у которой больше всего
+    готовых шагов. При равенстве сохраняется исходный порядок.
+
+    Raises:
+        ValueError: неизвестная или циклическая зависимость
+    """
+    names = {step.name for step in steps}
+    for step in steps:
+        unknown = set(step.depends_on) - names
+        if unknown:
+            raise ValueError(f"Шаг {step.name} зависит от неизвестных шагов: {', '.join(sorted(unknown))}")
+
+    cache = list(resident)
+    current = cache[-1] if cache else None
+    pending = list(steps)
+    done: set = set()
+    order: List[Step] = []
+    while pending:
+        ready = [step for step in pending if all(name in done for name in step.depends_on)]
+        if not ready:
+            raise ValueError(f"Циклическая зависимость: {', '.join(step.name for step in pending)}")
+        step = (
+            next((s for s in ready if s.model == current), None)
+            or next((s for s in ready if s.model in cache), None)
+            or max(ready, key=lambda s: (sum(r.model == s.model for r in ready), -ready.index(s)))
+        )
+        _touch(cache, step.model, sizes, budget)
+        current = step.model
+        pending.remove(step)
+        done.add(step.name)
+        order.append(step)
+    return order
+
+
+# ============================================
+# ВЫПОЛНЕНИЕ
+# ============================================
+
+@dataclass
+class ScheduleResult:
+    outputs: Dict[str, str]
+    order: List[str]
+    switches: int
+    baseline_switches: int
+    cold_starts: int
+    prefetches: int
+    seconds: float
+    models: Dict[str, str] = field(default_factory=dict)  # шаг → модель
+
+    @property
+    def switches_avoided(self) -> int:
+        return max(0, self.baseline_switches - self.switches)
+
+
+_schedulers: Dict[str, "ModelScheduler"] = {}
+
+
+class ModelScheduler:
+    """
+    Выполнение шагов пайплайна в порядке, щадящем память хоста
+
+    Шаги выполняются последовательно (на CPU параллельные генерации разных
+    моделей только делят ядра). Порядок — plan(); учитываются модели шагов
+    на хосте первого шага, шаги на других хостах переключений не вызывают.
+
+    Args:
+        name: Имя для scheduler_status()
+        budget: Память под модели, байт (по умолчанию ram_budget())
+        prefetch: Загружать модель следующего шага во время текущего
+        keep_alive: keep_alive для предзагрузки
+    """
+
+    def __init__(self, name: str = "default", budget: Optional[int] = None, prefetch: bool = True,
+                 keep_alive: Union[str, int] = KEEP_ALIVE):
+        self.name = name
+        self.budget = budget
+        self.prefetch_enabled = prefetch
+        self.keep_alive = keep_alive
+        self.runs = 0
+        self.steps = 0
+        self.switches = 0
+        self.baseline_switches = 0
+        self.cold_starts = 0
+        self.prefetches = 0
+        self.prefetch_hits = 0
+        self.prefetch_skipped = 0
+        self._lock = threading.Lock()
+        _schedulers[name] = self
+
+    def _monitor(self, base_url: str) -> ResidencyMonitor:
+        monitor = get_monitor(base_url)
+        if self.budget is not None:
+            monitor.budget = self.budget
+        return monitor
+
+    def order(self, steps: Sequence[Step]) -> List[Step]:
+        """Порядок выполнения (без запуска)"""
+        if not steps:
+            return []
+        monitor = self._monitor(steps[0].base_url)
+        resident = list(monitor.resident())
+        host_models = {step.model for step in steps if step.base_url == monitor.root}
+        sizes = {model: monitor.size(model) for model in host_models | set(resident)}
+        # Модели других хостов не занимают память этого: нулевой размер
+        sizes.update({step.model: 0 for step in steps if step.model not in host_models})
+        return plan(steps, resident, sizes, monitor.budget)
+
+    def run(self, steps: Sequence[Step]) -> ScheduleResult:
+        """
+        Выполнить шаги
+
+        Returns:
+            ScheduleResult с ответами по именам шагов и метриками переключений
+        """
+        started = time.monotonic()
+        order = self.order(steps)
+        monitor = self._monitor(order[0].base_url) if order else None
+        outputs: Dict[str, str] = {}
+        cold_starts = prefetches = hits = skipped = 0
+        loading: Dict[str, threading.Thread] = {}
+
+        with span(f"schedule {self.name}", "step", steps=len(order),
+                  order=" → ".join(f"{step.name}({step.model})" for step in order)) as schedule_span:
+            for index, step in enumerate(order):
+                on_host = monitor is not None and step.base_url == monitor.root
+                if on_host and step.model in loading:
+                    loading.pop(step.model).join()
+                    hits += step.model in monitor.resident()
+                cold = on_host and step.model not in monitor.resident()
+                cold_starts += cold
+
+                following = order[index + 1] if index + 1 < len(order) else None
+                if (self.prefetch_enabled and on_host and following is not None
+                        and following.base_url == monitor.root and following.model != step.model
+                        and following.model not in loading):
+                    # Предзагрузка не должна вытеснять модель текущего шага
+                    if monitor.fits([step.model, following.model]):
+                        loading[following.model] = monitor.prefetch(
+                            following.model, following.keep_alive or self.keep_alive, following.options)
+                        prefetches += 1
+                    else:
+                        skipped += 1
+
+                message = step.message(outputs) if callable(step.message) else step.message
+                with span(step.name, "step", agent=step.agent.name, model=step.model, cold=cold):
+                    reply = single_reply(step.agent, message)
+                outputs[step.name] = reply if isinstance(reply, str) else (reply or {}).get("content") or ""
+
+            for thread in loading.values():
+                thread.join()
+            switches, baseline = count_switches(order), count_switches(list(steps))
+            schedule_span.set(switches=switches, baseline_switches=baseline, cold_starts=cold_starts,
+                              prefetches=prefetches)
+
+        with self._lock:
+            self.runs += 1
+            self.steps += len(order)
+            self.switches += switches
+            self.baseline_switches += baseline
+            self.cold_starts += cold_starts
+            self.prefetches += prefetches
+            self.prefetch_hits += hits
+            self.prefetch_skipped += skipped
+        return ScheduleResult(outputs, [step.name for step in order], switches, baseline, cold_starts, prefetches,
+                              round(time.monotonic() - started, 2), {step.name: step.model for step in order})
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "runs": self.runs,
+                "steps": self.steps,
+                "switches": self.switches,
+                "baseline_switches": self.baseline_switches,
+                "switches_avoided": max(0, self.baseline_switches - self.switches),
+                "cold_starts": self.cold_starts,
+                "prefetches": self.prefetches,
+                "prefetch_hits": self.prefetch_hits,
+                "prefetch_skipped_ram": self.prefetch_skipped,
+                "budget_gb": round((self.budget if self.budget is not None else ram_budget()) / GB, 1),
+            }
+
+
+def scheduler_status() -> Dict[str, Dict[str, Any]]:
+    """Метрики всех планировщиков: переключения моделей, холодные старты, предзагрузки"""
+    return {name: scheduler.status() for name, scheduler in _schedulers.items()}
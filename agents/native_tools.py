@@ -0,0 +1,309 @@
+"""
+Нативные инструменты агентов (function calling)
+Вместо того чтобы писать shell-скрипт (`df -h`, `ollama list`, `cat file`),
+который UserProxyAgent запускает отдельным процессом, агент вызывает
+зарегистрированную функцию: один раунд генерации, выполнение в процессе,
+структурированный результат (JSON) вместо разбора вывода команд
+
+Использование:
+    register_tools(model_manager, [user], MODEL_TOOLS)
+    register_tools(reviewer, [user], REVIEW_TOOLS)
+    tool_status()  # вызовы, ошибки и время по инструментам
+"""
+
+import functools
+import os
+import shutil
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Annotated, Any, Callable, Dict, List, Optional, Sequence
+
+import requests
+from autogen import register_function
+
+from affected_tests import REPO_ROOT, ProjectGraph
+from tracing import span
+
+OLLAMA_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1").rstrip("/").removesuffix("/v1")
+
+# Ограничения объема результата: ответ инструмента целиком попадает в контекст модели
+MAX_READ_LINES = 400
+MAX_RESULT_CHARS = 20000
+MAX_GREP_RESULTS = 200
+
+GB = 1024 ** 3
+
+COMMAND_TIMEOUT = 30
+
+
+class ToolError(Exception):
+    """Ошибка инструмента: возвращается модели как {"error": ...}, а не исключением"""
+
+
+# ============================================
+# УЧЕТ ВЫЗОВОВ
+# ============================================
+
+_stats: Dict[str, Dict[str, float]] = {}
+_stats_lock = threading.Lock()
+
+
+def _tool(func: Callable[..., Any]) -> Callable[..., Any]:
+    """Спан, учет вызовов и ошибка как структурированный результат"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.monotonic()
+        error = None
+        with span(func.__name__, "tool", **{key: str(value)[:80] for key, value in kwargs.items()}) as current:
+            try:
+                result = func(*args, **kwargs)
+            except (ToolError, OSError, ValueError, subprocess.SubprocessError, requests.RequestException) as e:
+                error = str(e)
+                result = {"error": error}
+                current.set(error=error)
+        with _stats_lock:
+            stats = _stats.setdefault(func.__name__, {"calls": 0, "errors": 0, "seconds": 0.0})
+            stats["calls"] += 1
+            stats["errors"] += error is not None
+            stats["seconds"] += time.monotonic() - started
+        return result
+    return wrapper
+
+
+def tool_status() -> Dict[str, Dict[str, Any]]:
+    """Вызовы, ошибки и среднее время по инструментам"""
+    with _stats_lock:
+        return {
+            name: {"calls": int(stats["calls"]), "errors": int(stats["errors"]),
+                   "avg_ms": round(stats["seconds"] / stats["calls"] * 1000, 1) if stats["calls"] else 0.0}
+            for name, stats in _stats.items()
+        }
+
+
+def _repo_path(path: str) -> Path:
+    """Путь внутри репозитория (выход за его пределы запрещен)"""
+    resolved = (REPO_ROOT / path).resolve()
+    if resolved != REPO_ROOT and REPO_ROOT not in resolved.parents:
+        raise ToolError(f"Путь вне репозитория: {path}")
+    return resolved
+
+
+def _git(*args: str) -> str:
+    result = subprocess.run(["git", *args], cwd=REPO_ROOT, capture_output=True, text=True, timeout=COMMAND_TIMEOUT)
+    if result.returncode not in (0, 1):  # 1 — «ничего не найдено» у git grep
+        raise ToolError(result.stderr.strip() or f"git {args[0]}: код {result.returncode}")
+    return result.stdout
+
+
+def _clip(text: str) -> Dict[str, Any]:
+    return {"text": text[:MAX_RESULT_CHARS], "truncated": len(text) > MAX_RESULT_CHARS}
+
+
+# ============================================
+# КОД
+# ============================================
+
+@_tool
+def read_file(
+    path: Annotated[str, "Путь от корня репозитория"],
+    start: Annotated[int, "Первая строка (с 1)"] = 1,
+    end: Annotated[Optional[int], "Последняя строка включительно (по умолчанию start + 399)"] = None,
+) -> Dict[str, Any]:
+    """Прочитать диапазон строк файла репозитория (строки пронумерованы)"""
+    file = _repo_path(path)
+    if not file.is_file():
+        raise ToolError(f"Нет файла: {path}")
+    lines = file.read_text(encoding="utf-8", errors="replace").splitlines()
+    start = max(1, start)
+    end = min(len(lines), end or start + MAX_READ_LINES - 1, start + MAX_READ_LINES - 1)
+    content = "\n".join(f"{number}: {lines[number - 1]}" for number in range(start, end + 1))
+    return {"path": path, "start": start, "end": end, "total_lines": len(lines), **_clip(content)}
+
+
+@_tool
+def grep_repo(
+    pattern: Annotated[str, "Регулярное выражение (POSIX extended)"],
+    path: Annotated[str, "Каталог или файл от корня репозитория"] = ".",
+    glob: Annotated[Optional[str], "Фильтр файлов, например *.ts"] = None,
+    max_results: Annotated[int, "Максимум совпадений"] = 50,
+) -> Dict[str, Any]:
+    """Найти строки в отслеживаемых git файлах репозитория"""
+    target = _repo_path(path)
+    pathspec = os.path.relpath(target, REPO_ROOT)
+    if glob:
+        pathspec = f":(glob){'' if pathspec == '.' else pathspec + '/'}**/{glob}"
+    output = _git("grep", "-n", "-I", "-E", "--full-name", "-e", pattern, "--", pathspec)
+    matches = []
+    lines = output.splitlines()
+    for line in lines[:min(max_results, MAX_GREP_RESULTS)]:
+        file, number, text = line.split(":", 2)
+        matches.append({"file": file, "line": int(number), "text": text.strip()[:200]})
+    return {"pattern": pattern, "matches": matches, "total": len(lines), "truncated": len(lines) > len(matches)}
+
+
+@_tool
+def git_diff(
+    path: Annotated[Optional[str], "Ограничить файлом или каталогом"] = None,
+    base: Annotated[Optional[str], "С чем сравнивать (коммит/ветка); по умолчанию рабочее дерево с HEAD"] = None,
+    staged: Annotated[bool, "Только проиндексированные изменения"] = False,
+) -> Dict[str, Any]:
+    """Изменения в репозитории: список файлов со счетчиками строк и сам diff"""
+    args = ["--cached"] if staged else []
+    if base:
+        if base.startswith("-"):
+            raise ToolError(f"Некорректная ревизия: {base}")
+        args.append(base)
+    pathspec = ["--", os.path.relpath(_repo_path(path), REPO_ROOT)] if path else []
+    files = []
+    for line in _git("diff", "--numstat", *args, *pathspec).splitlines():
+        added, deleted, file = line.split("\t", 2)
+        files.append({"path": file, "added": int(added) if added != "-" else None,
+                      "deleted": int(deleted) if deleted != "-" else None})
+    return {"files": files, **_clip(_git("diff", *args, *pathspec))}
+
+
+_graph: Optional[ProjectGraph] = None
+
+
+@_tool
+def list_nx_projects(
+    name_filter: Annotated[Optional[str], "Подстрока имени или пути проекта"] = None,
+    file: Annotated[Optional[str], "Вернуть проект, которому принадлежит файл"] = None,
+) -> Dict[str, Any]:
+    """Проекты Nx: имя, корень, тип (app/lib), зависимости и зависящие проекты"""
+    global _graph
+    if _graph is None:
+        _graph = ProjectGraph.load()
+    if file:
+        projects = [project for project in [_graph.owner(file)] if project is not None]
+    else:
+        projects = [project for project in _graph.projects.values()
+                    if not name_filter or name_filter in project.name or name_filter in project.root]
+    return {"projects": [
+        {"name": project.name, "root": project.root,
+         "type": "app" if project.root.startswith("apps/") else "lib",
+         "dependencies": sorted(project.dependencies),
+         "dependents": sorted(_graph.dependents([project.name]))}
+        for project in sorted(projects, key=lambda item: item.name)
+    ]}
+
+
+# ============================================
+# МОДЕЛИ И РЕСУРСЫ
+# ============================================
+
+@_tool
+def ollama_models() -> Dict[str, Any]:
+    """Установленные модели Ollama (размер, параметры, квантование) и загруженные в память"""
+    installed = requests.get(f"{OLLAMA_URL}/api/tags", timeout=10)
+    installed.raise_for_status()
+    loaded = requests.get(f"{OLLAMA_URL}/api/ps", timeout=10)
+    loaded.raise_for_status()
+    return {
+        "installed": [
+            {"name": model["name"], "size_gb": round(model.get("size", 0) / GB, 2),
+             "parameters": model.get("details", {}).get("parameter_size"),
+             "quantization": model.get("details", {}).get("quantization_level"),
+             "family": model.get("details", {}).get("family"), "modified": model.get("modified_at")}
+            for model in installed.json().get("models", [])
+        ],
+        "loaded": [
+            {"name": model["name"], "size_gb": round(model.get("size", 0) / GB, 2),
+             "vram_gb": round(model.get("size_vram", 0) / GB, 2), "expires_at": model.get("expires_at")}
+            for model in loaded.json().get("models", [])
+        ],
+    }
+
+
+@_tool
+def ollama_model_info(model: Annotated[str, "Имя модели, например qwen2.5:7b"]) -> Dict[str, Any]:
+    """Сведения о модели Ollama: семейство, параметры, квантование, длина контекста, настройки"""
+    response = requests.post(f"{OLLAMA_URL}/api/show", json={"model": model}, timeout=30)
+    if response.status_code == 404:
+        raise ToolError(f"Модель {model} не установлена")
+    response.raise_for_status()
+    data = response.json()
+    info = data.get("model_info", {})
+    context = next((value for key, value in info.items() if key.endswith(".context_length")), None)
+    return {
+        "model": model,
+        "details": data.get("details", {}),
+        "context_length": context,
+        "parameter_count": info.get("general.parameter_count"),
+        "parameters": data.get("parameters", ""),
+    }
+
+
+def _meminfo() -> Dict[str, int]:
+    values = {}
+    with open("/proc/meminfo", encoding="utf-8") as meminfo:
+        for line in meminfo:
+            key, _, rest = line.partition(":")
+            values[key] = int(rest.split()[0]) * 1024
+    return values
+
+
+@_tool
+def system_resources(path: Annotated[str, "Путь, для которого считать место на диске"] = ".") -> Dict[str, Any]:
+    """Место на диске, оперативная память и загрузка CPU хоста"""
+    disk = shutil.disk_usage(_repo_path(path))
+    # Модели Ollama лежат в OLLAMA_MODELS (по умолчанию ~/.ollama), часто на другом разделе
+    models_dir = Path(os.getenv("OLLAMA_MODELS", Path.home() / ".ollama"))
+    result: Dict[str, Any] = {
+        "disk": {"path": path, "total_gb": round(disk.total / GB, 1), "free_gb": round(disk.free / GB, 1)},
+        "cpu": {"count": os.cpu_count(), "load_avg": [round(value, 2) for value in os.getloadavg()]},
+    }
+    if models_dir.exists():
+        models_disk = shutil.disk_usage(models_dir)
+        result["models_disk"] = {"path": str(models_dir), "total_gb": round(models_disk.total / GB, 1),
+                                 "free_gb": round(models_disk.free / GB, 1)}
+    try:
+        memory = _meminfo()
+        result["memory"] = {"total_gb": round(memory["MemTotal"] / GB, 1),
+                            "available_gb": round(memory["MemAvailable"] / GB, 1),
+                            "swap_free_gb": round(memory.get("SwapFree", 0) / GB, 1)}
+    except (OSError, KeyError):
+        result["memory"] = None
+    return result
+
+
+# ============================================
+# РЕГИСТРАЦИЯ
+# ============================================
+
+TOOLS: Dict[str, Callable[..., Any]] = {
+    tool.__name__: tool
+    for tool in (read_file, grep_repo, git_diff, list_nx_projects, ollama_models, ollama_model_info, system_resources)
+}
+
+REVIEW_TOOLS = ("read_file", "grep_repo", "git_diff", "list_nx_projects")
+MODEL_TOOLS = ("ollama_models", "ollama_model_info", "system_resources")
+
+
+def register_tools(caller: Any, executors: Sequence[Any], names: Sequence[str] = tuple(TOOLS)) -> List[str]:
+    """
+    Зарегистрировать инструменты: caller предлагает вызов, executors выполняют
+
+    Регистрация пересоздает клиента агента (AutoGen обновляет llm_config["tools"]),
+    поэтому OllamaModelClient подключается заново.
+
+    Returns:
+        Имена зарегистрированных инструментов
+    """
+    if not executors:
+        raise ValueError("Нужен хотя бы один агент-исполнитель")
+    unknown = set(names) - set(TOOLS)
+    if unknown:
+        raise ValueError(f"Нет инструментов: {', '.join(sorted(unknown))}; есть: {', '.join(TOOLS)}")
+    for name in names:
+        description = (TOOLS[name].__doc__ or name).strip()
+        register_function(TOOLS[name], caller=caller, executor=executors[0], name=name, description=description)
+        for executor in executors[1:]:
+            executor.register_for_execution(name=name)(TOOLS[name])
+    entries = caller.llm_config.get("config_list") or [caller.llm_config]
+    if any(entry.get("model_client_cls") for entry in entries):
+        from llm_client import register_ollama_client
+        register_ollama_client(caller)
+    return list(names)
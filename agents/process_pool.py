@@ -0,0 +1,218 @@
+"""
+Пул процессов для агентов и шагов пайплайна
+Каждый воркер — отдельный Python-процесс со своими агентами, поэтому разбор
+JSON, извлечение кода, выполнение кода и проверки разных задач не упираются
+в один GIL. Обмен с воркерами — JSON-сообщения через pipe
+
+Протокол:
+    запрос:  {"id": 1, "call": "devops_agent_complete:create_feature", "args": [...], "kwargs": {...}}
+    ответ:   {"id": 1, "ok": true, "result": ..., "pid": 123, "seconds": 1.5}
+             {"id": 1, "ok": false, "error": "...", "traceback": "...", "pid": 123}
+    стоп:    null
+
+Использование:
+    python process_pool.py devops_agent_complete:create_feature "Фича 1" "Фича 2" --workers 2
+"""
+
+import argparse
+import contextlib
+import dataclasses
+import importlib
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+AGENTS_DIR = Path(__file__).resolve().parent
+LOG_DIR = AGENTS_DIR.parent / ".cache" / "agent-workers"
+
+
+class WorkerError(Exception):
+    """Задача упала в воркере (или воркер завершился)"""
+
+    def __init__(self, message: str, remote_traceback: str = ""):
+        super().__init__(message)
+        self.remote_traceback = remote_traceback
+
+
+def to_jsonable(value: Any) -> Any:
+    """Привести результат к JSON: dataclass (StepArtifact, ...) → dict"""
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    if isinstance(value, dict):
+        return {str(key): to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [to_jsonable(item) for item in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def _resolve(call: str) -> Callable:
+    module_name, _, function_name = call.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def _worker_main(conn, preload: List[str], log_dir: Optional[str]):
+    """Цикл воркера: читать запросы из pipe, выполнять, отвечать"""
+    sys.path.insert(0, str(AGENTS_DIR))
+    for module_name in preload:
+        importlib.import_module(module_name)
+    while True:
+        try:
+            message = json.loads(conn.recv_bytes())
+        except EOFError:
+            break
+        if message is None:
+            break
+        started = time.monotonic()
+        response: Dict[str, Any] = {"id": message["id"], "pid": os.getpid()}
+        log = open(Path(log_dir) / f"job-{message['id']}-{os.getpid()}.log", "w") if log_dir else None
+        try:
+            with contextlib.redirect_stdout(log) if log else contextlib.nullcontext():
+                result = _resolve(message["call"])(*message.get("args", []), **message.get("kwargs", {}))
+            response.update(ok=True, result=to_jsonable(result))
+        except Exception as e:
+            response.update(ok=False, error=f"{type(e).__name__}: {e}", traceback=traceback.format_exc())
+        finally:
+            if log:
+                log.close()
+        response["seconds"] = round(time.monotonic() - started, 3)
+        conn.send_bytes(json.dumps(response, ensure_ascii=False).encode())
+    conn.close()
+
+
+class _Worker:
+    def __init__(self, context, preload: List[str], log_dir: Optional[str]):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child, preload, log_dir), daemon=True)
+        self.process.start()
+        child.close()
+
+
+class AgentProcessPool:
+    """
+    Пул процессов-воркеров с очередью задач
+
+    Args:
+        workers: Число процессов (по умолчанию — число ядер)
+        preload: Модули, импортируемые в воркере заранее (агенты создаются один раз)
+        log_dir: Куда писать stdout задач (None — выводить как есть)
+
+    Пример:
+        with AgentProcessPool(workers=3, preload=["devops_agent_complete"]) as pool:
+            futures = [pool.submit("devops_agent_complete:create_feature", d) for d in descriptions]
+            results = [f.result() for f in futures]
+    """
+
+    def __init__(self, workers: Optional[int] = None, preload: Iterable[str] = (),
+                 log_dir: Optional[Path] = LOG_DIR):
+        self.size = workers or os.cpu_count() or 1
+        self.preload = list(preload)
+        self.log_dir = str(log_dir) if log_dir else None
+        if self.log_dir:
+            Path(self.log_dir).mkdir(parents=True, exist_ok=True)
+        # spawn: воркеры не наследуют потоки и HTTP-сессии родителя
+        self._context = multiprocessing.get_context("spawn")
+        self._jobs: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._ids = itertools.count(1)
+        self._threads = [threading.Thread(target=self._dispatch, daemon=True) for _ in range(self.size)]
+        for thread in self._threads:
+            thread.start()
+
+    def _dispatch(self):
+        """Поток-диспетчер одного воркера; перезапускает воркер, если тот умер"""
+        worker = _Worker(self._context, self.preload, self.log_dir)
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            future, request = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                worker.conn.send_bytes(json.dumps(request, ensure_ascii=False).encode())
+                response = json.loads(worker.conn.recv_bytes())
+            except (EOFError, OSError) as e:
+                worker.process.join(timeout=5)
+                future.set_exception(WorkerError(
+                    f"Воркер {worker.process.pid} завершился (код {worker.process.exitcode}): {e}"))
+                worker = _Worker(self._context, self.preload, self.log_dir)
+                continue
+            if response["ok"]:
+                future.set_result(response["result"])
+            else:
+                future.set_exception(WorkerError(response["error"], response.get("traceback", "")))
+        with contextlib.suppress(OSError):
+            worker.conn.send_bytes(b"null")
+        worker.process.join(timeout=10)
+        if worker.process.is_alive():
+            worker.process.kill()
+
+    def submit(self, call: str, *args, **kwargs) -> Future:
+        """
+        Поставить задачу в очередь
+
+        Args:
+            call: "модуль:функция" (модуль из agents/)
+            args, kwargs: JSON-сериализуемые аргументы
+
+        Returns:
+            Future с JSON-результатом (dataclass-ы приходят как dict)
+        """
+        future: Future = Future()
+        self._jobs.put((future, {"id": next(self._ids), "call": call,
+                                 "args": to_jsonable(list(args)), "kwargs": to_jsonable(kwargs)}))
+        return future
+
+    def map(self, call: str, items: Iterable[Any]) -> List[Future]:
+        """По задаче на каждый элемент (передается первым аргументом)"""
+        return [self.submit(call, item) for item in items]
+
+    def shutdown(self):
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self) -> "AgentProcessPool":
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запуск шагов агентов в пуле процессов")
+    parser.add_argument("call", help="модуль:функция, например devops_agent_complete:create_feature")
+    parser.add_argument("items", nargs="+", help="Аргумент для каждой задачи")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    module_name = args.call.partition(":")[0]
+    results = {}
+    with AgentProcessPool(workers=args.workers, preload=[module_name]) as pool:
+        futures = dict(zip(args.items, pool.map(args.call, args.items)))
+        for item, future in futures.items():
+            try:
+                results[item] = {"ok": True, "result": future.result()}
+                print(f"✅ {item}")
+            except WorkerError as e:
+                results[item] = {"ok": False, "error": str(e)}
+                print(f"❌ {item}: {e}")
+    print(f"Логи задач: {LOG_DIR}")
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
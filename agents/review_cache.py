@@ -0,0 +1,198 @@
+"""
+Кэш результатов code review по файлам
+Ключ — путь и хэш содержимого файла, версия промпта ревьюера (системный промпт и
+правила .specify) и модель: неизмененные файлы берут прошлые замечания,
+к модели уходят только измененные
+
+Использование:
+    python review_cache.py --stats
+    python review_cache.py --invalidate libs/backend/domain/auth
+    python review_cache.py --invalidate-all
+    python review_cache.py --prune   # удалить записи устаревших правил/моделей
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+CACHE_DIR = REPO_ROOT / ".cache" / "reviews"
+SPECS_DIR = REPO_ROOT / ".specify" / "specs-optimized"
+
+# Повышается вручную при изменении формата/логики ревью
+REVIEW_PROMPT_VERSION = 2
+
+# Правила, от которых зависят замечания ревьюера
+REVIEW_RULE_FILES = ("core/development.md", "core/git-workflow.md", "process/testing.md", "process/code-review.md")
+
+REVIEW_EXTENSIONS = (".ts", ".tsx", ".js", ".mjs", ".html", ".scss")
+SKIP_DIRS = {"node_modules", "dist", "coverage", ".git", ".nx", ".angular"}
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def rules_fingerprint(system_message: str) -> str:
+    """Отпечаток промпта ревьюера: версия, системный промпт и файлы правил"""
+    digest = hashlib.sha256(f"{REVIEW_PROMPT_VERSION}\0{system_message}".encode())
+    for name in REVIEW_RULE_FILES:
+        path = SPECS_DIR / name
+        digest.update(name.encode() + b"\0" + (path.read_bytes() if path.exists() else b""))
+    return digest.hexdigest()[:16]
+
+
+def expand_paths(paths: Iterable[str], repo_root: Path = REPO_ROOT) -> List[str]:
+    """Файлы и каталоги → список файлов для ревью (относительно корня репозитория)"""
+    files: List[str] = []
+    for path in paths:
+        full = repo_root / path
+        if full.is_file():
+            files.append(path)
+            continue
+        for dirpath, dirnames, filenames in os.walk(full):
+            dirnames[:] = sorted(d for d in dirnames if d not in SKIP_DIRS)
+            for name in sorted(filenames):
+                if name.endswith(REVIEW_EXTENSIONS) and ".spec." not in name and ".test." not in name:
+                    files.append(os.path.relpath(os.path.join(dirpath, name), repo_root).replace(os.sep, "/"))
+    return list(dict.fromkeys(files))
+
+
+@dataclass
+class ReviewEntry:
+    path: str
+    content_hash: str
+    model: str
+    fingerprint: str
+    findings: str
+    created: float
+
+
+class ReviewCache:
+    """
+    Кэш замечаний ревьюера
+
+    Args:
+        model: Модель ревьюера
+        fingerprint: Отпечаток промпта и правил (см. rules_fingerprint)
+        directory: Каталог кэша (по умолчанию .cache/reviews)
+    """
+
+    def __init__(self, model: str, fingerprint: str, directory: Path = CACHE_DIR):
+        self.model = model
+        self.fingerprint = fingerprint
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, path: str, file_hash: str) -> str:
+        # Путь входит в ключ: он есть в промпте, и замечания ссылаются на него
+        return hashlib.sha256(f"{path}\0{file_hash}\0{self.fingerprint}\0{self.model}".encode()).hexdigest()
+
+    def _file(self, path: str, file_hash: str) -> Path:
+        key = self._key(path, file_hash)
+        return self.directory / key[:2] / f"{key}.json"
+
+    def get(self, path: str, data: bytes) -> Optional[ReviewEntry]:
+        cache_file = self._file(path, content_hash(data))
+        if not cache_file.exists():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return ReviewEntry(**json.loads(cache_file.read_text(encoding="utf-8")))
+
+    def put(self, path: str, data: bytes, findings: str) -> ReviewEntry:
+        file_hash = content_hash(data)
+        entry = ReviewEntry(path, file_hash, self.model, self.fingerprint, findings, time.time())
+        cache_file = self._file(path, file_hash)
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        temporary = cache_file.with_suffix(".tmp")
+        temporary.write_text(json.dumps(asdict(entry), ensure_ascii=False), encoding="utf-8")
+        os.replace(temporary, cache_file)
+        return entry
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+
+def _entries(directory: Path = CACHE_DIR):
+    for cache_file in directory.glob("*/*.json"):
+        try:
+            yield cache_file, json.loads(cache_file.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            yield cache_file, None
+
+
+def invalidate(paths: Iterable[str] = (), model: Optional[str] = None, everything: bool = False,
+               directory: Path = CACHE_DIR) -> int:
+    """
+    Удалить записи кэша
+
+    Args:
+        paths: Файлы или каталоги (префиксы путей)
+        model: Только записи этой модели
+        everything: Удалить все записи
+
+    Returns:
+        Число удаленных записей
+    """
+    prefixes = [p.rstrip("/") for p in paths]
+    if not (everything or prefixes or model):
+        return 0
+    removed = 0
+    for cache_file, entry in _entries(directory):
+        matches = everything or entry is None or (
+            (not prefixes or any(entry["path"] == p or entry["path"].startswith(p + "/") for p in prefixes))
+            and (model is None or entry["model"] == model)
+        )
+        if matches:
+            cache_file.unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+def prune(fingerprint: str, model: str, directory: Path = CACHE_DIR) -> int:
+    """Удалить записи, сделанные с другими правилами или другой моделью"""
+    removed = 0
+    for cache_file, entry in _entries(directory):
+        if entry is None or entry["fingerprint"] != fingerprint or entry["model"] != model:
+            cache_file.unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Кэш результатов code review")
+    parser.add_argument("--stats", action="store_true", help="Показать содержимое кэша")
+    parser.add_argument("--invalidate", nargs="+", metavar="PATH", help="Сбросить файлы/каталоги")
+    parser.add_argument("--model", help="Ограничить сброс моделью")
+    parser.add_argument("--invalidate-all", action="store_true")
+    parser.add_argument("--prune", action="store_true", help="Удалить записи устаревших правил и моделей")
+    args = parser.parse_args()
+
+    if args.invalidate or args.invalidate_all or (args.model and not args.prune):
+        removed = invalidate(args.invalidate or (), args.model, args.invalidate_all)
+        print(f"Удалено записей: {removed}")
+    if args.prune:
+        # Текущие правила берутся из ревьюера cursor_agent
+        from cursor_agent import REVIEW_MODEL, reviewer
+        removed = prune(rules_fingerprint(reviewer.system_message), args.model or REVIEW_MODEL)
+        print(f"Удалено устаревших записей: {removed}")
+    if args.stats:
+        by_model: Dict[str, int] = {}
+        for _, entry in _entries():
+            if entry:
+                key = f"{entry['model']} / правила {entry['fingerprint']}"
+                by_model[key] = by_model.get(key, 0) + 1
+        for key, count in sorted(by_model.items()):
+            print(f"{count:6d}  {key}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""
+Песочница для выполнения кода агентов без Docker
+Сгенерированный код запускается с ограничениями rlimit (CPU-время, память,
+размер файлов, число процессов), на ядрах, не занятых Ollama (sched_setaffinity),
+с пониженным приоритетом и, если доступно, в cgroup v2 с cpu.max / memory.max.
+Ограничения применяет обертка sandbox_exec.py перед exec команды (без preexec_fn)
+
+Ядра Ollama:
+    OLLAMA_CPUS=0-7  — ядра, на которых запущен Ollama (taskset -c 0-7 ollama serve);
+                       по умолчанию считается, что Ollama занимает первую половину ядер
+Ограничения по умолчанию (переопределяются для агента через SandboxLimits):
+    SANDBOX_CPUS, SANDBOX_MEMORY_MB, SANDBOX_CPU_SECONDS, SANDBOX_CGROUP_ROOT
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from hashlib import md5
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Set
+
+from autogen.code_utils import PYTHON_VARIANTS, TIMEOUT_MSG, WORKING_DIR
+
+from tracing import TracedUserProxyAgent, span
+
+DEFAULT_EXEC_TIMEOUT = 600
+
+# Интерпретаторы по языку блока (как в autogen.code_utils, без Windows)
+LANG_COMMANDS = {"bash": "bash", "sh": "sh", "shell": "sh", "javascript": "node"}
+
+
+def parse_cpu_list(value: str) -> Set[int]:
+    """'0-3,8,10-11' → {0, 1, 2, 3, 8, 10, 11}"""
+    cpus: Set[int] = set()
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        cpus.update(range(int(start), int(end or start) + 1))
+    return cpus
+
+
+def ollama_cpus() -> Set[int]:
+    """Ядра, зарезервированные под инференс Ollama"""
+    available = sorted(os.sched_getaffinity(0))
+    if os.getenv("OLLAMA_CPUS"):
+        return parse_cpu_list(os.environ["OLLAMA_CPUS"]) & set(available)
+    return set(available[: len(available) // 2])
+
+
+@dataclass
+class SandboxLimits:
+    """
+    Ограничения для кода одного агента
+
+    Args:
+        cpus: Сколько ядер (вне ядер Ollama) выделить коду
+        memory_mb: Лимит памяти (memory.max в cgroup, иначе RLIMIT_DATA)
+        cpu_seconds: Лимит процессорного времени (RLIMIT_CPU)
+        file_size_mb: Максимальный размер создаваемого файла (RLIMIT_FSIZE)
+        max_processes: Лимит числа процессов пользователя (RLIMIT_NPROC), None — без лимита
+        nice: Прибавка к nice, чтобы инференс имел приоритет
+        cgroup: Использовать cgroup v2, если есть права на SANDBOX_CGROUP_ROOT
+    """
+    cpus: int = int(os.getenv("SANDBOX_CPUS", "2"))
+    memory_mb: int = int(os.getenv("SANDBOX_MEMORY_MB", "2048"))
+    cpu_seconds: int = int(os.getenv("SANDBOX_CPU_SECONDS", "300"))
+    file_size_mb: int = 512
+    max_processes: Optional[int] = None
+    nice: int = 10
+    cgroup: bool = True
+
+    def cpu_set(self) -> List[int]:
+        """Ядра для кода: свободные от Ollama, не больше cpus"""
+        available = sorted(os.sched_getaffinity(0))
+        free = [cpu for cpu in available if cpu not in ollama_cpus()] or available[-1:]
+        return free[-self.cpus:] if self.cpus > 0 else free
+
+
+@dataclass
+class SandboxRun:
+    """Метрики одного запуска"""
+    agent: str
+    lang: str
+    exitcode: int
+    wall_s: float
+    cpu_s: float
+    max_rss_mb: float
+    cpus: List[int] = field(default_factory=list)
+    cgroup: bool = False
+    timed_out: bool = False
+    limit_hit: Optional[str] = None
+
+
+class _CGroup:
+    """Cgroup v2 для одного запуска (нужен делегированный SANDBOX_CGROUP_ROOT)"""
+
+    def __init__(self, limits: SandboxLimits, cpus: List[int]):
+        root = Path(os.getenv("SANDBOX_CGROUP_ROOT", "/sys/fs/cgroup/agent-sandbox"))
+        if not (root / "cgroup.controllers").exists() and not (root.parent / "cgroup.controllers").exists():
+            raise OSError(f"{root}: не cgroup v2")
+        self.path = root / f"run-{os.getpid()}-{threading.get_ident()}-{time.monotonic_ns()}"
+        self.path.mkdir(parents=True)
+        try:
+            self._write("cpu.max", f"{len(cpus) * 100000} 100000")
+            self._write("memory.max", str(limits.memory_mb * 1024 * 1024))
+        except OSError:
+            self.remove()
+            raise
+        if (self.path / "memory.swap.max").exists():
+            self._write("memory.swap.max", "0")
+
+    def _write(self, name: str, value: str):
+        # Файлы создает ядро; если их нет — это не cgroupfs или контроллер не делегирован
+        with open(self.path / name, "r+") as f:
+            f.write(value)
+
+    @classmethod
+    def create(cls, limits: SandboxLimits, cpus: List[int]) -> Optional["_CGroup"]:
+        """Cgroup или None, если cgroup v2 недоступна (тогда работают только rlimit)"""
+        if not limits.cgroup:
+            return None
+        try:
+            return cls(limits, cpus)
+        except OSError:
+            return None
+
+    def memory_exceeded(self) -> bool:
+        try:
+            events = dict(line.split() for line in (self.path / "memory.events").read_text().splitlines())
+        except OSError:
+            return False
+        return int(events.get("oom_kill", 0)) > 0
+
+    def remove(self):
+        try:
+            self.path.rmdir()
+        except OSError:
+            pass
+
+
+EXEC_WRAPPER = Path(__file__).resolve().parent / "sandbox_exec.py"
+
+
+def _wrap(command: List[str], limits: SandboxLimits, cpus: List[int], cgroup: Optional[_CGroup]) -> List[str]:
+    """Команда через обертку sandbox_exec.py, которая применяет ограничения к себе и делает exec"""
+    mb = 1024 * 1024
+    rlimits = [f"CPU={limits.cpu_seconds}:{limits.cpu_seconds + 5}", f"FSIZE={limits.file_size_mb * mb}"]
+    if cgroup is None:
+        rlimits.append(f"DATA={limits.memory_mb * mb}")
+    if limits.max_processes is not None:
+        rlimits.append(f"NPROC={limits.max_processes}")
+    wrapper = [sys.executable, "-I", "-S", str(EXEC_WRAPPER), "--cpus", ",".join(map(str, cpus)),
+               "--nice", str(limits.nice)]
+    if cgroup is not None:
+        wrapper += ["--cgroup", str(cgroup.path)]
+    for rlimit in rlimits:
+        wrapper += ["--rlimit", rlimit]
+    return wrapper + ["--", *command]
+
+
+# Метрики по агентам (аналогично breaker_status / hedge_status); последние
+# SANDBOX_HISTORY запусков, чтобы долгоживущий воркер не копил их без предела
+_runs: Deque[SandboxRun] = deque(maxlen=int(os.getenv("SANDBOX_HISTORY", "1000")))
+_runs_lock = threading.Lock()
+
+
+def sandbox_status() -> Dict[str, Dict[str, Any]]:
+    """Сводка запусков кода по агентам: время, CPU, память, срабатывания лимитов"""
+    with _runs_lock:
+        runs = list(_runs)
+    status: Dict[str, Dict[str, Any]] = {}
+    for run in runs:
+        stats = status.setdefault(run.agent, {"runs": 0, "failed": 0, "timeouts": 0, "limit_hits": 0,
+                                              "wall_s": 0.0, "cpu_s": 0.0, "max_rss_mb": 0.0})
+        stats["runs"] += 1
+        stats["failed"] += run.exitcode != 0
+        stats["timeouts"] += run.timed_out
+        stats["limit_hits"] += run.limit_hit is not None
+        stats["wall_s"] = round(stats["wall_s"] + run.wall_s, 3)
+        stats["cpu_s"] = round(stats["cpu_s"] + run.cpu_s, 3)
+        stats["max_rss_mb"] = max(stats["max_rss_mb"], run.max_rss_mb)
+    return status
+
+
+def sandbox_runs() -> List[Dict[str, Any]]:
+    with _runs_lock:
+        return [asdict(run) for run in _runs]
+
+
+def run_sandboxed(command: List[str], cwd: str, limits: SandboxLimits, timeout: float,
+                  agent: str = "", lang: str = "") -> tuple:
+    """
+    Запустить команду в песочнице
+
+    Returns:
+        (SandboxRun, stdout, stderr)
+    """
+    cpus = limits.cpu_set()
+    cgroup = _CGroup.create(limits, cpus)
+    started = time.monotonic()
+    timed_out = False
+    with tempfile.TemporaryFile() as stdout, tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(_wrap(command, limits, cpus, cgroup), cwd=cwd, stdout=stdout, stderr=stderr,
+                                   stdin=subprocess.DEVNULL, start_new_session=True)
+        # os.wait4 вместо Popen.wait — чтобы получить rusage именно этого процесса
+        while True:
+            pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                break
+            if time.monotonic() - started > timeout:
+                timed_out = True
+                os.killpg(process.pid, signal.SIGKILL)
+                _, status, usage = os.wait4(process.pid, 0)
+                break
+            time.sleep(0.02)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        stdout.seek(0)
+        stderr.seek(0)
+        out = stdout.read().decode("utf-8", errors="replace")
+        err = stderr.read().decode("utf-8", errors="replace")
+
+    limit_hit = None
+    if timed_out:
+        limit_hit = "timeout"
+    elif process.returncode in (-signal.SIGXCPU, -signal.SIGKILL) and usage.ru_utime + usage.ru_stime >= limits.cpu_seconds:
+        limit_hit = "cpu_seconds"
+    elif process.returncode == -signal.SIGXFSZ:
+        limit_hit = "file_size"
+    elif cgroup is not None and cgroup.memory_exceeded():
+        limit_hit = "memory"
+    if cgroup is not None:
+        cgroup.remove()
+
+    run = SandboxRun(
+        agent=agent,
+        lang=lang,
+        exitcode=process.returncode,
+        wall_s=round(time.monotonic() - started, 3),
+        cpu_s=round(usage.ru_utime + usage.ru_stime, 3),
+        max_rss_mb=round(usage.ru_maxrss / 1024, 1),
+        cpus=cpus,
+        cgroup=cgroup is not None,
+        timed_out=timed_out,
+        limit_hit=limit_hit,
+    )
+    with _runs_lock:
+        _runs.append(run)
+    return run, out, err
+
+
+class SandboxedUserProxyAgent(TracedUserProxyAgent):
+    """
+    UserProxyAgent, выполняющий код в песочнице (только при use_docker=False)
+
+    Args:
+        sandbox: Ограничения для кода этого агента (по умолчанию SandboxLimits())
+    """
+
+    def __init__(self, *args, sandbox: Optional[SandboxLimits] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sandbox = sandbox or SandboxLimits()
+
+    def run_code(self, code, **kwargs):
+        if kwargs.get("use_docker"):
+            return super().run_code(code, **kwargs)
+        lang = kwargs.get("lang") or "python"
+        if lang in PYTHON_VARIANTS or lang.startswith("python"):
+            interpreter, extension = sys.executable, "py"
+        elif lang in LANG_COMMANDS:
+            interpreter, extension = LANG_COMMANDS[lang], lang
+        else:
+            return 1, f"unknown language {lang}", None
+
+        work_dir = kwargs.get("work_dir") or WORKING_DIR
+        filename = kwargs.get("filename")
+        temporary = filename is None
+        if temporary:
+            filename = f"tmp_code_{md5(code.encode()).hexdigest()}.{extension}"
+        filepath = os.path.join(work_dir, filename)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, "w", encoding="utf-8") as f:
+            f.write(code)
+
+        with span(f"exec {lang}", "exec", lines=code.count("\n") + 1, sandbox=True) as current:
+            try:
+                run, out, err = run_sandboxed([interpreter, filename], work_dir, self.sandbox,
+                                              kwargs.get("timeout") or DEFAULT_EXEC_TIMEOUT, self.name, lang)
+            finally:
+                if temporary:
+                    os.remove(filepath)
+            current.set(exitcode=run.exitcode, cpu_s=run.cpu_s, max_rss_mb=run.max_rss_mb,
+                        cpus=",".join(map(str, run.cpus)), cgroup=run.cgroup, limit_hit=run.limit_hit)
+
+        if run.timed_out:
+            return 1, TIMEOUT_MSG, None
+        if run.exitcode:
+            logs = err.replace(str(Path(filepath).absolute()), "").replace(filename, "") if temporary else err
+            if run.limit_hit:
+                logs += f"\n[sandbox] превышен лимит: {run.limit_hit}"
+            return run.exitcode, logs, None
+        return 0, out, None
@@ -0,0 +1,59 @@
+"""
+Обертка запуска кода песочницы (см. sandbox.py)
+Применяет к себе cgroup, ядра, nice и rlimit и заменяется командой через exec.
+Заменяет preexec_fn: в многопоточном процессе (воркеры, agent_server) код
+между fork и exec может зависнуть на блокировке, захваченной другим потоком.
+
+Только стандартная библиотека: запускается как python -I -S sandbox_exec.py.
+
+Использование:
+    python sandbox_exec.py --cpus 4,5 --nice 10 --rlimit CPU=300:305 \\
+        --cgroup /sys/fs/cgroup/agent-sandbox/run-1 -- python script.py
+"""
+
+import argparse
+import os
+import resource
+import sys
+
+# Код выхода, если ограничения применить не удалось (как у sh: команда не запущена)
+EXIT_SETUP_FAILED = 126
+
+
+def parse_rlimit(value: str):
+    """'CPU=300:305' → (RLIMIT_CPU, (300, 305))"""
+    name, _, limits = value.partition("=")
+    soft, _, hard = limits.partition(":")
+    return getattr(resource, f"RLIMIT_{name.upper()}"), (int(soft), int(hard or soft))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запуск команды с ограничениями песочницы")
+    parser.add_argument("--cgroup", help="Каталог cgroup v2 для процесса")
+    parser.add_argument("--cpus", help="Ядра через запятую")
+    parser.add_argument("--nice", type=int, default=0)
+    parser.add_argument("--rlimit", action="append", default=[], type=parse_rlimit, metavar="NAME=SOFT[:HARD]")
+    parser.add_argument("command", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        parser.error("не указана команда")
+
+    try:
+        if args.cgroup:
+            with open(os.path.join(args.cgroup, "cgroup.procs"), "w") as procs:
+                procs.write(str(os.getpid()))
+        if args.cpus:
+            os.sched_setaffinity(0, [int(cpu) for cpu in args.cpus.split(",")])
+        if args.nice:
+            os.nice(args.nice)
+        for limit, values in args.rlimit:
+            resource.setrlimit(limit, values)
+        os.execvp(command[0], command)
+    except (OSError, ValueError) as e:
+        print(f"[sandbox] {command[0]}: {e}", file=sys.stderr)
+        sys.exit(EXIT_SETUP_FAILED)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+"""
+Семантический кэш промптов на локальных эмбеддингах
+Почти одинаковые запросы («Создай REST API для users» / «Создай REST API для
+пользователей») точный кэш AutoGen не находит. Здесь первый запрос диалога
+эмбеддится маленькой моделью Ollama (/api/embed), ближайший сосед ищется в
+векторном индексе (numpy в памяти, на диске .npy с mmap), и при сходстве выше
+порога агента кэшированный ответ передается модели как образец для адаптации
+или, если агент явно включил прямые попадания, возвращается как есть
+
+Прямое попадание по умолчанию выключено: для генерации кода высокое сходство
+не значит одинаковый ответ («REST API для users» / «для orders»), и чужой код
+вернулся бы молча. Промпты длиннее контекста модели эмбеддингов не кэшируются:
+обрезанные, они совпали бы по началу
+
+Кэш работает только для агентов из списка разрешенных (SEMANTIC_CACHE_AGENTS):
+агентам, чей ответ зависит от состояния системы (деплой, управление моделями),
+повтор чужого ответа опасен
+
+Использование:
+    python semantic_cache.py --stats
+    python semantic_cache.py --clear [--agent Coder]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import requests
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+CACHE_DIR = REPO_ROOT / ".cache" / "semantic"
+
+ENABLED = os.getenv("SEMANTIC_CACHE", "1") != "0"
+EMBED_MODEL = os.getenv("SEMANTIC_CACHE_MODEL", "nomic-embed-text")
+EMBED_TIMEOUT = 30
+
+MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "500"))
+TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL_DAYS", "7")) * 86400
+
+
+@dataclass
+class AgentPolicy:
+    """
+    Пороги косинусного сходства для агента
+
+    hit: Не ниже — вернуть кэшированный ответ без обращения к модели (None — только адаптация)
+    adapt: Не ниже (но меньше hit) — отдать модели кэшированный ответ как образец
+    """
+    hit: Optional[float] = None
+    adapt: Optional[float] = 0.90
+
+
+# Разрешенные агенты. Формат переменной: "Coder,Architect::0.88,Summarizer:0.97:0.9" —
+# имя без порогов или с пустым hit — только адаптация; hit задается явно (adapt не обязателен)
+DEFAULT_AGENTS = {
+    "Coder": AgentPolicy(adapt=0.90),
+    "FastCoder": AgentPolicy(adapt=0.90),
+    "Architect": AgentPolicy(adapt=0.88),
+}
+
+
+def _parse_agents(value: Optional[str]) -> Dict[str, AgentPolicy]:
+    if not value:
+        return dict(DEFAULT_AGENTS)
+    policies = {}
+    for item in value.split(","):
+        parts = item.strip().split(":")
+        if not parts[0]:
+            continue
+        hit = float(parts[1]) if len(parts) > 1 and parts[1] else None
+        if len(parts) > 2:
+            adapt = float(parts[2])
+        else:
+            adapt = None if hit is not None else AgentPolicy.adapt
+        policies[parts[0]] = AgentPolicy(hit, adapt)
+    return policies
+
+
+AGENTS = _parse_agents(os.getenv("SEMANTIC_CACHE_AGENTS"))
+
+ADAPT_PROMPT = """{prompt}
+
+Ниже ответ на очень похожий запрос «{cached_prompt}». Используй его как образец:
+сохрани то, что подходит, и исправь все, что отличается в текущем запросе.
+
+{answer}"""
+
+
+# ============================================
+# ЭМБЕДДИНГИ
+# ============================================
+
+_session = requests.Session()
+
+
+class PromptTooLong(ValueError):
+    """Текст не помещается в контекст модели эмбеддингов"""
+
+
+def embed(text: str, base_url: str, model: str = EMBED_MODEL) -> np.ndarray:
+    """
+    Нормированный эмбеддинг через Ollama /api/embed (base_url — с /v1 или без)
+
+    Без обрезки (truncate: false): длинный текст — ошибка PromptTooLong,
+    а не вектор его начала
+    """
+    root = base_url.rstrip("/").removesuffix("/v1")
+    response = _session.post(f"{root}/api/embed", json={"model": model, "input": text, "truncate": False},
+                             timeout=EMBED_TIMEOUT)
+    if response.status_code == 400:
+        raise PromptTooLong(response.text[:200])
+    response.raise_for_status()
+    vector = np.asarray(response.json()["embeddings"][0], dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    if not norm:
+        raise ValueError("Пустой эмбеддинг")
+    return vector / norm
+
+
+# ============================================
+# ИНДЕКС
+# ============================================
+
+@dataclass
+class CacheEntry:
+    prompt: str
+    answer: str
+    created: float
+    last_used: float
+    hits: int = 0
+
+
+class SemanticIndex:
+    """
+    Векторный индекс одной области (агент + модель + системный промпт)
+
+    Векторы хранятся в .npy и открываются через mmap; при добавлении матрица
+    копируется в память. Вытеснение — по TTL и LRU при превышении max_entries.
+    """
+
+    def __init__(self, scope: str, directory: Path = CACHE_DIR, max_entries: int = MAX_ENTRIES,
+                 ttl: float = TTL_SECONDS):
+        self.scope = scope
+        self.vectors_file = directory / f"{scope}.npy"
+        self.entries_file = directory / f"{scope}.json"
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.vectors: Optional[np.ndarray] = None
+        self.entries: List[CacheEntry] = []
+        self._load()
+
+    def _load(self):
+        if not (self.vectors_file.exists() and self.entries_file.exists()):
+            return
+        try:
+            vectors = np.load(self.vectors_file, mmap_mode="r")
+            entries = [CacheEntry(**item) for item in json.loads(self.entries_file.read_text(encoding="utf-8"))]
+        except (OSError, ValueError, TypeError):
+            return
+        if len(entries) == vectors.shape[0]:
+            self.vectors, self.entries = vectors, entries
+
+    def _save_locked(self):
+        self.vectors_file.parent.mkdir(parents=True, exist_ok=True)
+        if self.vectors is None or not self.entries:
+            self.vectors_file.unlink(missing_ok=True)
+            self.entries_file.unlink(missing_ok=True)
+            return
+        temporary = self.vectors_file.with_suffix(".tmp")
+        with open(temporary, "wb") as f:
+            np.save(f, np.ascontiguousarray(self.vectors))
+        os.replace(temporary, self.vectors_file)
+        temporary = self.entries_file.with_suffix(".tmp")
+        temporary.write_text(json.dumps([asdict(e) for e in self.entries], ensure_ascii=False), encoding="utf-8")
+        os.replace(temporary, self.entries_file)
+
+    def _keep_locked(self, keep: List[int]):
+        self.entries = [self.entries[i] for i in keep]
+        self.vectors = np.array(self.vectors[keep]) if keep else None
+
+    def search(self, vector: np.ndarray) -> Optional[tuple]:
+        """(сходство, запись) ближайшего соседа или None"""
+        with self.lock:
+            if self.vectors is None or not self.entries or self.vectors.shape[1] != vector.shape[0]:
+                return None
+            scores = self.vectors @ vector
+            best = int(np.argmax(scores))
+            entry = self.entries[best]
+            if time.time() - entry.created > self.ttl:
+                return None
+            return float(scores[best]), entry
+
+    def touch(self, entry: CacheEntry):
+        with self.lock:
+            entry.hits += 1
+            entry.last_used = time.time()
+
+    def add(self, vector: np.ndarray, prompt: str, answer: str) -> int:
+        """Добавить запись; возвращает число вытесненных"""
+        now = time.time()
+        with self.lock:
+            vector = vector.astype(np.float32).reshape(1, -1)
+            if self.vectors is not None and self.vectors.shape[1] != vector.shape[1]:
+                # Сменилась модель эмбеддингов — старые векторы несопоставимы
+                self.vectors, self.entries = None, []
+            self.vectors = vector if self.vectors is None else np.vstack([self.vectors, vector])
+            self.entries.append(CacheEntry(prompt, answer, now, now))
+            fresh = [i for i, e in enumerate(self.entries) if now - e.created <= self.ttl]
+            fresh.sort(key=lambda i: self.entries[i].last_used, reverse=True)
+            keep = sorted(fresh[:self.max_entries])
+            evicted = len(self.entries) - len(keep)
+            if evicted:
+                self._keep_locked(keep)
+            self._save_locked()
+            return evicted
+
+    def clear(self):
+        with self.lock:
+            self.vectors, self.entries = None, []
+            self._save_locked()
+
+
+# ============================================
+# КЭШ ДЛЯ КЛИЕНТА LLM
+# ============================================
+
+@dataclass
+class AgentCacheStats:
+    lookups: int = 0
+    hits: int = 0
+    adapted: int = 0
+    misses: int = 0
+    too_long: int = 0
+    stored: int = 0
+    evicted: int = 0
+    errors: int = 0
+    similarities: List[float] = field(default_factory=list)
+
+
+_indexes: Dict[str, SemanticIndex] = {}
+_stats: Dict[str, AgentCacheStats] = {}
+_lock = threading.Lock()
+
+
+def _index(scope: str) -> SemanticIndex:
+    with _lock:
+        if scope not in _indexes:
+            _indexes[scope] = SemanticIndex(scope)
+        return _indexes[scope]
+
+
+def _agent_stats(agent: str) -> AgentCacheStats:
+    with _lock:
+        return _stats.setdefault(agent, AgentCacheStats())
+
+
+@dataclass
+class Lookup:
+    """Результат поиска для одного запроса клиента LLM"""
+    agent: str
+    index: SemanticIndex
+    vector: np.ndarray
+    prompt: str
+    similarity: float = 0.0
+    answer: Optional[str] = None
+    adapt_messages: Optional[List[Dict[str, Any]]] = None
+
+    def store(self, answer: Optional[str]):
+        """Сохранить ответ модели (для промаха и адаптации)"""
+        if not answer:
+            return
+        evicted = self.index.add(self.vector, self.prompt, answer)
+        stats = _agent_stats(self.agent)
+        stats.stored += 1
+        stats.evicted += evicted
+
+
+def lookup(agent: Optional[str], model: str, base_url: str, params: Dict[str, Any]) -> Optional[Lookup]:
+    """
+    Найти похожий запрос в кэше
+
+    Кэшируется только первый запрос диалога (системный промпт + одно сообщение
+    пользователя) без инструментов: в продолжении диалога сходство последней
+    реплики ничего не говорит о сходстве ответа.
+
+    Returns:
+        None — кэш не применяется; Lookup.answer — готовый ответ;
+        Lookup.adapt_messages — сообщения с образцом для модели
+    """
+    policy = AGENTS.get(agent or "")
+    if not ENABLED or policy is None or params.get("tools") or params.get("response_format"):
+        return None
+    messages = params["messages"]
+    system = [m for m in messages if m.get("role") == "system"]
+    user = [m for m in messages if m.get("role") != "system"]
+    if len(user) != 1 or user[0].get("role") != "user" or not isinstance(user[0].get("content"), str):
+        return None
+
+    stats = _agent_stats(agent)
+    prompt = user[0]["content"]
+    fingerprint = hashlib.sha256(
+        "\0".join([model, EMBED_MODEL, *(str(m.get("content")) for m in system)]).encode()).hexdigest()[:12]
+    index = _index(f"{agent}-{fingerprint}")
+    try:
+        vector = embed(prompt, base_url)
+    except PromptTooLong:
+        stats.too_long += 1
+        return None
+    except (requests.RequestException, ValueError, KeyError, IndexError):
+        stats.errors += 1
+        return None
+
+    stats.lookups += 1
+    result = Lookup(agent, index, vector, prompt)
+    found = index.search(vector)
+    if found is None:
+        stats.misses += 1
+        return result
+    result.similarity, entry = found
+    stats.similarities.append(round(result.similarity, 4))
+    del stats.similarities[:-200]
+    if policy.hit is not None and result.similarity >= policy.hit:
+        stats.hits += 1
+        index.touch(entry)
+        result.answer = entry.answer
+    elif policy.adapt is not None and result.similarity >= policy.adapt:
+        stats.adapted += 1
+        index.touch(entry)
+        result.adapt_messages = system + [{
+            **user[0],
+            "content": ADAPT_PROMPT.format(prompt=prompt, cached_prompt=entry.prompt, answer=entry.answer),
+        }]
+    else:
+        stats.misses += 1
+    return result
+
+
+def semantic_cache_status() -> Dict[str, Dict[str, Any]]:
+    """Доля попаданий и размер индекса по агентам"""
+    with _lock:
+        entries: Dict[str, int] = {}
+        for scope, index in _indexes.items():
+            agent = scope.rsplit("-", 1)[0]
+            entries[agent] = entries.get(agent, 0) + len(index.entries)
+        status = {}
+        for agent, stats in _stats.items():
+            similarities = sorted(stats.similarities)
+            status[agent] = {
+                "lookups": stats.lookups,
+                "hits": stats.hits,
+                "adapted": stats.adapted,
+                "misses": stats.misses,
+                "too_long": stats.too_long,
+                "hit_rate": round(stats.hits / stats.lookups, 3) if stats.lookups else 0.0,
+                "served_rate": round((stats.hits + stats.adapted) / stats.lookups, 3) if stats.lookups else 0.0,
+                "median_similarity": similarities[len(similarities) // 2] if similarities else None,
+                "stored": stats.stored,
+                "evicted": stats.evicted,
+                "errors": stats.errors,
+                "entries": entries.get(agent, 0),
+            }
+        return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Семантический кэш промптов")
+    parser.add_argument("--stats", action="store_true", help="Показать записи на диске")
+    parser.add_argument("--clear", action="store_true", help="Удалить записи")
+    parser.add_argument("--agent", help="Ограничить агентом")
+    args = parser.parse_args()
+
+    for entries_file in sorted(CACHE_DIR.glob("*.json")):
+        scope = entries_file.stem
+        if args.agent and scope.rsplit("-", 1)[0] != args.agent:
+            continue
+        index = SemanticIndex(scope)
+        if args.stats:
+            hits = sum(entry.hits for entry in index.entries)
+            print(f"{len(index.entries):6d} записей  {hits:6d} попаданий  {scope}")
+        if args.clear:
+            index.clear()
+            print(f"Очищено: {scope}")
+
+
+if __name__ == "__main__":
+    main()
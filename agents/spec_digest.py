@@ -0,0 +1,236 @@
+"""
+Дайджесты правил проекта из .specify для системных промптов агентов
+Каждый файл спецификации сжимается маленькой моделью в краткий список правил;
+дайджест кэшируется по хэшу содержимого и пересобирается только при изменении файла
+
+Сборка — отдельный шаг (CLI или scripts/start-cursor-agent.sh): при импорте
+агентов role_context берет только кэш, а для несобранных файлов — извлечение
+правил без модели, поэтому импорт не ждет Ollama
+
+Использование:
+    python spec_digest.py              # собрать/обновить дайджесты, удалить устаревшие
+    python spec_digest.py --role coder # показать контекст для роли
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from llm_client import CircuitOpenError, OllamaModelClient
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SPECS_DIR = REPO_ROOT / ".specify" / "specs-optimized"
+CACHE_DIR = REPO_ROOT / ".cache" / "spec-digests"
+
+DIGEST_MODEL = os.getenv("SPEC_DIGEST_MODEL", "qwen2.5:1.5b")
+DIGEST_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1")
+
+# Меняется при изменении промпта — старые дайджесты перестают совпадать по ключу
+PROMPT_VERSION = 1
+
+DIGEST_PROMPT = """Сожми спецификацию проекта в список правил для разработчика.
+
+Требования:
+- Только проверяемые правила и запреты (что делать / чего не делать), команды и форматы
+- Без вступлений, истории, примеров и пояснений
+- Каждое правило — одна строка, начинается с "- "
+- Не более {max_rules} правил, сохраняй конкретные имена, пути и команды
+- Язык — как в спецификации
+
+Спецификация ({path}):
+
+{text}"""
+
+# Какие спецификации нужны каждой роли (пути относительно SPECS_DIR)
+ROLE_SPECS: Dict[str, List[str]] = {
+    "coder": ["core/development.md"],
+    "tester": ["process/testing.md"],
+    "reviewer": ["core/development.md", "core/git-workflow.md", "process/testing.md", "process/code-review.md"],
+}
+
+MAX_CHUNK_CHARS = 6000
+MAX_RULES_PER_CHUNK = 15
+MAX_EXTRACTIVE_CHARS = 2500
+
+# Строки, которые похожи на правила (для сжатия без модели)
+RULE_LINE = re.compile(r"^\s*(?:[-*]|\d+\.)\s+\S|✅|❌|\b(?:НЕ|MUST|NEVER|ALWAYS|Запрещ|Обязательн)", re.IGNORECASE)
+
+
+@dataclass
+class SpecDigest:
+    path: str
+    source_hash: str
+    model: str
+    digest: str
+    source_chars: int
+
+    @property
+    def ratio(self) -> float:
+        return len(self.digest) / self.source_chars if self.source_chars else 0.0
+
+
+def _cache_key(text: str, model: str) -> str:
+    return hashlib.sha256(f"{PROMPT_VERSION}\0{model}\0{text}".encode()).hexdigest()
+
+
+def _chunks(text: str, max_chars: int = MAX_CHUNK_CHARS) -> List[str]:
+    """Разбить markdown по заголовкам ## на части не длиннее max_chars"""
+    sections = re.split(r"(?m)^(?=##\s)", text)
+    chunks: List[str] = []
+    current = ""
+    for section in sections:
+        if current and len(current) + len(section) > max_chars:
+            chunks.append(current)
+            current = ""
+        while len(section) > max_chars:
+            chunks.append(section[:max_chars])
+            section = section[max_chars:]
+        current += section
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+
+def extractive_digest(text: str, max_chars: int = MAX_EXTRACTIVE_CHARS) -> str:
+    """Сжатие без модели: строки-правила под своими заголовками, без блоков кода"""
+    lines: List[str] = []
+    heading = None
+    in_code = False
+    for line in text.splitlines():
+        if line.strip().startswith("```"):
+            in_code = not in_code
+            continue
+        if in_code or not line.strip():
+            continue
+        if line.startswith("#"):
+            heading = line.rstrip()
+        elif RULE_LINE.search(line):
+            if heading:
+                lines.append(heading)
+                heading = None
+            lines.append(line.rstrip())
+    digest = "\n".join(lines)
+    return digest if len(digest) <= max_chars else digest[:max_chars].rsplit("\n", 1)[0]
+
+
+def _summarize(client: OllamaModelClient, path: str, text: str) -> str:
+    parts = []
+    for chunk in _chunks(text):
+        response = client.create({
+            "messages": [{"role": "user", "content": DIGEST_PROMPT.format(
+                max_rules=MAX_RULES_PER_CHUNK, path=path, text=chunk)}],
+            "temperature": 0,
+        })
+        parts.append((response.choices[0].message.content or "").strip())
+    return "\n".join(part for part in parts if part)
+
+
+def build_digest(path: str, model: str = DIGEST_MODEL, force: bool = False,
+                 client: Optional[OllamaModelClient] = None) -> SpecDigest:
+    """
+    Дайджест одного файла спецификации (из кэша, если файл не менялся)
+
+    Args:
+        path: Путь относительно SPECS_DIR
+        model: Модель для сжатия
+        force: Пересобрать, даже если дайджест есть в кэше
+
+    Если модель недоступна, возвращается извлечение правил без модели
+    (оно не кэшируется — при следующем запуске модель будет вызвана снова).
+    """
+    text = (SPECS_DIR / path).read_text(encoding="utf-8")
+    key = _cache_key(text, model)
+    cache_file = CACHE_DIR / f"{key}.json"
+    if cache_file.exists() and not force:
+        return SpecDigest(**json.loads(cache_file.read_text(encoding="utf-8")))
+
+    client = client or OllamaModelClient({"model": model, "base_url": DIGEST_BASE_URL})
+    try:
+        digest = SpecDigest(path, key, model, _summarize(client, path, text), len(text))
+    except CircuitOpenError as e:
+        print(f"⚠️  Дайджест {path} собран без модели: {str(e)[:120]}")
+        return SpecDigest(path, key, "extractive", extractive_digest(text), len(text))
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    cache_file.write_text(json.dumps(asdict(digest), ensure_ascii=False, indent=2), encoding="utf-8")
+    return digest
+
+
+def cached_digest(path: str, model: str = DIGEST_MODEL) -> SpecDigest:
+    """Дайджест из кэша без вызова модели; если его нет — извлечение правил без модели"""
+    text = (SPECS_DIR / path).read_text(encoding="utf-8")
+    key = _cache_key(text, model)
+    cache_file = CACHE_DIR / f"{key}.json"
+    if cache_file.exists():
+        return SpecDigest(**json.loads(cache_file.read_text(encoding="utf-8")))
+    return SpecDigest(path, key, "extractive", extractive_digest(text), len(text))
+
+
+def prune_cache(directory: Path = CACHE_DIR) -> int:
+    """Удалить дайджесты, не совпадающие с текущим содержимым спецификаций (и версией промпта)"""
+    removed = 0
+    for cache_file in directory.glob("*.json"):
+        try:
+            entry = json.loads(cache_file.read_text(encoding="utf-8"))
+            source = SPECS_DIR / entry["path"]
+            text = source.read_text(encoding="utf-8") if source.exists() else None
+            stale = text is None or _cache_key(text, entry["model"]) != cache_file.stem
+        except (OSError, ValueError, KeyError):
+            stale = True
+        if stale:
+            cache_file.unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+def build_digests(paths: Optional[List[str]] = None, model: str = DIGEST_MODEL,
+                  force: bool = False) -> Dict[str, SpecDigest]:
+    """Дайджесты указанных файлов (по умолчанию — всех, что нужны ролям)"""
+    paths = paths or sorted({path for specs in ROLE_SPECS.values() for path in specs})
+    client = OllamaModelClient({"model": model, "base_url": DIGEST_BASE_URL})
+    return {path: build_digest(path, model, force, client) for path in paths}
+
+
+def role_context(role: str, model: str = DIGEST_MODEL, build: bool = False) -> str:
+    """
+    Блок для системного промпта: дайджесты спецификаций, нужных роли
+
+    По умолчанию модель не вызывается (вызов при импорте модуля агентов
+    блокировал бы импорт на время сжатия): берется кэш, для несобранных
+    файлов — извлечение без модели. build=True — собрать недостающие.
+
+    Пример:
+        system_message = CODER_PROMPT + role_context("coder")
+    """
+    paths = ROLE_SPECS.get(role, [])
+    if not paths or os.getenv("SPEC_DIGEST", "1") == "0":
+        return ""
+    digests = build_digests(paths, model) if build else {path: cached_digest(path, model) for path in paths}
+    sections = [f"### {path}\n{digests[path].digest}" for path in paths if digests[path].digest]
+    return "\n\nПравила проекта (дайджест .specify/specs-optimized):\n\n" + "\n\n".join(sections)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Дайджесты спецификаций .specify для агентов")
+    parser.add_argument("--role", choices=sorted(ROLE_SPECS), help="Показать контекст для роли")
+    parser.add_argument("--model", default=DIGEST_MODEL)
+    parser.add_argument("--force", action="store_true", help="Пересобрать все дайджесты")
+    args = parser.parse_args()
+
+    if args.role:
+        print(role_context(args.role, args.model, build=True))
+        return
+    for path, digest in build_digests(model=args.model, force=args.force).items():
+        print(f"{path}: {digest.source_chars} → {len(digest.digest)} символов "
+              f"({digest.ratio:.0%}, {digest.model})")
+    removed = prune_cache()
+    if removed:
+        print(f"Удалено устаревших дайджестов: {removed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Статическая проверка перед LLM code review
+Инкрементальный tsc и ESLint только по затронутым файлам; если механические
+проверки не прошли, ревью моделью не запускается
+"""
+
+import json
+import os
+import re
+import subprocess
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set
+
+from affected_tests import REPO_ROOT, ProjectGraph, git_changed_files
+
+CACHE_DIR = REPO_ROOT / ".cache" / "static-gate"
+TS_EXTENSIONS = (".ts", ".tsx", ".mts", ".cts")
+LINT_EXTENSIONS = TS_EXTENSIONS + (".js", ".mjs", ".cjs")
+TSCONFIG_NAMES = ("tsconfig.lib.json", "tsconfig.app.json", "tsconfig.json")
+# tsconfig.lib/app.json (и часто tsconfig.json) исключают тесты: для них — tsconfig.spec.json
+SPEC_SUFFIXES = (".spec.ts", ".test.ts", ".spec.tsx", ".test.tsx")
+SPEC_TSCONFIG_NAMES = ("tsconfig.spec.json",)
+
+TSC_DIAGNOSTIC = re.compile(r"^(?P<file>.+?)\((?P<line>\d+),\d+\): (?P<severity>error|warning) (?P<rule>TS\d+): (?P<message>.*)$")
+
+
+@dataclass
+class Finding:
+    tool: str
+    file: str
+    line: int
+    severity: str  # error | warning
+    rule: str
+    message: str
+
+    def __str__(self) -> str:
+        return f"{self.file}:{self.line} [{self.tool} {self.rule}] {self.message}"
+
+
+@dataclass
+class GateResult:
+    files: List[str]
+    findings: List[Finding] = field(default_factory=list)
+    tool_errors: List[str] = field(default_factory=list)
+
+    @property
+    def errors(self) -> List[Finding]:
+        return [f for f in self.findings if f.severity == "error"]
+
+    @property
+    def passed(self) -> bool:
+        """Ошибок нет и все инструменты отработали: непроверенный код проверку не проходит"""
+        return not self.errors and not self.tool_errors
+
+    def to_prompt(self, max_findings: int = 40) -> str:
+        """Результаты проверки для промпта ревьюера или кодера"""
+        if not self.findings and not self.tool_errors:
+            return "Статическая проверка (tsc, ESLint): замечаний нет."
+        lines = [f"Статическая проверка (tsc, ESLint): ошибок {len(self.errors)}, "
+                 f"предупреждений {len(self.findings) - len(self.errors)}"]
+        ordered = sorted(self.findings, key=lambda f: (f.severity != "error", f.file, f.line))
+        lines.extend(f"- {finding}" for finding in ordered[:max_findings])
+        if len(ordered) > max_findings:
+            lines.append(f"- ... и еще {len(ordered) - max_findings}")
+        lines.extend(f"- (не удалось запустить) {error}" for error in self.tool_errors)
+        return "\n".join(lines)
+
+
+def _tsconfig(project_root: str, names: Iterable[str] = TSCONFIG_NAMES) -> Optional[str]:
+    for name in names:
+        if (REPO_ROOT / project_root / name).exists():
+            return f"{project_root}/{name}"
+    return None
+
+
+def _spec_tsconfig(base: str, files: List[str]) -> str:
+    """
+    Конфиг для тестов проекта без tsconfig.spec.json: настройки base,
+    но только переданные тестовые файлы (base их исключает)
+    """
+    path = CACHE_DIR / f"{_slug(base)}.spec.json"
+    path.write_text(json.dumps({
+        "extends": str(REPO_ROOT / base),
+        "compilerOptions": {"types": ["vitest/globals", "node"]},
+        "files": [str(REPO_ROOT / file) for file in sorted(files)],
+        "include": [],
+        "exclude": [],
+    }, indent=2), encoding="utf-8")
+    return path.relative_to(REPO_ROOT).as_posix()
+
+
+def _slug(config: str) -> str:
+    return re.sub(r"[^\w.-]+", "_", config)
+
+
+def run_tsc(files: List[str], graph: ProjectGraph) -> tuple:
+    """
+    Инкрементальная проверка типов проектов, которым принадлежат файлы
+
+    Build info сохраняется в .cache/static-gate, поэтому повторные запуски
+    перепроверяют только изменившееся. В отчет попадают только ошибки в
+    затронутых файлах.
+    """
+    findings: List[Finding] = []
+    tool_errors: List[str] = []
+    touched = set(files)
+    tsconfigs: Set[str] = set()
+    uncovered_specs: Dict[str, List[str]] = {}  # корень проекта → тесты без tsconfig.spec.json
+    for path in files:
+        project = graph.owner(path)
+        if project is None:
+            continue
+        if path.endswith(SPEC_SUFFIXES):
+            config = _tsconfig(project.root, SPEC_TSCONFIG_NAMES)
+            if config is None:
+                uncovered_specs.setdefault(project.root, []).append(path)
+                continue
+        else:
+            config = _tsconfig(project.root)
+        if config:
+            tsconfigs.add(config)
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    for project_root, specs in uncovered_specs.items():
+        base = _tsconfig(project_root, ("tsconfig.json",) + TSCONFIG_NAMES)
+        if base:
+            tsconfigs.add(_spec_tsconfig(base, specs))
+
+    # Build info по конфигу: у кода и тестов одного проекта разные наборы файлов
+    for config in sorted(tsconfigs):
+        command = [
+            "npx", "--no-install", "tsc", "-p", config, "--noEmit", "--incremental",
+            "--tsBuildInfoFile", str(CACHE_DIR / f"{_slug(config)}.tsbuildinfo"), "--pretty", "false",
+        ]
+        try:
+            result = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True, timeout=600)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            tool_errors.append(f"tsc -p {config}: {e}")
+            continue
+        diagnostics = 0
+        for line in result.stdout.splitlines():
+            match = TSC_DIAGNOSTIC.match(line.strip())
+            if not match:
+                continue
+            diagnostics += 1
+            file = os.path.relpath(REPO_ROOT / match["file"], REPO_ROOT).replace(os.sep, "/")
+            if file in touched:
+                findings.append(Finding("tsc", file, int(match["line"]), match["severity"],
+                                        match["rule"], match["message"]))
+        if result.returncode != 0 and not diagnostics:
+            tool_errors.append(f"tsc -p {config}: {(result.stderr or result.stdout).strip()[:300]}")
+    return findings, tool_errors
+
+
+def run_eslint(files: List[str]) -> tuple:
+    """ESLint только по затронутым файлам с постоянным кэшем"""
+    lint_files = [f for f in files if f.endswith(LINT_EXTENSIONS)]
+    if not lint_files:
+        return [], []
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    command = [
+        "npx", "--no-install", "eslint", "--cache", "--cache-location", str(CACHE_DIR / "eslintcache"),
+        "--format", "json", "--no-warn-ignored", *lint_files,
+    ]
+    try:
+        result = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True, timeout=600)
+        if result.returncode not in (0, 1):
+            return [], [f"eslint: {(result.stderr or result.stdout).strip()[:300]}"]
+        reports = json.loads(result.stdout)
+    except (OSError, subprocess.TimeoutExpired, ValueError) as e:
+        return [], [f"eslint: {e}"]
+    findings = []
+    for report in reports:
+        file = os.path.relpath(report["filePath"], REPO_ROOT).replace(os.sep, "/")
+        for message in report.get("messages", []):
+            findings.append(Finding(
+                "eslint", file, message.get("line", 0),
+                "error" if message.get("severity") == 2 else "warning",
+                message.get("ruleId") or "parse", message.get("message", ""),
+            ))
+    return findings, []
+
+
+def run_static_gate(files: Optional[Iterable[str]] = None) -> GateResult:
+    """
+    Запустить tsc и ESLint по затронутым файлам
+
+    Args:
+        files: Файлы относительно корня репозитория (по умолчанию — git status)
+    """
+    files = [f for f in (files if files is not None else git_changed_files())
+             if f.endswith(LINT_EXTENSIONS) and (REPO_ROOT / f).exists()]
+    result = GateResult(files=files)
+    if not files:
+        return result
+    graph = ProjectGraph.load()
+    for findings, tool_errors in (run_tsc([f for f in files if f.endswith(TS_EXTENSIONS)], graph),
+                                  run_eslint(files)):
+        result.findings.extend(findings)
+        result.tool_errors.extend(tool_errors)
+    return result
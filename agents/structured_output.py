@@ -0,0 +1,281 @@
+"""
+Структурированные ответы агентов по JSON-схеме
+Агент объявляет схему ответа; схема уходит в Ollama (response_format с
+json_schema — ограниченное декодирование), ответ проверяется валидатором,
+и следующий шаг получает dict через json.loads вместо разбора прозы и markdown
+
+Использование:
+    reviewer_json = structured_agent(reviewer, REVIEW_SCHEMA)
+    review = ask_structured(reviewer_json, "Проверь код: ...")
+    review["verdict"], review["issues"]
+"""
+
+import copy
+import json
+import re
+from typing import Any, Dict, List, Optional, Union
+
+from autogen import AssistantAgent
+
+from artifacts import CodeBlock, StepArtifact
+
+# ============================================
+# СХЕМЫ
+# ============================================
+
+REVIEW_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "verdict": {"type": "string", "enum": ["approve", "request_changes"]},
+        "summary": {"type": "string"},
+        "issues": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "file": {"type": "string"},
+                    "line": {"type": "integer", "minimum": 0},
+                    "severity": {"type": "string", "enum": ["blocker", "major", "minor"]},
+                    "message": {"type": "string"},
+                    "suggestion": {"type": "string"},
+                },
+                "required": ["severity", "message"],
+            },
+        },
+    },
+    "required": ["verdict", "summary", "issues"],
+}
+
+DEPLOY_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "manifests": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "path": {"type": "string"},
+                    "kind": {"type": "string"},
+                    "content": {"type": "string"},
+                },
+                "required": ["path", "kind", "content"],
+            },
+        },
+        "commands": {"type": "array", "items": {"type": "string"}},
+        "notes": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["manifests", "commands"],
+}
+
+MODEL_PLAN_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "action": {"type": "string", "enum": ["pull", "remove", "keep", "use_alternative"]},
+        "model": {"type": "string"},
+        "required_ram_gb": {"type": "number", "minimum": 0},
+        "required_disk_gb": {"type": "number", "minimum": 0},
+        "commands": {"type": "array", "items": {"type": "string"}},
+        "alternative": {"type": "string"},
+        "reason": {"type": "string"},
+    },
+    "required": ["action", "model", "commands", "reason"],
+}
+
+TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+    "null": type(None),
+}
+
+JSON_FENCE = re.compile(r"^\s*```(?:json)?\s*\n(.*?)\n\s*```\s*$", re.DOTALL)
+
+
+class StructuredOutputError(ValueError):
+    """Ответ не разобрался как JSON или не соответствует схеме"""
+
+    def __init__(self, message: str, errors: Optional[List[str]] = None, raw: str = ""):
+        super().__init__(message)
+        self.errors = errors or []
+        self.raw = raw
+
+
+# ============================================
+# ВАЛИДАЦИЯ
+# ============================================
+
+def validate(instance: Any, schema: Dict[str, Any], path: str = "$") -> List[str]:
+    """
+    Проверить значение по подмножеству JSON Schema
+
+    Поддерживаются type, enum, properties, required, additionalProperties: false,
+    items, minimum/maximum, minItems/maxItems. Этого достаточно для схем агентов.
+
+    Returns:
+        Список ошибок (пустой — значение корректно)
+    """
+    errors: List[str] = []
+    expected = schema.get("type")
+    if expected is not None:
+        names = expected if isinstance(expected, list) else [expected]
+        python_types = tuple(t for name in names for t in (TYPES[name] if isinstance(TYPES[name], tuple)
+                                                           else (TYPES[name],)))
+        # bool — подкласс int, но в JSON это разные типы
+        if not isinstance(instance, python_types) or (isinstance(instance, bool) and "boolean" not in names):
+            return [f"{path}: ожидался {'/'.join(names)}, получен {type(instance).__name__}"]
+    if "enum" in schema and instance not in schema["enum"]:
+        errors.append(f"{path}: {instance!r} не из {schema['enum']}")
+    if isinstance(instance, (int, float)) and not isinstance(instance, bool):
+        if "minimum" in schema and instance < schema["minimum"]:
+            errors.append(f"{path}: {instance} < {schema['minimum']}")
+        if "maximum" in schema and instance > schema["maximum"]:
+            errors.append(f"{path}: {instance} > {schema['maximum']}")
+    if isinstance(instance, dict):
+        properties = schema.get("properties", {})
+        for name in schema.get("required", []):
+            if name not in instance:
+                errors.append(f"{path}: нет обязательного поля {name}")
+        for name, value in instance.items():
+            if name in properties:
+                errors.extend(validate(value, properties[name], f"{path}.{name}"))
+            elif schema.get("additionalProperties") is False:
+                errors.append(f"{path}: лишнее поле {name}")
+    if isinstance(instance, list):
+        if len(instance) < schema.get("minItems", 0):
+            errors.append(f"{path}: элементов меньше {schema['minItems']}")
+        if "maxItems" in schema and len(instance) > schema["maxItems"]:
+            errors.append(f"{path}: элементов больше {schema['maxItems']}")
+        if "items" in schema:
+            for index, item in enumerate(instance):
+                errors.extend(validate(item, schema["items"], f"{path}[{index}]"))
+    return errors
+
+
+def parse_structured(text: str, schema: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Разобрать ответ модели как JSON и проверить по схеме
+
+    Raises:
+        StructuredOutputError: невалидный JSON или несоответствие схеме
+    """
+    fenced = JSON_FENCE.match(text or "")
+    raw = fenced.group(1) if fenced else (text or "")
+    try:
+        data = json.loads(raw)
+    except ValueError as e:
+        raise StructuredOutputError(f"Ответ не JSON: {e}", raw=text) from e
+    errors = validate(data, schema)
+    if errors:
+        raise StructuredOutputError("Ответ не соответствует схеме: " + "; ".join(errors[:5]), errors, text)
+    return data
+
+
+# ============================================
+# АГЕНТЫ
+# ============================================
+
+def schema_llm_config(llm_config: Dict[str, Any], schema: Dict[str, Any], name: str = "reply") -> Dict[str, Any]:
+    """
+    Копия llm_config, запрашивающая ответ по схеме
+
+    Ollama получает response_format {"type": "json_schema", ...} и ограничивает
+    декодирование схемой, так что невалидный JSON не генерируется вовсе.
+    """
+    config = copy.deepcopy(llm_config)
+    response_format = {"type": "json_schema", "json_schema": {"name": name, "schema": schema, "strict": True}}
+    for entry in config.get("config_list") or [config]:
+        entry["response_format"] = response_format
+    return config
+
+
+def structured_agent(agent: AssistantAgent, schema: Dict[str, Any], name: Optional[str] = None) -> AssistantAgent:
+    """
+    Вариант агента, отвечающий JSON по схеме
+
+    Системный промпт и модель те же; к промпту добавляется схема
+    (модели полезно видеть смысл полей, а не только ограничение декодера).
+
+    Args:
+        agent: Исходный агент
+        schema: JSON-схема ответа
+        name: Имя нового агента (по умолчанию <имя>JSON)
+    """
+    name = name or f"{agent.name}JSON"
+    structured = AssistantAgent(
+        name=name,
+        system_message=f"{agent.system_message}\n\nОтвечай только JSON-объектом по схеме:\n"
+                       f"{json.dumps(schema, ensure_ascii=False)}",
+        llm_config=schema_llm_config(agent.llm_config, schema, name),
+        max_consecutive_auto_reply=1,
+    )
+    entries = structured.llm_config.get("config_list") or [structured.llm_config]
+    if any(entry.get("model_client_cls") for entry in entries):
+        # Импорт здесь: llm_client не нужен агентам с обычным OpenAI-клиентом
+        from llm_client import register_ollama_client
+        register_ollama_client(structured)
+    structured.output_schema = schema
+    return structured
+
+
+def single_reply(agent: AssistantAgent, message: str) -> Union[str, Dict[str, Any], None]:
+    """
+    Один ответ модели агента на сообщение, без истории чата
+
+    generate_reply(messages=...) без sender считает ответы в общем счетчике
+    для None, который никто не сбрасывает: после max_consecutive_auto_reply
+    ответ молча становится None. generate_oai_reply счетчик не использует и
+    не трогает историю агента, поэтому безопасен и из нескольких потоков.
+
+    Returns:
+        Текст, сообщение с tool_calls (dict) или None, если клиента нет
+    """
+    _, reply = agent.generate_oai_reply([{"role": "user", "content": message}])
+    return reply
+
+
+def ask_structured(agent: AssistantAgent, message: str, schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Один запрос к агенту со структурированным ответом
+
+    Args:
+        agent: Агент из structured_agent (или любой, если передана schema)
+        message: Задача
+        schema: Схема (по умолчанию — объявленная агентом)
+
+    Returns:
+        Ответ как dict, проверенный по схеме
+
+    Raises:
+        StructuredOutputError: ответ не соответствует схеме (повтор не делается:
+            при ограниченном декодировании это ошибка конфигурации, а не модели)
+    """
+    schema = schema or getattr(agent, "output_schema", None)
+    if schema is None:
+        raise ValueError(f"У агента {agent.name} не объявлена схема ответа")
+    reply = single_reply(agent, message)
+    text = reply if isinstance(reply, str) else (reply or {}).get("content") or ""
+    return parse_structured(text, schema)
+
+
+def review_artifact(review: Dict[str, Any], agent: str) -> StepArtifact:
+    """Ответ по REVIEW_SCHEMA → артефакт шага review"""
+    decisions = [f"verdict: {review['verdict']} — {review['summary']}"]
+    for issue in review["issues"]:
+        location = issue.get("file", "") + (f":{issue['line']}" if issue.get("line") else "")
+        text = " ".join(part for part in (f"[{issue['severity']}]", location, issue["message"]) if part)
+        decisions.append(text + (f" → {issue['suggestion']}" if issue.get("suggestion") else ""))
+    return StepArtifact(step="review", agent=agent, decisions=decisions)
+
+
+def deploy_artifact(deploy: Dict[str, Any], agent: str) -> StepArtifact:
+    """Ответ по DEPLOY_SCHEMA → артефакт шага deploy с файлами манифестов"""
+    blocks = [
+        CodeBlock(lang="dockerfile" if manifest["path"].split("/")[-1].startswith("Dockerfile") else "yaml",
+                  code=manifest["content"], path=manifest["path"])
+        for manifest in deploy["manifests"]
+    ]
+    return StepArtifact(step="deploy", agent=agent, code_blocks=blocks, files=[b.path for b in blocks],
+                        decisions=list(deploy.get("notes", [])) + [f"$ {command}" for command in deploy["commands"]])
@@ -0,0 +1,233 @@
+"""
+Трассировка пайплайна агентов
+Спаны для прогонов (create_feature), чатов initiate_chat, запросов к LLM
+(с load/prompt_eval/eval от Ollama) и выполнения кода; экспорт в формате
+Chrome trace (chrome://tracing, Perfetto) и сводка главных потребителей времени
+"""
+
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from autogen import UserProxyAgent
+
+TRACE_DIR = Path(os.getenv("AGENT_TRACE_DIR", Path(__file__).resolve().parent.parent / ".cache" / "traces"))
+TRACE_ENABLED = os.getenv("AGENT_TRACE", "1") != "0"
+
+# Поля ответа Ollama с длительностями (наносекунды) → имя дочернего спана
+OLLAMA_TIMINGS = (("load_duration", "load"), ("prompt_eval_duration", "prompt_eval"), ("eval_duration", "eval"))
+
+
+@dataclass
+class Span:
+    id: int
+    name: str
+    category: str
+    start: float
+    parent: Optional[int] = None
+    end: Optional[float] = None
+    thread: int = 0
+    args: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def set(self, **args):
+        """Добавить атрибуты спана (токены, код выхода, ошибка и т.д.)"""
+        self.args.update(args)
+
+
+class Trace:
+    """Спаны одного прогона"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = datetime.now()
+        self.origin = time.perf_counter()
+        self.spans: List[Span] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def open(self, name: str, category: str, parent: Optional[int], start: Optional[float] = None,
+             **args) -> Span:
+        with self._lock:
+            span = Span(next(self._ids), name, category, start if start is not None else time.perf_counter(),
+                        parent, thread=threading.get_ident(), args=args)
+            self.spans.append(span)
+        return span
+
+    def to_chrome(self) -> Dict[str, Any]:
+        """События в формате Trace Event (ph: "X" — завершенный спан)"""
+        pid = os.getpid()
+        threads = {span.thread: index for index, span in enumerate(
+            {s.thread: s for s in self.spans}.values())}
+        events = [
+            {"name": "process_name", "ph": "M", "pid": pid, "args": {"name": self.name}},
+            *({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+               "args": {"name": "main" if tid == 0 else f"thread-{tid}"}} for tid in threads.values()),
+        ]
+        for span in self.spans:
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": round((span.start - self.origin) * 1e6, 1),
+                "dur": round(span.duration * 1e6, 1),
+                "pid": pid,
+                "tid": threads[span.thread],
+                "args": {key: value if isinstance(value, (int, float, str, bool, type(None))) else str(value)
+                         for key, value in span.args.items()},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"run": self.name, "started_at": self.started_at.isoformat()}}
+
+    def save(self, directory: Path = TRACE_DIR) -> Path:
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{self.name}-{self.started_at:%Y%m%d-%H%M%S}.json"
+        path.write_text(json.dumps(self.to_chrome(), ensure_ascii=False))
+        return path
+
+    def summary(self, top: int = 10) -> str:
+        """
+        Главные потребители времени
+
+        Время считается «собственным» (без вложенных спанов), поэтому
+        чат не дублирует время своих LLM-запросов и выполнения кода.
+        """
+        children: Dict[Optional[int], float] = {}
+        for span in self.spans:
+            children[span.parent] = children.get(span.parent, 0.0) + span.duration
+        by_key: Dict[tuple, List[float]] = {}
+        by_category: Dict[str, float] = {}
+        for span in self.spans:
+            self_time = max(0.0, span.duration - children.get(span.id, 0.0))
+            stats = by_key.setdefault((span.category, span.name), [0, 0.0])
+            stats[0] += 1
+            stats[1] += self_time
+            by_category[span.category] = by_category.get(span.category, 0.0) + self_time
+
+        roots = [span for span in self.spans if span.parent is None]
+        total = sum(span.duration for span in roots) or 1e-9
+        lines = [f"⏱️  {self.name}: {total:.1f}s, спанов: {len(self.spans)}", "По категориям:"]
+        for category, seconds in sorted(by_category.items(), key=lambda item: -item[1]):
+            lines.append(f"   {category:<12} {seconds:9.2f}s {seconds / total:6.1%}")
+        lines.append(f"Топ-{top}:")
+        ranked = sorted(by_key.items(), key=lambda item: -item[1][1])[:top]
+        for (category, name), (count, seconds) in ranked:
+            lines.append(f"   {seconds:9.2f}s {seconds / total:6.1%}  ×{count:<4} [{category}] {name}")
+        return "\n".join(lines)
+
+
+# Прогон и спан — контекстные переменные: параллельные запросы agent_server
+# (потоки) ведут каждый свою трассу; при раздаче работы в пулы потоков
+# контекст копируется (contextvars.copy_context), и спаны попадают в трассу родителя
+_active: ContextVar[Optional[Trace]] = ContextVar("active_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def active_trace() -> Optional[Trace]:
+    return _active.get()
+
+
+@contextmanager
+def span(name: str, category: str = "step", **args):
+    """
+    Спан внутри активного прогона (без прогона — ничего не делает)
+
+    Пример:
+        with span("qwen2.5:7b", "llm", endpoint=url) as s:
+            ...
+            s.set(completion_tokens=120)
+    """
+    trace = _active.get()
+    if trace is None:
+        yield Span(0, name, category, time.perf_counter())
+        return
+    parent = _current_span.get()
+    current = trace.open(name, category, parent.id if parent else None, **args)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        current.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+@contextmanager
+def trace_run(name: str, save: bool = True, print_summary: bool = True):
+    """
+    Трассировать прогон пайплайна; работает и как декоратор
+
+    По завершении трасса сохраняется в .cache/traces/<name>-<время>.json
+    (AGENT_TRACE_DIR) и печатается сводка. Вложенный прогон становится
+    обычным спаном внешнего. AGENT_TRACE=0 отключает трассировку.
+    """
+    outer = _active.get()
+    if not TRACE_ENABLED or outer is not None:
+        with span(name, "run"):
+            yield outer
+        return
+    trace = Trace(name)
+    token = _active.set(trace)
+    try:
+        with span(name, "run"):
+            yield trace
+    finally:
+        _active.reset(token)
+        if save:
+            path = trace.save()
+        if print_summary:
+            print("\n" + trace.summary())
+            if save:
+                print(f"   Трасса: {path} (chrome://tracing или ui.perfetto.dev)")
+
+
+def record_ollama_timings(parent: Span, data: Dict[str, Any]):
+    """
+    Дочерние спаны load / prompt_eval / eval из длительностей Ollama
+
+    Ollama сообщает только длительности, поэтому спаны выстраиваются
+    последовательно и заканчиваются вместе с запросом.
+    """
+    trace = _active.get()
+    timings = {label: data[key] / 1e9 for key, label in OLLAMA_TIMINGS if data.get(key)}
+    if trace is None or not timings or parent.id == 0:
+        return
+    parent.set(**{f"{label}_s": round(seconds, 3) for label, seconds in timings.items()})
+    end = parent.end if parent.end is not None else time.perf_counter()
+    # Часы Ollama и клиента не совпадают: не выходить за границы родителя
+    scale = min(1.0, (end - parent.start) / sum(timings.values()))
+    start = end - sum(timings.values()) * scale
+    for label, seconds in timings.items():
+        child = trace.open(label, f"llm.{label}", parent.id, start=start)
+        child.end = start + seconds * scale
+        start = child.end
+
+
+class TracedUserProxyAgent(UserProxyAgent):
+    """Пользовательский агент, чьи чаты и выполнение кода попадают в трассу"""
+
+    def initiate_chat(self, recipient, *args, **kwargs):
+        with span(f"{self.name} → {recipient.name}", "chat") as current:
+            result = super().initiate_chat(recipient, *args, **kwargs)
+            current.set(messages=len(getattr(result, "chat_history", []) or []))
+            return result
+
+    def run_code(self, code, **kwargs):
+        lang = kwargs.get("lang") or "code"
+        with span(f"exec {lang}", "exec", lines=code.count("\n") + 1) as current:
+            exitcode, logs, image = super().run_code(code, **kwargs)
+            current.set(exitcode=exitcode)
+            return exitcode, logs, image
@@ -0,0 +1,96 @@
+/**
+ * Долгоживущий Vitest-воркер для agents/affected_tests.py
+ *
+ * Держит прогретый Vite-сервер и граф модулей между запусками.
+ * Протокол: JSON-строки в stdin — {"id", "files": [...], "changed": [...]},
+ * ответы в stdout с префиксом MARKER, остальной вывод игнорируется клиентом.
+ *
+ * Запуск: node agents/vitest_worker.mjs --root <dir> [--config <vitest.config.ts>]
+ */
+import { createInterface } from 'node:readline';
+import { resolve } from 'node:path';
+import { createVitest } from 'vitest/node';
+
+const MARKER = '@@VITEST_WORKER@@ ';
+
+function arg(name) {
+  const index = process.argv.indexOf(`--${name}`);
+  return index === -1 ? undefined : process.argv[index + 1];
+}
+
+function send(message) {
+  process.stdout.write(`${MARKER}${JSON.stringify(message)}\n`);
+}
+
+const root = resolve(arg('root') ?? process.cwd());
+const config = arg('config');
+
+const vitest = await createVitest('test', {
+  root,
+  config: config ? resolve(config) : undefined,
+  watch: false,
+  reporters: [],
+  passWithNoTests: true,
+});
+
+function serializeModule(testModule) {
+  const tests = [];
+  for (const testCase of testModule.children.allTests()) {
+    const result = testCase.result();
+    tests.push({
+      name: testCase.fullName,
+      state: result.state,
+      errors: (result.errors ?? []).map((error) => error.message),
+    });
+  }
+  return {
+    file: testModule.moduleId,
+    state: testModule.state(),
+    errors: testModule.errors().map((error) => error.message),
+    tests,
+  };
+}
+
+async function run(request) {
+  const started = Date.now();
+  for (const file of request.changed ?? []) {
+    vitest.invalidateFile(resolve(root, file));
+  }
+  const files = request.files ?? [];
+  const byFile = await Promise.all(files.map((file) => vitest.getModuleSpecifications(resolve(root, file))));
+  // Файлы, исключенные конфигом (например, Jest-проекты в корневом vitest.config.ts), не запускаются
+  const notRun = files.filter((_, index) => byFile[index].length === 0);
+  const specifications = byFile.flat();
+  const result = specifications.length
+    ? await vitest.runTestSpecifications(specifications, false)
+    : { testModules: [], unhandledErrors: [] };
+  const modules = result.testModules.map(serializeModule);
+  return {
+    id: request.id,
+    // Ни одного запущенного модуля — не успех
+    ok: modules.length > 0 && notRun.length === 0 && result.unhandledErrors.length === 0
+      && modules.every((m) => m.state !== 'failed'),
+    duration_ms: Date.now() - started,
+    modules,
+    not_run: notRun,
+    unhandled_errors: result.unhandledErrors.map((error) => String(error?.message ?? error)),
+  };
+}
+
+send({ ready: true });
+
+const lines = createInterface({ input: process.stdin });
+for await (const line of lines) {
+  if (!line.trim()) {
+    continue;
+  }
+  let request;
+  try {
+    request = JSON.parse(line);
+    send(await run(request));
+  } catch (error) {
+    send({ id: request?.id, ok: false, error: String(error?.stack ?? error), modules: [] });
+  }
+}
+
+await vitest.close();
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Переписывание путей после миграции библиотек (migrate_libs.py).
+
+По плану миграции строится карта «старый путь → новый путь», после чего
+все TS/JS/JSON файлы в apps/, libs/ и корневые конфиги (tsconfig.base.json,
+nx.json, project.json и т.д.) параллельно сканируются и переписываются:
+- пути от корня репозитория (`libs/auth/src/index.ts`, `dist/libs/auth`);
+- относительные пути (`../../libs/auth`, `../../node_modules/...` внутри
+  перенесенной библиотеки, у которой изменилась глубина).
+
+Относительные пути, которые уже указывают на существующий файл, не
+переписываются, поэтому повторный запуск после исправления безопасен.
+
+Файлы обрабатываются построчно, поэтому память ограничена размером строки,
+а в работе одновременно находится не больше нескольких файлов на ядро.
+
+Использование:
+    python migrate_libs.py --plan-out plan.json
+    python migrate_imports.py [--plan plan.json] [--dry-run] [--report changes.jsonl]
+"""
+
+import argparse
+import json
+import os
+import posixpath
+import re
+import sys
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from migrate_libs import LIBS_DIR, Move, build_mapping, find_base_dir
+
+SCAN_DIRS = ["apps", "apps-e2e", "libs", "tools"]
+EXTENSIONS = {".ts", ".tsx", ".mts", ".cts", ".js", ".mjs", ".cjs", ".json"}
+SKIP_DIRS = {"node_modules", "dist", "coverage", "tmp", ".git", ".nx", ".angular", ".cache"}
+
+# Относительный литерал (./x, ../../x) или путь от корня, содержащий libs/
+PATH_PATTERN = re.compile(
+    r"(?P<rel>(?<![\w@/.-])\.{1,2}/[\w@./-]*)"
+    r"|(?P<abs>(?<![\w@.-])" + re.escape(LIBS_DIR) + r"/[\w@./-]+)"
+)
+
+RESOLVE_SUFFIXES = ["", ".ts", ".tsx", ".js", ".json", "/index.ts", "/index.js"]
+
+# Состояние процесса-воркера (заполняется в _init_worker)
+_base_dir = ""
+_moves: List[Move] = []
+_dry_run = False
+
+
+def load_plan(base_dir: Path, plan_file: Optional[Path] = None) -> List[Move]:
+    """
+    Загрузить план миграции
+
+    Args:
+        base_dir: Корень репозитория
+        plan_file: JSON из `migrate_libs.py --plan-out`. Если не задан, план
+            восстанавливается по карте категорий: библиотека считается
+            перенесенной, если старого каталога нет, а новый существует.
+
+    Returns:
+        Список переносов
+    """
+    if plan_file:
+        return [Move(**item) for item in json.loads(plan_file.read_text())]
+    plan = []
+    for lib, target in build_mapping().items():
+        src, dst = f"{LIBS_DIR}/{lib}", f"{LIBS_DIR}/{target}"
+        if not (base_dir / src).exists() and (base_dir / dst).is_dir():
+            plan.append(Move(src=src, dst=dst))
+    return plan
+
+
+def _within(path: str, parent: str) -> bool:
+    return path == parent or path.startswith(parent + "/")
+
+
+def _map_path(path: str, forward: bool = True) -> Tuple[str, bool]:
+    """Отобразить путь через план (самый длинный совпадающий префикс)"""
+    best = None
+    for move in _moves:
+        prefix, target = (move.src, move.dst) if forward else (move.dst, move.src)
+        if _within(path, prefix) and (best is None or len(prefix) > len(best[0])):
+            best = (prefix, target)
+    if best is None:
+        return path, False
+    return best[1] + path[len(best[0]):], True
+
+
+def _exists(rel_path: str) -> bool:
+    """Путь (или модуль без расширения) существует в дереве"""
+    return any(os.path.exists(os.path.join(_base_dir, rel_path + suffix)) for suffix in RESOLVE_SUFFIXES)
+
+
+def _rewrite_rel(literal: str, file_new: str, file_old: str, file_moved: bool) -> str:
+    target_old = posixpath.normpath(posixpath.join(posixpath.dirname(file_old), literal.rstrip("/")))
+    if target_old.startswith(".."):
+        return literal
+    target_new, target_moved = _map_path(target_old)
+    if not target_moved and not file_moved:
+        return literal
+    if file_moved and any(_within(file_old, m.src) and _within(target_old, m.src) for m in _moves):
+        # Файл и цель внутри одной перенесенной библиотеки — путь не меняется
+        return literal
+    current = posixpath.normpath(posixpath.join(posixpath.dirname(file_new), literal.rstrip("/")))
+    if _exists(current) and not _exists(target_new):
+        # Литерал уже указывает на существующий путь (повторный запуск)
+        return literal
+    new_literal = posixpath.relpath(target_new, posixpath.dirname(file_new))
+    if not new_literal.startswith("."):
+        new_literal = "./" + new_literal
+    if literal.endswith("/"):
+        new_literal += "/"
+    return new_literal
+
+
+def rewrite_line(line: str, file_new: str) -> str:
+    """
+    Переписать все пути в строке
+
+    Args:
+        line: Строка файла
+        file_new: Путь файла (после миграции) относительно корня репозитория
+    """
+    file_old, file_moved = _map_path(file_new, forward=False)
+
+    def replace(match: re.Match) -> str:
+        if match.group("rel"):
+            return _rewrite_rel(match.group("rel"), file_new, file_old, file_moved)
+        return _map_path(match.group("abs"))[0]
+
+    return PATH_PATTERN.sub(replace, line)
+
+
+def _init_worker(base_dir: str, moves: List[Move], dry_run: bool):
+    global _base_dir, _moves, _dry_run
+    _base_dir = base_dir
+    _moves = moves
+    _dry_run = dry_run
+
+
+def process_file(base_dir: str, rel_path: str) -> List[Dict]:
+    """
+    Потоково переписать один файл (выполняется в процессе-воркере)
+
+    Returns:
+        Список изменений {file, line, old, new}
+    """
+    changes: List[Dict] = []
+    path = os.path.join(base_dir, rel_path)
+    directory = os.path.dirname(path)
+    tmp = None
+    try:
+        with open(path, encoding="utf-8", newline="") as src:
+            for number, line in enumerate(src, 1):
+                new_line = rewrite_line(line, rel_path)
+                if new_line != line:
+                    changes.append({"file": rel_path, "line": number, "old": line.strip(), "new": new_line.strip()})
+                    if tmp is None and not _dry_run:
+                        # Первое изменение: копируем уже прочитанный префикс
+                        tmp = tempfile.NamedTemporaryFile("w", encoding="utf-8", newline="", dir=directory, delete=False)
+                        with open(path, encoding="utf-8", newline="") as head:
+                            for _ in range(number - 1):
+                                tmp.write(head.readline())
+                if tmp is not None:
+                    tmp.write(new_line)
+    except UnicodeDecodeError:
+        changes = []
+    finally:
+        if tmp is not None:
+            tmp.close()
+            if changes:
+                os.chmod(tmp.name, os.stat(path).st_mode)
+                os.replace(tmp.name, path)
+            else:
+                os.unlink(tmp.name)
+    return changes
+
+
+def iter_files(base_dir: Path, exclude: Iterable[Path] = ()) -> Iterator[str]:
+    """Перебрать файлы для сканирования (пути относительно корня)"""
+    excluded = {path.resolve() for path in exclude}
+    for entry in sorted(base_dir.iterdir()):
+        if entry.is_file() and entry.suffix in EXTENSIONS and entry.resolve() not in excluded:
+            yield entry.name
+    for scan_dir in SCAN_DIRS:
+        for root, dirs, files in os.walk(base_dir / scan_dir):
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+            for name in files:
+                if os.path.splitext(name)[1] in EXTENSIONS:
+                    yield os.path.relpath(os.path.join(root, name), base_dir).replace(os.sep, "/")
+
+
+def rewrite_paths(base_dir: Path, plan: List[Move], dry_run: bool = False,
+                  workers: Optional[int] = None, report=None,
+                  exclude: Iterable[Path] = ()) -> Tuple[int, int]:
+    """
+    Параллельно переписать пути во всех файлах
+
+    Args:
+        base_dir: Корень репозитория
+        plan: План миграции
+        dry_run: Только показать изменения
+        workers: Число процессов (по умолчанию — число ядер)
+        report: Открытый файл для JSONL-отчета об изменениях
+        exclude: Файлы, которые не нужно трогать (сам план, отчет)
+
+    Returns:
+        (число измененных файлов, число измененных строк)
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * 4
+    files_changed = lines_changed = 0
+
+    def collect(done):
+        nonlocal files_changed, lines_changed
+        for future in done:
+            changes = future.result()
+            if changes:
+                files_changed += 1
+                lines_changed += len(changes)
+            for change in changes:
+                print(f"   {change['file']}:{change['line']}: {change['old']}  →  {change['new']}")
+                if report:
+                    report.write(json.dumps(change, ensure_ascii=False) + "\n")
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(str(base_dir), plan, dry_run)) as pool:
+        in_flight = set()
+        for rel_path in iter_files(base_dir, exclude):
+            in_flight.add(pool.submit(process_file, str(base_dir), rel_path))
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+        collect(wait(in_flight).done)
+    return files_changed, lines_changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rewrite import paths and Nx/tsconfig metadata after migrate_libs.py")
+    parser.add_argument("--base", type=Path, help="repository root (default: git toplevel)")
+    parser.add_argument("--plan", type=Path, help="plan JSON written by migrate_libs.py --plan-out")
+    parser.add_argument("--dry-run", action="store_true", help="print changes without writing files")
+    parser.add_argument("--workers", type=int, help="number of worker processes (default: CPU count)")
+    parser.add_argument("--report", type=Path, help="write every change as JSON lines")
+    args = parser.parse_args()
+
+    base_dir = args.base or find_base_dir()
+    plan = load_plan(base_dir, args.plan)
+    if not plan:
+        print("✅ Nothing to rewrite: no migrated libraries found")
+        return
+
+    print(f"🔁 Rewriting paths for {len(plan)} migrated libraries...")
+    report = args.report.open("w", encoding="utf-8") if args.report else None
+    try:
+        files_changed, lines_changed = rewrite_paths(base_dir, plan, args.dry_run, args.workers, report,
+                                                     exclude=[p for p in (args.plan, args.report) if p])
+    finally:
+        if report:
+            report.close()
+
+    prefix = "🔍 Dry run: would change" if args.dry_run else "✅ Changed"
+    print(f"{prefix} {lines_changed} lines in {files_changed} files")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,27 @@
 #!/usr/bin/env python3
-import os
-import shutil
+"""
+Транзакционная миграция библиотек libs/ по декларативной карте.
+
+Сначала строится полный план переносов, затем он проверяется на конфликты,
+после чего все переносы применяются одним обновлением индекса git
+(`git update-index --index-info`). При любой ошибке файловые переносы
+откатываются, индекс остается нетронутым.
+
+Использование:
+    python migrate_libs.py [--base DIR] [--dry-run] [--plan-out plan.json]
+"""
+
+import argparse
+import json
 import subprocess
+import sys
+from dataclasses import asdict, dataclass
 from pathlib import Path
+from typing import Dict, List, Optional
 
-BASE_DIR = Path("/home/ivan/git/workix")
-LIBS_DIR = BASE_DIR / "libs"
+LIBS_DIR = "libs"
 
-# Create category directories
+# Декларативная карта категорий
 categories = {
     "domain": ["auth", "users", "pipelines", "rbac", "webhooks", "workflows", "workers"],
     "infrastructure": ["database", "prisma", "message-broker", "i18n", "notifications", "api-keys", "testing", "service-discovery", "performance"],
@@ -22,89 +36,236 @@ categories = {
     "utilities": ["ab-testing", "billing", "batch-processing", "custom-scripts", "data-validation", "file-storage", "resilience"]
 }
 
-def migrate():
-    print("🚀 Starting migration...")
 
-    # Create domain directories
-    for lib in categories["domain"]:
-        src = LIBS_DIR / lib
-        if src.exists():
-            dst = LIBS_DIR / "domain" / lib
-            dst.parent.mkdir(parents=True, exist_ok=True)
-            print(f"Moving {lib} to domain/{lib}...")
-            try:
-                subprocess.run(["git", "mv", str(src), str(dst)], cwd=BASE_DIR, check=True)
-                print(f"✅ Moved {lib}")
-            except subprocess.CalledProcessError as e:
-                print(f"❌ Failed to move {lib}: {e}")
-
-    # Create infrastructure directories
-    for lib in categories["infrastructure"]:
-        src = LIBS_DIR / lib
-        if src.exists():
-            dst = LIBS_DIR / "infrastructure" / lib
-            dst.parent.mkdir(parents=True, exist_ok=True)
-            print(f"Moving {lib} to infrastructure/{lib}...")
-            try:
-                subprocess.run(["git", "mv", str(src), str(dst)], cwd=BASE_DIR, check=True)
-                print(f"✅ Moved {lib}")
-            except subprocess.CalledProcessError as e:
-                print(f"❌ Failed to move {lib}: {e}")
-
-    # Create integrations directories
-    for category, libs in categories["integrations"].items():
-        if category == "core":
-            for lib in libs:
-                src = LIBS_DIR / lib
-                if src.exists():
-                    dst = LIBS_DIR / "integrations" / "core"
-                    dst.mkdir(parents=True, exist_ok=True)
-                    print(f"Moving {lib} to integrations/core...")
-                    try:
-                        subprocess.run(["git", "mv", str(src), str(dst)], cwd=BASE_DIR, check=True)
-                        print(f"✅ Moved {lib}")
-                    except subprocess.CalledProcessError as e:
-                        print(f"❌ Failed to move {lib}: {e}")
+@dataclass(frozen=True)
+class Move:
+    """Один перенос библиотеки (пути относительно корня репозитория)"""
+    src: str
+    dst: str
+
+
+class MigrationError(Exception):
+    """Ошибка планирования или применения миграции"""
+
+
+def build_mapping(spec: Dict = categories) -> Dict[str, str]:
+    """
+    Развернуть карту категорий в соответствие «библиотека → новый путь»
+
+    Args:
+        spec: Карта категорий в формате `categories`
+
+    Returns:
+        Словарь {имя библиотеки: путь относительно libs/}
+    """
+    mapping: Dict[str, str] = {}
+    for category, libs in spec.items():
+        if isinstance(libs, dict):
+            for group, group_libs in libs.items():
+                for lib in group_libs:
+                    if group == "core":
+                        mapping[lib] = f"{category}/core/{lib}"
+                    else:
+                        mapping[lib] = f"{category}/{group}/{lib.replace('-integration', '')}"
         else:
             for lib in libs:
-                src = LIBS_DIR / lib
-                if src.exists():
-                    dst = LIBS_DIR / "integrations" / category / lib.replace("-integration", "")
-                    dst.parent.mkdir(parents=True, exist_ok=True)
-                    print(f"Moving {lib} to integrations/{category}/{lib.replace('-integration', '')}...")
-                    try:
-                        subprocess.run(["git", "mv", str(src), str(dst)], cwd=BASE_DIR, check=True)
-                        print(f"✅ Moved {lib}")
-                    except subprocess.CalledProcessError as e:
-                        print(f"❌ Failed to move {lib}: {e}")
-
-    # Create AI directories
-    for lib in categories["ai"]:
-        src = LIBS_DIR / lib
-        if src.exists():
-            dst = LIBS_DIR / "ai" / lib
-            dst.parent.mkdir(parents=True, exist_ok=True)
-            print(f"Moving {lib} to ai/{lib}...")
-            try:
-                subprocess.run(["git", "mv", str(src), str(dst)], cwd=BASE_DIR, check=True)
-                print(f"✅ Moved {lib}")
-            except subprocess.CalledProcessError as e:
-                print(f"❌ Failed to move {lib}: {e}")
-
-    # Create utilities directories
-    for lib in categories["utilities"]:
-        src = LIBS_DIR / lib
-        if src.exists():
-            dst = LIBS_DIR / "utilities" / lib
-            dst.parent.mkdir(parents=True, exist_ok=True)
-            print(f"Moving {lib} to utilities/{lib}...")
-            try:
-                subprocess.run(["git", "mv", str(src), str(dst)], cwd=BASE_DIR, check=True)
-                print(f"✅ Moved {lib}")
-            except subprocess.CalledProcessError as e:
-                print(f"❌ Failed to move {lib}: {e}")
-
-    print("✅ Migration complete!")
+                mapping[lib] = f"{category}/{lib}"
+    return mapping
+
+
+def find_base_dir() -> Path:
+    """Определить корень git-репозитория, в котором лежит скрипт"""
+    result = subprocess.run(
+        ["git", "rev-parse", "--show-toplevel"],
+        cwd=Path(__file__).resolve().parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return Path(result.stdout.strip())
+
+
+def build_plan(base_dir: Path, mapping: Optional[Dict[str, str]] = None) -> List[Move]:
+    """
+    Построить план переносов для существующих библиотек
+
+    Args:
+        base_dir: Корень репозитория
+        mapping: Карта «библиотека → путь в libs/» (по умолчанию из `categories`)
+
+    Returns:
+        Список переносов; отсутствующие библиотеки пропускаются
+    """
+    mapping = mapping if mapping is not None else build_mapping()
+    plan: List[Move] = []
+    for lib, target in mapping.items():
+        if (base_dir / LIBS_DIR / lib).is_dir():
+            plan.append(Move(src=f"{LIBS_DIR}/{lib}", dst=f"{LIBS_DIR}/{target}"))
+    return plan
+
+
+def _is_within(path: str, parent: str) -> bool:
+    return path == parent or path.startswith(parent + "/")
+
+
+def _read_index(base_dir: Path, plan: List[Move]) -> List[tuple]:
+    """Прочитать записи индекса для всех источников одним вызовом git"""
+    if not plan:
+        return []
+    result = subprocess.run(
+        ["git", "ls-files", "-s", "-z", "--", *[move.src for move in plan]],
+        cwd=base_dir,
+        capture_output=True,
+        check=True,
+    )
+    entries = []
+    for record in result.stdout.decode("utf-8").split("\0"):
+        if not record:
+            continue
+        meta, path = record.split("\t", 1)
+        mode, sha, stage = meta.split(" ")
+        entries.append((mode, sha, stage, path))
+    return entries
+
+
+def validate_plan(base_dir: Path, plan: List[Move], entries: List[tuple]) -> List[str]:
+    """
+    Проверить план на конфликты до каких-либо изменений
+
+    Returns:
+        Список найденных проблем (пустой, если план корректен)
+    """
+    errors: List[str] = []
+    seen_dst: Dict[str, str] = {}
+    for move in plan:
+        if move.dst in seen_dst:
+            errors.append(f"{move.src} и {seen_dst[move.dst]} переносятся в один путь {move.dst}")
+        seen_dst[move.dst] = move.src
+        if (base_dir / move.dst).exists():
+            errors.append(f"{move.dst} уже существует")
+        if _is_within(move.dst, move.src):
+            errors.append(f"{move.dst} находится внутри переносимой {move.src}")
+        for other in plan:
+            if other is not move and _is_within(move.dst, other.src):
+                errors.append(f"{move.dst} находится внутри переносимой {other.src}")
+
+    tracked = {move.src: 0 for move in plan}
+    for _, _, stage, path in entries:
+        if stage != "0":
+            errors.append(f"{path} в состоянии конфликта слияния")
+        for src in tracked:
+            if _is_within(path, src):
+                tracked[src] += 1
+                break
+    for src, count in tracked.items():
+        if count == 0:
+            errors.append(f"{src} не содержит файлов под контролем git")
+    return errors
+
+
+def _rollback(base_dir: Path, done: List[Move], created_dirs: List[Path]):
+    for move in reversed(done):
+        (base_dir / move.dst).rename(base_dir / move.src)
+    for directory in reversed(created_dirs):
+        try:
+            directory.rmdir()
+        except OSError:
+            pass
+
+
+def apply_plan(base_dir: Path, plan: List[Move], entries: List[tuple]):
+    """
+    Применить план: переносы в файловой системе и одно обновление индекса
+
+    При ошибке переносы откатываются в обратном порядке.
+    """
+    done: List[Move] = []
+    created_dirs: List[Path] = []
+    index_info: List[str] = []
+    for mode, sha, _, path in entries:
+        move = next(m for m in plan if _is_within(path, m.src))
+        new_path = move.dst + path[len(move.src):]
+        index_info.append(f"0 {'0' * 40}\t{path}")
+        index_info.append(f"{mode} {sha} 0\t{new_path}")
+
+    try:
+        for move in plan:
+            parent = (base_dir / move.dst).parent
+            missing = [p for p in [parent, *parent.parents] if not p.exists()]
+            parent.mkdir(parents=True, exist_ok=True)
+            created_dirs.extend(reversed(missing))
+            (base_dir / move.src).rename(base_dir / move.dst)
+            done.append(move)
+
+        subprocess.run(
+            ["git", "update-index", "-z", "--index-info"],
+            cwd=base_dir,
+            input="".join(f"{line}\0" for line in index_info).encode("utf-8"),
+            capture_output=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        _rollback(base_dir, done, created_dirs)
+        detail = e.stderr.decode("utf-8", "replace").strip() if isinstance(e, subprocess.CalledProcessError) else str(e)
+        raise MigrationError(f"Миграция отменена, изменения откачены: {detail}") from e
+
+
+def migrate(base_dir: Optional[Path] = None, dry_run: bool = False, plan_out: Optional[Path] = None) -> List[Move]:
+    """
+    Выполнить миграцию libs/ целиком
+
+    Args:
+        base_dir: Корень репозитория (по умолчанию определяется через git)
+        dry_run: Только показать план, ничего не менять
+        plan_out: Файл для сохранения плана в JSON (используется migrate_imports.py)
+
+    Returns:
+        Примененный (или запланированный) список переносов
+    """
+    base_dir = base_dir or find_base_dir()
+    print("🚀 Starting migration...")
+
+    plan = build_plan(base_dir)
+    if not plan:
+        print("✅ Nothing to migrate")
+        return plan
+
+    for move in plan:
+        print(f"   {move.src} → {move.dst}")
+
+    entries = _read_index(base_dir, plan)
+    errors = validate_plan(base_dir, plan, entries)
+    if errors:
+        for error in errors:
+            print(f"❌ {error}")
+        raise MigrationError(f"План содержит {len(errors)} конфликт(ов), ничего не изменено")
+
+    if plan_out:
+        plan_out.write_text(json.dumps([asdict(move) for move in plan], indent=2) + "\n")
+        print(f"📝 Plan saved to {plan_out}")
+
+    if dry_run:
+        print(f"🔍 Dry run: {len(plan)} libraries, {len(entries)} files would be moved")
+        return plan
+
+    apply_plan(base_dir, plan, entries)
+    print(f"✅ Migration complete! {len(plan)} libraries, {len(entries)} files moved")
+    return plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate libs/ into category directories")
+    parser.add_argument("--base", type=Path, help="repository root (default: git toplevel)")
+    parser.add_argument("--dry-run", action="store_true", help="print the plan without changing anything")
+    parser.add_argument("--plan-out", type=Path, help="write the plan as JSON")
+    args = parser.parse_args()
+
+    try:
+        migrate(args.base, dry_run=args.dry_run, plan_out=args.plan_out)
+    except MigrationError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
 
 if __name__ == "__main__":
-    migrate()
+    main()
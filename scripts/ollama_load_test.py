@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест Ollama: N параллельных клиентов
+
+Режимы подачи запросов:
+- closed: N клиентов, каждый отправляет следующий запрос после ответа;
+- open: запросы приходят по Пуассону с заданной частотой независимо от
+  ответов (задержка считается от запланированного момента, поэтому
+  очередь на стороне клиента тоже попадает в latency).
+
+Размер промпта задается распределением (в словах, ~токенах):
+    fixed:200 | uniform:50-800 | choice:50,200,1000 | normal:300,100
+
+Отчет: throughput, p50/p95/p99 latency и TTFT, доля ошибок — в JSON и
+гистограммой в терминале.
+
+Использование:
+    python scripts/ollama_load_test.py --clients 10 --duration 60
+    python scripts/ollama_load_test.py --mode open --rate 2 --prompt-size uniform:50-800
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+FILLER_WORDS = (
+    "сервис пользователь запрос ответ модуль контроллер репозиторий тест "
+    "service user request response module controller repository test"
+).split()
+
+
+@dataclass
+class RequestResult:
+    """Результат одного запроса"""
+    started: float
+    latency: float
+    ttft: Optional[float]
+    ok: bool
+    prompt_words: int
+    output_chunks: int = 0
+    error: Optional[str] = None
+
+
+def parse_distribution(spec: str, rng: random.Random) -> Callable[[], int]:
+    """
+    Разобрать распределение размера промпта
+
+    Args:
+        spec: fixed:N | uniform:A-B | choice:A,B,C | normal:MEAN,STD
+        rng: Генератор случайных чисел
+
+    Returns:
+        Функция, возвращающая очередной размер промпта в словах
+    """
+    kind, _, value = spec.partition(":")
+    if kind == "fixed":
+        size = int(value)
+        return lambda: size
+    if kind == "uniform":
+        low, high = (int(v) for v in value.split("-"))
+        return lambda: rng.randint(low, high)
+    if kind == "choice":
+        sizes = [int(v) for v in value.split(",")]
+        return lambda: rng.choice(sizes)
+    if kind == "normal":
+        mean, std = (float(v) for v in value.split(","))
+        return lambda: max(1, int(rng.gauss(mean, std)))
+    raise ValueError(f"Неизвестное распределение: {spec}")
+
+
+def make_prompt(words: int, rng: random.Random) -> str:
+    """Сгенерировать промпт примерно заданного размера"""
+    body = " ".join(rng.choice(FILLER_WORDS) for _ in range(words))
+    return f"Кратко перескажи текст одним предложением: {body}"
+
+
+def stream_request(session: requests.Session, base_url: str, api: str, model: str,
+                   prompt: str, max_tokens: int, timeout: float) -> tuple:
+    """
+    Отправить потоковый запрос и замерить время до первого токена
+
+    Returns:
+        (ttft в секундах или None, число полученных чанков)
+    """
+    started = time.perf_counter()
+    ttft = None
+    chunks = 0
+    if api == "native":
+        url = f"{base_url.rstrip('/').removesuffix('/v1')}/api/chat"
+        payload = {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": True,
+            "options": {"num_predict": max_tokens},
+        }
+    else:
+        url = f"{base_url.rstrip('/')}/chat/completions"
+        payload = {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": True,
+            "max_tokens": max_tokens,
+        }
+
+    with session.post(url, json=payload, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        # chunk_size=None: читать чанки по мере прихода (Ollama отдает chunked)
+        for line in response.iter_lines(chunk_size=None):
+            if not line:
+                continue
+            if api == "native":
+                data = json.loads(line)
+                content = data.get("message", {}).get("content")
+            else:
+                text = line.decode("utf-8").removeprefix("data: ")
+                if text == "[DONE]":
+                    break
+                data = json.loads(text)
+                choices = data.get("choices") or [{}]
+                content = choices[0].get("delta", {}).get("content")
+            if content:
+                chunks += 1
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+    return ttft, chunks
+
+
+class LoadTest:
+    """Нагрузочный прогон против одного хоста Ollama"""
+
+    def __init__(self, base_url: str, model: str, api: str = "openai", clients: int = 10,
+                 duration: float = 60.0, mode: str = "closed", rate: float = 1.0,
+                 prompt_size: str = "fixed:200", max_tokens: int = 64,
+                 timeout: float = 300.0, seed: int = 42):
+        self.base_url = base_url
+        self.model = model
+        self.api = api
+        self.clients = clients
+        self.duration = duration
+        self.mode = mode
+        self.rate = rate
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.next_size = parse_distribution(prompt_size, self.rng)
+        self.results: List[RequestResult] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _one(self, scheduled: float):
+        with self._lock:
+            words = self.next_size()
+            prompt = make_prompt(words, self.rng)
+        # Ожидание в клиентской очереди учитывается и в latency, и в TTFT
+        queued = time.perf_counter() - scheduled
+        try:
+            ttft, chunks = stream_request(self._session(), self.base_url, self.api, self.model,
+                                          prompt, self.max_tokens, self.timeout)
+            result = RequestResult(scheduled, time.perf_counter() - scheduled,
+                                   None if ttft is None else queued + ttft, True, words, chunks)
+        except Exception as e:
+            result = RequestResult(scheduled, time.perf_counter() - scheduled, None, False, words,
+                                   error=type(e).__name__)
+        with self._lock:
+            self.results.append(result)
+
+    def _closed_loop(self, deadline: float):
+        def client():
+            while time.perf_counter() < deadline:
+                self._one(time.perf_counter())
+
+        threads = [threading.Thread(target=client, daemon=True) for _ in range(self.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _open_loop(self, deadline: float):
+        with ThreadPoolExecutor(max_workers=self.clients) as pool:
+            next_at = time.perf_counter()
+            while next_at < deadline:
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self._one, next_at)
+                with self._lock:
+                    next_at += self.rng.expovariate(self.rate)
+
+    def run(self) -> Dict:
+        """Провести прогон и вернуть сводку"""
+        started = time.perf_counter()
+        deadline = started + self.duration
+        if self.mode == "open":
+            self._open_loop(deadline)
+        else:
+            self._closed_loop(deadline)
+        return self.summary(time.perf_counter() - started)
+
+    def summary(self, elapsed: float) -> Dict:
+        """Сводные метрики прогона"""
+        ok = [r for r in self.results if r.ok]
+        errors: Dict[str, int] = {}
+        for r in self.results:
+            if not r.ok:
+                errors[r.error] = errors.get(r.error, 0) + 1
+        latencies = sorted(r.latency for r in ok)
+        ttfts = sorted(r.ttft for r in ok if r.ttft is not None)
+        total = len(self.results)
+        return {
+            "config": {
+                "base_url": self.base_url, "model": self.model, "api": self.api,
+                "clients": self.clients, "duration": self.duration, "mode": self.mode,
+                "rate": self.rate if self.mode == "open" else None, "max_tokens": self.max_tokens,
+            },
+            "elapsed_s": round(elapsed, 3),
+            "requests": total,
+            "succeeded": len(ok),
+            "error_rate": round((total - len(ok)) / total, 4) if total else 0.0,
+            "errors": errors,
+            "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+            "output_chunks_per_s": round(sum(r.output_chunks for r in ok) / elapsed, 2) if elapsed else 0.0,
+            "latency_s": percentiles(latencies),
+            "ttft_s": percentiles(ttfts),
+        }
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p95/p99 (по ближайшему рангу) для отсортированного списка"""
+    def pick(q: float) -> Optional[float]:
+        if not values:
+            return None
+        return round(values[min(len(values) - 1, max(0, int(q * len(values) + 0.5) - 1))], 3)
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99),
+            "max": round(values[-1], 3) if values else None}
+
+
+def print_histogram(values: List[float], title: str, bins: int = 12, width: int = 40):
+    """Нарисовать гистограмму в терминале"""
+    print(f"\n📊 {title}")
+    if not values:
+        print("   (нет данных)")
+        return
+    low, high = min(values), max(values)
+    step = (high - low) / bins or 1.0
+    counts = [0] * bins
+    for value in values:
+        counts[min(bins - 1, int((value - low) / step))] += 1
+    peak = max(counts)
+    for i, count in enumerate(counts):
+        bar = "█" * round(count / peak * width) if peak else ""
+        print(f"   {low + i * step:8.2f}s – {low + (i + 1) * step:8.2f}s │{bar} {count}")
+
+
+def build_parser(default_base_url: str, default_model: str, default_api: str) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Concurrent load test for Ollama")
+    parser.add_argument("--base-url", default=default_base_url)
+    parser.add_argument("--model", default=default_model)
+    parser.add_argument("--api", choices=["openai", "native"], default=default_api,
+                        help="openai: /v1/chat/completions, native: /api/chat")
+    parser.add_argument("--clients", type=int, default=10, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=60.0, help="test duration in seconds")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed", help="arrival model")
+    parser.add_argument("--rate", type=float, default=1.0, help="open-loop arrival rate, requests/s")
+    parser.add_argument("--prompt-size", default="fixed:200",
+                        help="fixed:N | uniform:A-B | choice:A,B,C | normal:MEAN,STD (words)")
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json-out", help="write the JSON report to this file")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None, default_base_url: Optional[str] = None,
+         default_model: Optional[str] = None, default_api: str = "openai") -> int:
+    """Точка входа (используется также из test-ollama-connection.py --load)"""
+    parser = build_parser(
+        default_base_url or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1"),
+        default_model or os.getenv("OLLAMA_MODEL", "llama3.1:8b-instruct-q4_K_M"),
+        default_api,
+    )
+    args = parser.parse_args(argv)
+
+    test = LoadTest(args.base_url, args.model, api=args.api, clients=args.clients,
+                    duration=args.duration, mode=args.mode, rate=args.rate,
+                    prompt_size=args.prompt_size, max_tokens=args.max_tokens,
+                    timeout=args.timeout, seed=args.seed)
+
+    print("=" * 60)
+    print(f"🔥 Нагрузочный тест Ollama: {args.clients} клиентов, {args.duration:.0f}s, режим {args.mode}")
+    print(f"   {args.base_url} ({args.api}) · {args.model} · промпт {args.prompt_size}")
+    print("=" * 60)
+
+    report = test.run()
+    print_histogram(sorted(r.latency for r in test.results if r.ok), "Latency")
+    print_histogram(sorted(r.ttft for r in test.results if r.ok and r.ttft is not None), "TTFT")
+    print()
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n📝 Отчет сохранен: {args.json_out}")
+    return 0 if report["succeeded"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,11 @@
 #!/bin/bash
 
 # Запуск Cursor IDE Agent с Ollama
-# Использование: ./scripts/start-cursor-agent.sh
+# Использование: ./scripts/start-cursor-agent.sh [--foreground | --repl]
+#   по умолчанию — фоновый сервер агентов (agents/agent_server.py) с прогретыми
+#   моделями; запросы из Cursor идут через agents/agent_client.py
+#   --foreground — сервер в текущем терминале
+#   --repl       — прежний интерактивный режим (agents/cursor_agent.py)
 
 set -e
 
@@ -37,8 +41,53 @@ export OLLAMA_BASE_URL="http://localhost:11434/v1"
 export OLLAMA_MODEL="llama3.1:8b-instruct-q4_K_M"
 export AUTOGEN_TEMPERATURE="0.7"
 
-# Запуск агента
+export AGENT_SERVER_PORT="${AGENT_SERVER_PORT:-8765}"
+export AGENT_SERVER_URL="${AGENT_SERVER_URL:-http://127.0.0.1:$AGENT_SERVER_PORT}"
+
+if [ "$1" == "--repl" ]; then
+    echo ""
+    echo "🤖 Запуск агента..."
+    echo ""
+    python agents/cursor_agent.py
+    exit 0
+fi
+
+if [ "$1" == "--foreground" ]; then
+    echo ""
+    echo "🤖 Запуск сервера агентов..."
+    exec python agents/agent_server.py --port "$AGENT_SERVER_PORT"
+fi
+
+# Дайджесты правил .specify для промптов агентов: модель вызывается только для
+# измененных спецификаций, импорт агентов берет готовый кэш
+echo ""
+echo "📚 Дайджесты правил .specify..."
+python agents/spec_digest.py || echo "⚠️  Дайджесты не собраны, агенты используют правила без сжатия моделью"
+
+# Сервер агентов (один раз; дальше запросы не платят за импорт и загрузку моделей)
 echo ""
-echo "🤖 Запуск агента..."
+if curl -s "$AGENT_SERVER_URL/health" > /dev/null 2>&1; then
+    echo "✅ Сервер агентов уже запущен: $AGENT_SERVER_URL"
+else
+    echo "🤖 Запуск сервера агентов..."
+    mkdir -p .cache
+    nohup python agents/agent_server.py --port "$AGENT_SERVER_PORT" > .cache/agent-server.log 2>&1 &
+    for _ in $(seq 1 120); do
+        if curl -s "$AGENT_SERVER_URL/health" > /dev/null 2>&1; then
+            break
+        fi
+        sleep 1
+    done
+    if ! curl -s "$AGENT_SERVER_URL/health" > /dev/null 2>&1; then
+        echo "❌ Сервер не ответил за 120s, см. .cache/agent-server.log"
+        exit 1
+    fi
+    echo "✅ Сервер агентов запущен: $AGENT_SERVER_URL (лог: .cache/agent-server.log)"
+fi
+
 echo ""
-python agents/cursor_agent.py
+echo "Использование:"
+echo "  python agents/agent_client.py chat Coder \"Создай DTO для users\""
+echo "  python agents/agent_client.py pipeline static_gate"
+echo "  python agents/agent_client.py status"
+echo "  python agents/agent_client.py stop"
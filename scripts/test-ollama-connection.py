@@ -2,11 +2,16 @@
 """
 Тест подключения к Ollama API
 Проверяет правильность формата запросов
+
+Режим нагрузочного теста (N параллельных клиентов):
+    python scripts/test-ollama-connection.py --load --clients 10 --duration 60
+Остальные параметры см. scripts/ollama_load_test.py --help
 """
 
 import requests
 import json
 import os
+import sys
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -74,6 +79,11 @@ def test_ollama_connection():
         return False
 
 if __name__ == "__main__":
+    if "--load" in sys.argv:
+        from ollama_load_test import main as load_test_main
+        sys.exit(load_test_main([arg for arg in sys.argv[1:] if arg != "--load"],
+                                default_base_url=OLLAMA_BASE_URL, default_model=MODEL))
+
     print("=" * 60)
     print("🧪 Тест подключения Ollama API")
     print("=" * 60)
@@ -1,5 +1,9 @@
 #!/usr/bin/env python3
-"""Тест подключения Ollama и AutoGen"""
+"""Тест подключения Ollama и AutoGen
+
+Нагрузочный тест через нативный API (/api/chat):
+    python scripts/test_ollama_autogen.py --load --clients 10 --duration 60
+"""
 
 import autogen
 import os
@@ -83,6 +87,15 @@ def test_autogen():
 
 
 if __name__ == "__main__":
+    if "--load" in sys.argv:
+        from ollama_load_test import main as load_test_main
+        sys.exit(load_test_main(
+            [arg for arg in sys.argv[1:] if arg != "--load"],
+            default_base_url=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"),
+            default_model=os.getenv("OLLAMA_MODEL", "qwen2.5:7b"),
+            default_api="native",
+        ))
+
     print("="*60)
     print("🔍 Тестирование Ollama и AutoGen")
     print("="*60)